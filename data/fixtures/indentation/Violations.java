@@ -0,0 +1,36 @@
+class Violations {
+    int loop(int a, int b) {
+        while (a > 0
+                && b > 0) {
+                a--; // violation
+            } // violation
+        return a;
+    }
+
+    int branch(int a, int b) {
+      if (a > 0 // violation
+                && b > 0) {
+            a--;
+        } else if (a < 0
+                || b < 0) {
+            a++;
+      } // violation
+        return a + b;
+    }
+
+    int count(int[] values) {
+        int n = 0;
+        for (int i = 0;
+                i < values.length; i++) {
+          n += values[i]; // violation
+        }
+        return n;
+    }
+
+    void sync(Object lock) {
+        synchronized (lock
+                .getClass()) {
+            lock.notify();
+         } // violation
+    }
+}
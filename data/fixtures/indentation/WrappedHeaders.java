@@ -0,0 +1,76 @@
+class WrappedHeaders {
+    int loop(int a, int b) {
+        while (a > 0
+                && b > 0) {
+            a--;
+        }
+        return a;
+    }
+
+    int branch(int a, int b) {
+        if (a > 0
+                && b > 0) {
+            a--;
+        } else if (a < 0
+                || b < 0) {
+            a++;
+        } else {
+            b++;
+        }
+        return a + b;
+    }
+
+    int count(int[] values) {
+        int n = 0;
+        for (int i = 0;
+                i < values.length; i++) {
+            n += values[i];
+        }
+        for (int value
+                : values) {
+            n -= value;
+        }
+        return n;
+    }
+
+    String read(java.io.File file) throws java.io.IOException {
+        try (java.io.BufferedReader reader =
+                new java.io.BufferedReader(new java.io.FileReader(file))) {
+            return reader.readLine();
+        } catch (IllegalStateException
+                | IllegalArgumentException e) {
+            return null;
+        }
+    }
+
+    void sync(Object lock,
+            int a) {
+        synchronized (lock
+                .getClass()) {
+            a++;
+        }
+        switch (a
+                + 1) {
+            case 1:
+                a--;
+                break;
+            default:
+                break;
+        }
+    }
+
+    void ownLine(int a) {
+        while (a > 0)
+        {
+            a--;
+        }
+        try
+        {
+            a++;
+        }
+        finally
+        {
+            a--;
+        }
+    }
+}
@@ -3,6 +3,7 @@
 # See the LICENSE file in the project root for license terms.
 
 from pathlib import Path
+from typing import List, Optional
 from typing_extensions import Annotated
 
 import typer
@@ -14,9 +15,13 @@ from tabulate import tabulate
 import matplotlib.font_manager as fm
 
 from correlation import group_difference
-from data_utils import load_jsons
+from data_utils import load_results
+from set_relations import SetRelations
+from probability_cache import ProbabilityCache
+from incremental import model_key
+from bootstrap import Bootstrap, bootstrap_tables
 from visualization import radar_factory
-from environment import PROJECTS, PERFORMANCE_METRICS
+from environment import PROJECTS, PERFORMANCE_METRICS, SEED
 
 
 app = typer.Typer(add_completion=False, help="Table and plot generation for analysis")
@@ -37,25 +42,31 @@ def plot_radars(
         Path, typer.Argument(exists=True, file_okay=True, readable=True)
     ] = Path("data/output/xgboost_combined.json"),
     save_dir: Annotated[Path, typer.Option()] = Path("data/output/plots/analysis"),
+    results_dir: Annotated[
+        Optional[Path],
+        typer.Option(help="Read the scores from this results store instead of the JSON files"),
+    ] = None,
 ):
     """
     (RQ3) Generate radar charts for performance comparison between models
     """
-    rf_df = load_jsons([rf_baseline_cuf, rf_baseline])
-    xgb_df = load_jsons([xgb_baseline_cuf, xgb_baseline])
+    rf_df = load_results(
+        [rf_baseline_cuf, rf_baseline], columns=PERFORMANCE_METRICS, results_dir=results_dir
+    )
+    xgb_df = load_results(
+        [xgb_baseline_cuf, xgb_baseline], columns=PERFORMANCE_METRICS, results_dir=results_dir
+    )
 
     ours = rf_baseline_cuf.stem.split("_")[-1]
     baseline = rf_baseline.stem.split("_")[-1]
 
     rf = (
-        rf_df.drop(columns=["tp_samples", "pos_samples"])
-        .groupby(["project", "features"])
+        rf_df.groupby(["project", "features"])
         .agg("median")
     )
 
     xgb = (
-        xgb_df.drop(columns=["tp_samples", "pos_samples"])
-        .groupby(["project", "features"])
+        xgb_df.groupby(["project", "features"])
         .agg("median")
     )
 
@@ -190,11 +201,17 @@ def table_performances(
     json2: Annotated[Path, typer.Argument(exists=True, file_okay=True)],
     fmt: Annotated[str, typer.Option()] = "github",
     quiet: Annotated[bool, typer.Option()] = False,
+    results_dir: Annotated[
+        Optional[Path],
+        typer.Option(help="Read the scores from this results store instead of the JSON files"),
+    ] = None,
 ):
     """
     (RQ3) Generate table for performance comparison between models
     """
-    result_df = load_jsons([json1, json2])
+    result_df = load_results(
+        [json1, json2], columns=PERFORMANCE_METRICS, results_dir=results_dir
+    )
     table = []
     features_1 = json1.stem.split("_")[-1]
     features_2 = json2.stem.split("_")[-1]
@@ -233,6 +250,69 @@ def table_performances(
     return output
 
 
+@app.command()
+def table_bootstrap(
+    model: Annotated[str, typer.Argument(help="Model to use: random_forest|xgboost")],
+    feature_sets: Annotated[
+        List[str], typer.Option("--features", help="Feature sets to compare")
+    ] = ["baseline", "cuf", "combined"],
+    n_boot: Annotated[int, typer.Option(help="Number of bootstrap replicates")] = 1000,
+    alpha: Annotated[float, typer.Option(help="1 - confidence level")] = 0.05,
+    threshold: Annotated[float, typer.Option(help="Decision threshold")] = 0.5,
+    seed: Annotated[int, typer.Option()] = SEED,
+    proba_dir: Annotated[Path, typer.Option()] = Path("data/cache/probabilities"),
+    incremental: Annotated[
+        bool, typer.Option(help="Use the probabilities of train-test --incremental")
+    ] = False,
+    fmt: Annotated[str, typer.Option()] = "github",
+    quiet: Annotated[bool, typer.Option()] = False,
+):
+    """
+    (RQ3) Bootstrap confidence intervals and paired tests of performance between feature sets
+    """
+    cache = ProbabilityCache(proba_dir)
+    folds = {
+        features: cache.load(model_key(model, incremental), features)
+        for features in feature_sets
+    }
+    intervals, tests = bootstrap_tables(
+        folds, Bootstrap(n_boot=n_boot, seed=seed), threshold=threshold, alpha=alpha
+    )
+    names = {**PROJECTS, "all": "All"}
+
+    table = []
+    for (project, features), rows in intervals.groupby(["project", "features"], sort=False):
+        rows = rows.set_index("metric")
+        cells = [
+            f"{rows.loc[metric, 'estimate']:.3f} [{rows.loc[metric, 'lower']:.3f}, {rows.loc[metric, 'upper']:.3f}]"
+            for metric in PERFORMANCE_METRICS
+        ]
+        table.append([names[project], features, *cells])
+    output = tabulate(
+        table, headers=["Project", "Features", *PERFORMANCE_METRICS], tablefmt=fmt
+    )
+
+    if len(tests):
+        table = []
+        for (project, features_a, features_b), rows in tests.groupby(
+            ["project", "features_a", "features_b"], sort=False
+        ):
+            rows = rows.set_index("metric")
+            cells = [
+                f"{rows.loc[metric, 'difference']:+.3f} (p={rows.loc[metric, 'p_value']:.3f})"
+                for metric in PERFORMANCE_METRICS
+            ]
+            table.append([names[project], f"{features_a} - {features_b}", *cells])
+        output += "\n\n" + tabulate(
+            table, headers=["Project", "Difference", *PERFORMANCE_METRICS], tablefmt=fmt
+        )
+
+    if not quiet:
+        print(output)
+
+    return output
+
+
 @app.command()
 def table_set_relationships(
     cuf_json: Annotated[Path, typer.Argument(exists=True, file_okay=True)],
@@ -240,59 +320,31 @@ def table_set_relationships(
     fmt: Annotated[str, typer.Option()] = "github",
     only_tp: Annotated[bool, typer.Option()] = True,
     quiet: Annotated[bool, typer.Option()] = False,
+    results_dir: Annotated[
+        Optional[Path],
+        typer.Option(help="Read the scores from this results store instead of the JSON files"),
+    ] = None,
 ):
     """
     (RQ2) Generate table for TPs predicted by baseline model only vs cuf model only
     """
-    result_df = load_jsons([cuf_json, baseline_json])
+    samples = "tp_samples" if only_tp else "pos_samples"
+    result_df = load_results(
+        [cuf_json, baseline_json], columns=[samples], results_dir=results_dir
+    )
     features_1 = cuf_json.stem.split("_")[-1]
     features_2 = baseline_json.stem.split("_")[-1]
+    means = SetRelations(result_df, samples).project_means(features_1, features_2)
+    means = means.reindex(PROJECTS.keys())
     table = []
 
-    for project in PROJECTS:
-        only_1_ratio = []
-        only_2_ratio = []
-        intersection_ratio = []
-
-        for i in range(20):
-            project_df = result_df.loc[
-                (result_df["project"] == project)
-                & (result_df["features"] == features_1)
-                & (result_df["fold"] == i)
-            ]
-            project_df_2 = result_df.loc[
-                (result_df["project"] == project)
-                & (result_df["features"] == features_2)
-                & (result_df["fold"] == i)
-            ]
-
-            if only_tp:
-                samples_1 = set(project_df["tp_samples"].explode())
-                samples_2 = set(project_df_2["tp_samples"].explode())
-            else:
-                samples_1 = set(project_df["pos_samples"].explode())
-                samples_2 = set(project_df_2["pos_samples"].explode())
-
-            if len(samples_1 | samples_2) == 0:
-                continue
-
-            only_1_ratio.append(
-                len(samples_1 - samples_2) / len(samples_1 | samples_2)
-            )
-            only_2_ratio.append(
-                len(samples_2 - samples_1) / len(samples_1 | samples_2)
-            )
-            intersection_ratio.append(
-                len(samples_1 & samples_2) / len(samples_1 | samples_2)
-            )
- 
-
+    for project, row in means.iterrows():
         table.append(
             [
                 PROJECTS[project],
-                round(pd.Series(only_1_ratio).agg("mean") * 100, 1),
-                round(pd.Series(intersection_ratio).agg("mean") * 100, 1),
-                round(pd.Series(only_2_ratio).agg("mean") * 100, 1),
+                round(row["only_a"] * 100, 1),
+                round(row["intersection"] * 100, 1),
+                round(row["only_b"] * 100, 1),
             ]
         )
 
@@ -328,62 +380,26 @@ def plot_set_relationships(
         "data/output/plots/analysis/diff_plot.svg"
     ),
     only_tp: Annotated[bool, typer.Option()] = True,
+    results_dir: Annotated[
+        Optional[Path],
+        typer.Option(help="Read the scores from this results store instead of the JSON files"),
+    ] = None,
 ):
     """
     (RQ2) Generate plots for TPs predicted by baseline model only vs cuf model only
     """
-    result_df = load_jsons([baseline_json, cuf_json])
+    samples = "tp_samples" if only_tp else "pos_samples"
+    result_df = load_results(
+        [baseline_json, cuf_json], columns=[samples], results_dir=results_dir
+    )
     features_1 = baseline_json.stem.split("_")[-1]
     features_2 = cuf_json.stem.split("_")[-1]
-    table = []
-
-    for project in PROJECTS:
-        only_1_ratio = []
-        only_2_ratio = []
-        intersection_ratio = []
-
-        for i in range(20):
-            project_df = result_df.loc[
-                (result_df["project"] == project)
-                & (result_df["features"] == features_1)
-                & (result_df["fold"] == i)
-            ]
-            project_df_2 = result_df.loc[
-                (result_df["project"] == project)
-                & (result_df["features"] == features_2)
-                & (result_df["fold"] == i)
-            ]
-
-          
-            if only_tp:
-                samples_1 = set(project_df["tp_samples"].explode())
-                samples_2 = set(project_df_2["tp_samples"].explode())
-            else:
-                samples_1 = set(project_df["pos_samples"].explode())
-                samples_2 = set(project_df_2["pos_samples"].explode())
-
-            if len(samples_1 | samples_2) == 0:
-                continue
-
-            only_1_ratio.append(
-                len(samples_1 - samples_2) / len(samples_1 | samples_2)
-            )
-            only_2_ratio.append(
-                len(samples_2 - samples_1) / len(samples_1 | samples_2)
-            )
-            intersection_ratio.append(
-                len(samples_1 & samples_2) / len(samples_1 | samples_2)
-            )
- 
-
-        table.append(
-            [
-                PROJECTS[project],
-                pd.Series(only_1_ratio).agg("mean"),
-                pd.Series(intersection_ratio).agg("mean"),
-                pd.Series(only_2_ratio).agg("mean"),
-            ]
-        )
+    means = SetRelations(result_df, samples).project_means(features_1, features_2)
+    means = means.reindex(PROJECTS.keys())
+    table = [
+        [PROJECTS[project], row["only_a"], row["intersection"], row["only_b"]]
+        for project, row in means.iterrows()
+    ]
     df = pd.DataFrame(table, columns=["Project", "Baseline", "Intersection", "cuf"])
 
     # plot stacked barh plot using seaborn
@@ -0,0 +1,172 @@
+# Copyright (c) 2024 Hansae Ju
+# Licensed under the Apache License, Version 2.0
+# See the LICENSE file in the project root for license terms.
+
+from typing import Dict
+
+import numpy as np
+import pandas as pd
+
+from environment import PERFORMANCE_METRICS, SEED
+from probability_cache import FoldProbabilities, confusion_scores, evaluate_folds
+
+
+class Bootstrap:
+    """
+    Bootstrap replicates of the fold scores from cached test probabilities
+
+    Test samples are resampled with replacement within each fold. The resample
+    indices of a batch of replicates are drawn as one (batch, samples) matrix, and
+    the confusion counts of every (replicate, fold) come from one bincount, so all
+    metrics are computed for all replicates at once.
+
+    The indices only depend on the seed and the fold sizes, so two feature sets
+    evaluated on the same folds get the same resamples (paired replicates).
+    """
+
+    def __init__(self, n_boot: int = 1000, seed: int = SEED, batch_size: int = 100) -> None:
+        self.n_boot = n_boot
+        self.seed = seed
+        self.batch_size = batch_size
+
+    def indices(self, group: np.ndarray, rng: np.random.Generator, n: int) -> np.ndarray:
+        """
+        (n, samples) resample indices, each drawn from its own fold's samples
+        """
+        sizes = np.bincount(group)
+        starts = np.concatenate([[0], np.cumsum(sizes)[:-1]])
+        draws = rng.random((n, len(group)))
+        return (starts[group] + (draws * sizes[group]).astype(np.int64)).astype(np.int32)
+
+    def fold_scores(
+        self, folds: FoldProbabilities, threshold: float = 0.5
+    ) -> Dict[str, np.ndarray]:
+        """
+        metric -> (n_boot, n_folds) replicated fold scores
+        """
+        if np.any(np.diff(folds.group) < 0):
+            raise ValueError("Samples must be grouped by fold")
+        rng = np.random.default_rng(self.seed)
+        n_folds = len(folds.keys)
+        y_true, y_pred = folds.y_true, folds.proba > threshold
+        # 0: tn, 1: fp, 2: fn, 3: tp
+        outcome = 2 * y_true.astype(np.int64) + y_pred
+        squared_error = (folds.proba - y_true) ** 2
+
+        batches = []
+        for start in range(0, self.n_boot, self.batch_size):
+            n = min(self.batch_size, self.n_boot - start)
+            indices = self.indices(folds.group, rng, n)
+            # One bin per (replicate, fold)
+            bins = (np.arange(n)[:, None] * n_folds + folds.group[indices]).ravel()
+            confusion = np.bincount(
+                4 * bins + outcome[indices].ravel(), minlength=4 * n * n_folds
+            ).reshape(n, n_folds, 4)
+            counts = {
+                "tn": confusion[..., 0].astype(float),
+                "fp": confusion[..., 1].astype(float),
+                "fn": confusion[..., 2].astype(float),
+                "tp": confusion[..., 3].astype(float),
+                "squared_error": np.bincount(
+                    bins, weights=squared_error[indices].ravel(), minlength=n * n_folds
+                ).reshape(n, n_folds),
+            }
+            batches.append(confusion_scores(**counts))
+        return {
+            metric: np.concatenate([batch[metric] for batch in batches])
+            for metric in PERFORMANCE_METRICS
+        }
+
+
+def project_means(
+    folds: FoldProbabilities, scores: Dict[str, np.ndarray]
+) -> Dict[str, pd.DataFrame]:
+    """
+    metric -> (replicates x projects) fold means, with an "all" column over every fold
+    """
+    projects = folds.keys["project"].unique()
+    means = {}
+    for metric, values in scores.items():
+        columns = {
+            project: np.nanmean(values[:, (folds.keys["project"] == project).values], axis=1)
+            for project in projects
+        }
+        columns["all"] = np.nanmean(values, axis=1)
+        means[metric] = pd.DataFrame(columns)
+    return means
+
+
+def confidence_interval(replicates: pd.DataFrame, alpha: float = 0.05) -> pd.DataFrame:
+    """
+    Percentile interval of each column
+    """
+    return pd.DataFrame(
+        {
+            "lower": replicates.quantile(alpha / 2),
+            "upper": replicates.quantile(1 - alpha / 2),
+        }
+    )
+
+
+def paired_test(
+    replicates_a: pd.DataFrame, replicates_b: pd.DataFrame, alpha: float = 0.05
+) -> pd.DataFrame:
+    """
+    Paired bootstrap test of a - b for each column: percentile interval of the
+    difference and the two-sided p-value of a zero difference
+    """
+    difference = replicates_a - replicates_b
+    p_value = 2 * np.minimum((difference <= 0).mean(), (difference >= 0).mean())
+    result = confidence_interval(difference, alpha)
+    result.insert(0, "difference", difference.mean())
+    result["p_value"] = np.minimum(p_value, 1.0)
+    return result
+
+
+def bootstrap_tables(
+    folds: Dict[str, FoldProbabilities],
+    bootstrap: Bootstrap,
+    threshold: float = 0.5,
+    alpha: float = 0.05,
+) -> tuple[pd.DataFrame, pd.DataFrame]:
+    """
+    Confidence intervals of each feature set and paired tests of every pair of them
+
+    `folds` maps a feature set to its probabilities, all on the same test folds.
+    """
+    names = list(folds)
+    reference = folds[names[0]]
+    for name in names[1:]:
+        if not np.array_equal(folds[name].commit_id, reference.commit_id):
+            raise ValueError(
+                f"{name} was not evaluated on the same test samples as {names[0]}"
+            )
+
+    replicates = {
+        name: project_means(probabilities, bootstrap.fold_scores(probabilities, threshold))
+        for name, probabilities in folds.items()
+    }
+
+    intervals = []
+    for name in names:
+        observed = evaluate_folds(folds[name], threshold)
+        estimates = observed.groupby("project", sort=False)[PERFORMANCE_METRICS].mean()
+        estimates.loc["all"] = observed[PERFORMANCE_METRICS].mean()
+        for metric in PERFORMANCE_METRICS:
+            interval = confidence_interval(replicates[name][metric], alpha)
+            interval.insert(0, "estimate", estimates[metric])
+            intervals.append(interval.assign(features=name, metric=metric))
+    intervals = pd.concat(intervals).rename_axis("project").reset_index()
+
+    tests = []
+    for i, name_a in enumerate(names):
+        for name_b in names[i + 1 :]:
+            for metric in PERFORMANCE_METRICS:
+                test = paired_test(
+                    replicates[name_a][metric], replicates[name_b][metric], alpha
+                )
+                tests.append(
+                    test.assign(features_a=name_a, features_b=name_b, metric=metric)
+                )
+    tests = pd.concat(tests).rename_axis("project").reset_index() if tests else pd.DataFrame()
+    return intervals, tests
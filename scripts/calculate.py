@@ -2,7 +2,10 @@
 # Licensed under the Apache License, Version 2.0
 # See the LICENSE file in the project root for license terms.
 
+from concurrent.futures import ProcessPoolExecutor
+from functools import partial
 from pathlib import Path
+from tempfile import TemporaryDirectory
 from typing import List
 from typing_extensions import Annotated
 
@@ -10,8 +13,19 @@ import pandas as pd
 from typer import Typer, Argument, Option
 from rich.progress import track
 
-from neurojit.commit import Mining
+from neurojit.commit import Mining, clone_repo
+from neurojit.kamei import REFERENCE_COLUMNS, compare_with_reference, kamei_metrics
 from neurojit.cuf.metrics import CommitUnderstandabilityFeatures
+from neurojit.cuf.rii import (
+    CheckstyleError,
+    IndentationStore,
+    check_checkstyle,
+    native_indentation_errors,
+    require_conformance,
+    run_checkstyle,
+)
+
+from journal import Journal, Watermarks, processed_rows
 
 app = Typer(add_completion=False, help="Calculate metrics for CUF and Baseline")
 
@@ -30,41 +44,129 @@ def cuf_all(
     checkstyle_cache_dir: Annotated[
         str, Option(help="Path to checkstyle cache")
     ] = "data/cache/checkstyle",
+    engine: Annotated[
+        str, Option(help="Indentation engine for II: checkstyle|native")
+    ] = "checkstyle",
+    max_concurrency: Annotated[
+        int, Option(help="Maximum number of concurrent Checkstyle processes")
+    ] = 4,
+    checkpoint: Annotated[
+        int, Option(help="Materialize the CSV every N journaled commits")
+    ] = 1000,
+    workers: Annotated[
+        int, Option(help="Number of worker processes")
+    ] = 1,
+    incremental: Annotated[
+        bool, Option(help="Add commits listed since the last run to the existing output")
+    ] = False,
 ):
     """
     Calculate all CUF for a project
     """
+    if engine == "native":
+        require_conformance(checkstyle_cache_dir, checkstyle_path, xml_path)
+    else:
+        check_checkstyle(checkstyle_path, xml_path)
     save_path = save_dir / f"{project}.csv"
     Path(save_path).parent.mkdir(exist_ok=True, parents=True)
+    commits_csv = Path(f"data/dataset/commits/{project}.csv")
+    watermarks = Watermarks(save_dir / ".watermarks.json")
+    journal = Journal(save_path, every=checkpoint)
+    compute = partial(
+        cuf_record,
+        checkstyle_path=checkstyle_path,
+        xml_path=xml_path,
+        checkstyle_cache_dir=checkstyle_cache_dir,
+        engine=engine,
+        max_concurrency=max_concurrency,
+    )
+
     if not Path(save_path).exists():
-        df = pd.read_csv(f"data/dataset/commits/{project}.csv", index_col="commit_id")
-        assert df[df["target"] == "not_yet"].shape[0] == 0
-        df = df[df["target"] == "yes"]
+        commits = pd.read_csv(commits_csv, index_col="commit_id")
+        assert commits[commits["target"] == "not_yet"].shape[0] == 0
+        df = commits[commits["target"] == "yes"]
+    elif incremental:
+        # Add the commits past the watermark; rows not done (errors of earlier runs
+        # included) are computed again below
+        df = pd.read_csv(save_path, index_col="commit_id")
+        commits = pd.read_csv(commits_csv, index_col="commit_id")
+        start = watermarks.position(project, commits.index)
+        if start is None:
+            start = processed_rows(commits.index, save_path)
+        new = commits.iloc[start:]
+        assert new[new["target"] == "not_yet"].shape[0] == 0
+        new = new[(new["target"] == "yes") & ~new.index.isin(df.index)]
+        df = pd.concat([df, new])
     else:
+        commits = None
         df = pd.read_csv(save_path, index_col="commit_id")
 
-    for commit_id, row in track(
-        df.iterrows(),
+    df = journal.replay(df)
+
+    todo = [
+        (commit_id, row["project"])
+        for commit_id, row in df.iterrows()
+        if row["target"] != "done"
+    ]
+    for commit_id, record in track(
+        compute_records(compute, todo, workers),
         f"Computing cuf for {project}...",
-        total=df.shape[0],
+        total=len(todo),
         disable=quiet,
     ):
-        if row["target"] == "done":
-            continue
-        commit = Mining.load("data/cache", row["project"], commit_id)
-        if commit is None:
-            df.loc[commit_id, "target"] = "error"
-            df.to_csv(save_path)
-            continue
-        cuf = CommitUnderstandabilityFeatures(commit, checkstyle_path, xml_path, checkstyle_cache_dir)
-        cufs = cuf.all
-        for metric, value in cufs.items():
-            df.loc[commit_id, metric] = value
+        for column, value in record.items():
+            df.loc[commit_id, column] = value
+        journal.append(commit_id, **record)
+        journal.checkpoint(df)
 
-        df.loc[commit_id, "target"] = "done"
-        df.to_csv(save_path)
+    journal.materialize(df)
+    if commits is not None:
+        watermarks.update(project, commits.index)
 
-    df.to_csv(save_path)
+
+def compute_records(compute, todo: list, workers: int = 1):
+    """
+    Yield compute(commit) for each commit in order, on a process pool if workers > 1
+    """
+    if workers <= 1:
+        yield from map(compute, todo)
+        return
+    with ProcessPoolExecutor(max_workers=workers) as executor:
+        # Executor.map yields in submission order, so the output does not depend on workers
+        yield from executor.map(compute, todo, chunksize=8)
+
+
+def cuf_record(
+    commit: tuple[str, str],
+    checkstyle_path: str,
+    xml_path: str,
+    checkstyle_cache_dir: str,
+    engine: str,
+    max_concurrency: int,
+) -> tuple[str, dict]:
+    """
+    CUF of a cached commit with its status. Failures on the commit become an `error`
+    status; Checkstyle failing to run at all stops the run.
+    """
+    commit_id, project = commit
+    try:
+        method_changes_commit = Mining.load("data/cache", project, commit_id)
+        if method_changes_commit is None:
+            return commit_id, {"target": "error"}
+        cuf = CommitUnderstandabilityFeatures(
+            method_changes_commit,
+            checkstyle_path,
+            xml_path,
+            checkstyle_cache_dir,
+            engine=engine,
+            max_concurrency=max_concurrency,
+        )
+        return commit_id, {**cuf.all, "target": "done"}
+    except CheckstyleError:
+        raise
+    except Exception as e:
+        print(f"{commit_id}: {e}")
+        return commit_id, {"target": "error"}
 
 
 @app.command()
@@ -84,10 +186,23 @@ def cuf_metrics(
     checkstyle_cache_dir: Annotated[
         str, Option(help="Path to checkstyle cache")
     ] = "data/cache/checkstyle",
+    engine: Annotated[
+        str, Option(help="Indentation engine for II: checkstyle|native")
+    ] = "checkstyle",
+    max_concurrency: Annotated[
+        int, Option(help="Maximum number of concurrent Checkstyle processes")
+    ] = 4,
+    checkpoint: Annotated[
+        int, Option(help="Materialize the CSV every N journaled commits")
+    ] = 1000,
 ):
     """
     Calculate specific CUF metrics for a project
     """
+    if engine == "native":
+        require_conformance(checkstyle_cache_dir, checkstyle_path, xml_path)
+    else:
+        check_checkstyle(checkstyle_path, xml_path)
     save_path = save_dir / f"{project}.csv"
     Path(save_path).parent.mkdir(exist_ok=True, parents=True)
     if not Path(save_path).exists():
@@ -101,68 +216,291 @@ def cuf_metrics(
         if metric not in df.columns:
             df[metric] = None
 
+    journal = Journal(save_path, every=checkpoint)
+    records = journal.records()
+    df = journal.replay(df)
+
+    # Commits journaled with every requested metric by an interrupted run
+    done = {
+        commit_id
+        for commit_id, record in records.items()
+        if all(metric in record for metric in metrics)
+    }
+    todo = df[~df.index.isin(done)]
+
     for commit_id, row in track(
-        df.iterrows(),
+        todo.iterrows(),
         f"Computing CUF {', '.join(metrics)} for {project}...",
-        total=df.shape[0],
+        total=todo.shape[0],
         disable=quiet,
     ):
         commit = Mining.load("data/cache", row["project"], commit_id)
         if commit is None:
             continue
-        cuf = CommitUnderstandabilityFeatures(commit, checkstyle_path, xml_path, checkstyle_cache_dir)
+        cuf = CommitUnderstandabilityFeatures(
+            commit,
+            checkstyle_path,
+            xml_path,
+            checkstyle_cache_dir,
+            engine=engine,
+            max_concurrency=max_concurrency,
+        )
 
-        for metric in metrics:
-            value = getattr(cuf, metric)
+        values = {metric: getattr(cuf, metric) for metric in metrics}
+        for metric, value in values.items():
             df.loc[commit_id, metric] = value
-        df.to_csv(save_path)
-    df.to_csv(save_path)
+        journal.append(commit_id, **values)
+        journal.checkpoint(df)
+    journal.materialize(df)
+
+
+@app.command()
+def ii_conformance(
+    project: Annotated[str, Argument(..., help="activemq|camel|cassandra|flink|groovy|hbase|hive|ignite")],
+    sample: Annotated[int, Option(help="Number of commits to sample")] = 100,
+    seed: Annotated[int, Option(help="Random seed for sampling")] = 42,
+    checkstyle_path: Annotated[
+        str, Option(help="Path to checkstyle jar")
+    ] = "checkstyle.jar",
+    xml_path: Annotated[
+        str, Option(help="Path to checkstyle xml config")
+    ] = "indentation_config.xml",
+    checkstyle_cache_dir: Annotated[
+        str, Option(help="Path to checkstyle cache")
+    ] = "data/cache/checkstyle",
+    fixtures_dir: Annotated[
+        Path, Option(help="Java files marking each expected violation with `// violation`")
+    ] = Path("data/fixtures/indentation"),
+    min_agreement: Annotated[
+        float, Option(help="Method agreement rate the native engine needs to be used")
+    ] = 0.99,
+    quiet: Annotated[bool, Option(help="Disable progress bar")] = False,
+):
+    """
+    Compare the native II engine with Checkstyle on fixtures and sampled methods of a project
+    """
+    fixtures = 0
+    fixtures_matched = 0
+    mismatches = []
+    for java_file in sorted(fixtures_dir.glob("*.java")):
+        code = java_file.read_text()
+        marked = {
+            line
+            for line, text in enumerate(code.split("\n"), start=1)
+            if text.rstrip().endswith("// violation")
+        }
+        checkstyle = set(run_checkstyle(java_file, checkstyle_path, xml_path))
+        native = set(native_indentation_errors(code))
+        if checkstyle != marked:
+            print(
+                f"{java_file.name}: Checkstyle differs from the markers "
+                f"on lines {sorted(checkstyle ^ marked)}"
+            )
+
+        fixtures += 1
+        if native == checkstyle:
+            fixtures_matched += 1
+        else:
+            mismatches.append((java_file.name, "", sorted(native ^ checkstyle)))
+
+    df = pd.read_csv(f"data/dataset/commits/{project}.csv", index_col="commit_id")
+    df = df[df["target"] == "yes"]
+    df = df.sample(n=min(sample, df.shape[0]), random_state=seed)
+
+    methods = 0
+    matched = 0
+    with TemporaryDirectory() as tmp_dir:
+        for commit_id, row in track(
+            df.iterrows(),
+            f"Checking II conformance for {project}...",
+            total=df.shape[0],
+            disable=quiet,
+        ):
+            commit = Mining.load("data/cache", row["project"], commit_id)
+            if commit is None:
+                continue
+            checked = {}
+            for method in commit.methods_after:
+                if method.code not in checked:
+                    java_file = Path(tmp_dir) / f"{len(checked)}.java"
+                    java_file.write_text(method.code)
+                    checked[method.code] = set(
+                        run_checkstyle(java_file, checkstyle_path, xml_path)
+                    )
+                lines = set(range(method.start_line, method.end_line + 1))
+                expected = checked[method.code] & lines
+                actual = set(native_indentation_errors(method.code)) & lines
+
+                methods += 1
+                if expected == actual:
+                    matched += 1
+                else:
+                    mismatches.append(
+                        (commit_id[:7], method.signature, sorted(expected ^ actual))
+                    )
+
+    for name, signature, lines in mismatches:
+        print(f"{name} {signature}: lines {lines}")
+    for name, checked, agreed in [
+        ("fixtures", fixtures, fixtures_matched),
+        ("methods", methods, matched),
+    ]:
+        print(f"{agreed}/{checked} {name} conform ({agreed / max(checked, 1) * 100:.1f}%)")
+
+    # The native engine refuses to run until this run agrees closely enough with Checkstyle
+    store = IndentationStore(checkstyle_cache_dir)
+    store.put_conformance(
+        store.config_key(checkstyle_path, xml_path, "native"),
+        project,
+        (fixtures, fixtures_matched),
+        (methods, matched),
+        min_agreement,
+    )
 
 
 @app.command()
 def LT(
     project: Annotated[str, Argument(..., help="activemq|camel|cassandra|flink|groovy|hbase|hive|ignite")],
     save_dir: Annotated[Path, Option()] = Path("data/dataset/baseline"),
-    quiet: Annotated[bool, Option(help="Disable progress bar")] = False,
+    baseline_csv: Annotated[
+        Path, Option(help="Path to apachejit_metrics(baseline)")
+    ] = Path("data/dataset/baseline.csv"),
+    quiet: Annotated[bool, Option(help="Disable summary output")] = False,
+    incremental: Annotated[
+        bool, Option(help="Add commits listed since the last run to the existing output")
+    ] = False,
 ):
     """
     Calculate LT for apachejit_metrics(baseline)
     """
     save_path = save_dir / f"{project}.csv"
-
     Path(save_path).parent.mkdir(exist_ok=True, parents=True)
+    watermarks = Watermarks(save_dir / ".watermarks.json")
+    journal = Journal(save_path)
+
+    baseline = None
     if not Path(save_path).exists():
-        df = pd.read_csv("data/dataset/baseline.csv", index_col="commit_id")
-        df = df[df["project"] == project]
+        baseline = project_baseline(baseline_csv, project)
+        df = baseline.copy()
         df["target"] = "not_yet"
+    elif incremental:
+        # Add the baseline rows past the watermark; rows not done (errors of earlier
+        # runs included) are computed again below
+        df = pd.read_csv(save_path, index_col="commit_id")
+        baseline = project_baseline(baseline_csv, project)
+        start = watermarks.position(project, baseline.index)
+        if start is None:
+            start = processed_rows(baseline.index, save_path)
+        new = baseline.iloc[start:]
+        new = new[~new.index.isin(df.index)].assign(target="not_yet")
+        df = pd.concat([df, new])
     else:
         df = pd.read_csv(save_path, index_col="commit_id")
 
-    for commit_id, row in track(
-        df.iterrows(),
-        f"Computing KAMEI for {project}...",
-        total=df.shape[0],
-        disable=quiet,
-    ):
-        if row["target"] == "done":
-            continue
-        commit = Mining.load("data/cache", row["project"], commit_id)
-        if commit is None:
-            df.loc[commit_id, "target"] = "error"
-            df.to_csv(save_path)
-            continue
+    # Records of an interrupted run of the former per-commit loop
+    df = journal.replay(df)
+    found = lt_values(df, project)
+    journal.materialize(df)
+    if baseline is not None:
+        watermarks.update(project, baseline.index)
+
+    if not quiet:
+        print(f"LT of {project}: {found.sum()} done, {(~found).sum()} without method cache")
+
+    return str(save_path)
+
+
+def project_baseline(baseline_csv: Path, project: str) -> pd.DataFrame:
+    df = pd.read_csv(baseline_csv, index_col="commit_id")
+    return df[df["project"] == project]
+
 
-        before_code_files = {method.code for method in commit.methods_before}
-        lt = sum(len(code.splitlines()) for code in before_code_files)
+def lt_values(df: pd.DataFrame, project: str):
+    """
+    LT of the commits of `df` not done yet, from the change statistics sidecar of
+    the method cache. Returns whether each of them was found.
+    """
+    todo = df.index[df["target"] != "done"]
+    stats = Mining.commit_stats("data/cache", project, todo)
+    found = stats["LT"].notna().values
+
+    df.loc[todo[found], "LT"] = stats["LT"].values[found].astype(int)
+    df.loc[todo[found], "target"] = "done"
+    df.loc[todo[~found], "target"] = "error"
+    return found
+
+
+@app.command()
+def kamei(
+    project: Annotated[str, Argument(..., help="activemq|camel|cassandra|flink|groovy|hbase|hive|ignite")],
+    save_dir: Annotated[Path, Option()] = Path("data/dataset/kamei"),
+    repo_dir: Annotated[Path, Option(help="Path to the cloned repositories")] = Path(
+        "data/repo"
+    ),
+    all_commits: Annotated[
+        bool, Option(help="Keep every commit instead of only those in baseline.csv")
+    ] = False,
+):
+    """
+    Calculate all Kamei metrics for a project in one pass over its git history
+    """
+    save_path = save_dir / f"{project}.csv"
+    Path(save_path).parent.mkdir(exist_ok=True, parents=True)
 
-        df.loc[commit_id, "LT"] = lt
-        df.loc[commit_id, "target"] = "done"
-        df.to_csv(save_path)
+    commit_hashes = None
+    if not all_commits:
+        baseline = pd.read_csv("data/dataset/baseline.csv", usecols=["commit_id", "project"])
+        commit_hashes = set(baseline.loc[baseline["project"] == project, "commit_id"])
 
+    repo_path = clone_repo(project, str(repo_dir))
+    df = kamei_metrics(repo_path, commit_hashes)
     df.to_csv(save_path)
+    print(f"Saved {df.shape[0]} commits to {save_path}")
 
     return str(save_path)
 
 
+@app.command()
+def kamei_check(
+    project: Annotated[str, Argument(..., help="activemq|camel|cassandra|flink|groovy|hbase|hive|ignite")],
+    reference_csv: Annotated[
+        Path, Option(help="ApacheJIT Kamei metrics to compare with")
+    ] = Path("data/dataset/apache_metrics_kamei.csv"),
+    repo_dir: Annotated[Path, Option(help="Path to the cloned repositories")] = Path(
+        "data/repo"
+    ),
+    sample: Annotated[int, Option(help="Number of commits to sample")] = 500,
+    seed: Annotated[int, Option(help="Random seed for sampling")] = 42,
+    rtol: Annotated[float, Option(help="Relative tolerance of a matching value")] = 1e-3,
+    min_agreement: Annotated[
+        float, Option(help="Agreement rate every metric needs for the check to pass")
+    ] = 0.9,
+):
+    """
+    Compare the native Kamei metrics with the ApacheJIT reference on sampled commits
+    """
+    baseline = pd.read_csv("data/dataset/baseline.csv", usecols=["commit_id", "project"])
+    commit_ids = baseline.loc[baseline["project"] == project, "commit_id"]
+    commit_ids = commit_ids.sample(n=min(sample, commit_ids.shape[0]), random_state=seed)
+
+    reference = pd.read_csv(
+        reference_csv,
+        usecols=lambda column: column == "commit_id" or column in REFERENCE_COLUMNS,
+        index_col="commit_id",
+    )
+    reference = reference[reference.index.isin(commit_ids)]
+
+    repo_path = clone_repo(project, str(repo_dir))
+    # The state still comes from the whole history, only the sampled rows are kept
+    metrics = kamei_metrics(repo_path, set(commit_ids))
+    agreement = compare_with_reference(metrics, reference, rtol)
+    print(agreement.to_string(float_format="{:.3f}".format))
+
+    failed = agreement.index[~(agreement["agreement"] >= min_agreement)].to_list()
+    if failed:
+        print(f"Below {min_agreement:.0%} agreement: {', '.join(failed)}")
+        raise SystemExit(1)
+
+
 if __name__ == "__main__":
     app()
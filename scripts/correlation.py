@@ -2,12 +2,19 @@
 # Licensed under the Apache License, Version 2.0
 # See the LICENSE file in the project root for license terms.
 
+import json
+import hashlib
+from concurrent.futures import ProcessPoolExecutor
+from pathlib import Path
+from typing import Optional
+
 import numpy as np
 import pandas as pd
-
+import sklearn
+import statsmodels
 import statsmodels.api as sm
-from cliffs_delta import cliffs_delta
-from scipy.stats import ranksums, spearmanr, mannwhitneyu
+from scipy.special import ndtr
+from scipy.stats import rankdata, spearmanr, mannwhitneyu
 from sklearn.preprocessing import StandardScaler
 from sklearn.ensemble import RandomForestClassifier
 
@@ -15,18 +22,26 @@ from sklearn.ensemble import RandomForestClassifier
 SEED = 42
 np.random.seed(SEED)
 
+# Cliff's delta thresholds (Hess and Kromrey, 2004), as in the cliffs_delta package
+CLIFFS_THRESHOLDS = {"small": 0.147, "medium": 0.33, "large": 0.474}
+
+
+def standardize(X: pd.DataFrame) -> pd.DataFrame:
+    scaled_X = StandardScaler().fit_transform(X)
+    return pd.DataFrame(scaled_X, columns=X.columns, index=X.index)
 
-def correlation(X, y, metrics, method):
+
+def correlation(X, y, metrics, method, scaled=False):
+    """
+    scaled: X is already standardized (StandardScaler is per column, so any column
+    subset of a standardized matrix is the standardized subset)
+    """
     results = {}
     try:
         match method:
             case "logistic_regression":
                 X_selected = X[metrics]
-                scaler = StandardScaler()
-                scaled_X = scaler.fit_transform(X_selected)
-                scaled_X_df = pd.DataFrame(
-                    scaled_X, columns=X_selected.columns, index=X_selected.index
-                )
+                scaled_X_df = X_selected if scaled else standardize(X_selected)
 
                 X_const = sm.add_constant(scaled_X_df)
 
@@ -66,11 +81,7 @@ def correlation(X, y, metrics, method):
 
             case "random_forest":
                 X_selected = X[metrics]
-                scaler = StandardScaler()
-                scaled_X = scaler.fit_transform(X_selected)
-                scaled_X_df = pd.DataFrame(
-                    scaled_X, columns=X_selected.columns, index=X_selected.index
-                )
+                scaled_X_df = X_selected if scaled else standardize(X_selected)
 
                 rf = RandomForestClassifier(n_estimators=100, random_state=SEED)
                 rf.fit(scaled_X_df, y)
@@ -88,9 +99,74 @@ def correlation(X, y, metrics, method):
         print(metrics)
 
 
+def group_differences(x1, x2):
+    """
+    Wilcoxon rank-sum p-values and Cliff's deltas of x1 vs x2, column by column
+
+    Both come from the rank sum of x1 in the pooled sample, so every column is sorted
+    once: with mid-ranks for ties, #(x1 > x2) - #(x1 < x2) = 2 * R1 - n1 * (n1 + 1) - n1 * n2.
+    Results equal scipy.stats.ranksums and cliffs_delta.cliffs_delta. NaNs are dropped
+    column by column; a column with an empty group gets NaN.
+    """
+    x1 = np.asarray(x1, dtype=float)
+    x2 = np.asarray(x2, dtype=float)
+    single = x1.ndim == 1
+    if single:
+        x1, x2 = x1[:, None], x2[:, None]
+
+    missing = np.isnan(x1).any(axis=0) | np.isnan(x2).any(axis=0)
+    p_values = np.full(x1.shape[1], np.nan)
+    deltas = np.full(x1.shape[1], np.nan)
+    if len(x1) and len(x2):
+        p_values[~missing], deltas[~missing] = _rank_differences(
+            x1[:, ~missing], x2[:, ~missing]
+        )
+    for column in np.flatnonzero(missing):
+        a = x1[~np.isnan(x1[:, column]), column]
+        b = x2[~np.isnan(x2[:, column]), column]
+        if len(a) and len(b):
+            (p_values[column],), (deltas[column],) = _rank_differences(a[:, None], b[:, None])
+
+    if single:
+        return p_values[0], deltas[0]
+    return p_values, deltas
+
+
+def _rank_differences(x1: np.ndarray, x2: np.ndarray) -> tuple[np.ndarray, np.ndarray]:
+    n1, n2 = len(x1), len(x2)
+    ranks = rankdata(np.concatenate([x1, x2]), axis=0)
+    # Mid-ranks are multiples of 1/2, so the doubled rank sums are exact integers
+    doubled_sum = (2 * ranks[:n1]).sum(axis=0).astype(np.int64)
+    rank_sum = doubled_sum / 2
+
+    expected = n1 * (n1 + n2 + 1) / 2.0
+    z = (rank_sum - expected) / np.sqrt(n1 * n2 * (n1 + n2 + 1) / 12.0)
+    p_values = 2 * ndtr(-np.abs(z))
+    deltas = (doubled_sum - n1 * (n1 + 1) - n1 * n2) / (n1 * n2)
+    return p_values, deltas
+
+
+def cliffs_size(delta: float) -> str:
+    delta = abs(delta)
+    if delta < CLIFFS_THRESHOLDS["small"]:
+        return "negligible"
+    if delta < CLIFFS_THRESHOLDS["medium"]:
+        return "small"
+    if delta < CLIFFS_THRESHOLDS["large"]:
+        return "medium"
+    return "large"
+
+
 def group_difference(x1, x2, fmt="str"):
-    p = ranksums(x1, x2).pvalue
-    d, size = cliffs_delta(x1, x2)
+    p, d = group_differences(x1, x2)
+    return format_difference(p, d, fmt)
+
+
+def format_difference(p: float, d: float, fmt="str"):
+    if np.isnan(p) or np.isnan(d):
+        # One of the groups has no values
+        return "-"
+    size = cliffs_size(d)
     if fmt == "pair":
         p_str = "<" if p < 0.05 else ">"
         d_str = (
@@ -123,7 +199,10 @@ def group_difference(x1, x2, fmt="str"):
 
 def significances(X, y, metrics):
     lr_results = correlation(X, y, metrics=metrics, method="logistic_regression")
+    return significance_table(lr_results, metrics)
 
+
+def significance_table(lr_results, metrics):
     lr_p_values = []
     lr_odds_ratios = []
     lr_errors = []
@@ -149,3 +228,90 @@ def significances(X, y, metrics):
     )
 
     return results
+
+
+def _correlation_job(job):
+    X, y, metrics, method = job
+    return correlation(X, y, metrics, method, scaled=True)
+
+
+class CorrelationRunner:
+    """
+    correlation() fits of many metric subsets and projects, cached and in parallel
+
+    The design matrix of every scope (all data, or one project) is standardized once
+    and sliced for each metric subset. Results are stored as JSON under a hash of the
+    standardized subset, the labels, the method and the library versions, so fits of
+    unchanged data are never repeated.
+    """
+
+    def __init__(
+        self,
+        data: pd.DataFrame,
+        metrics: list,
+        cache_dir: Path = Path("data/cache/correlation"),
+        workers: int = 1,
+    ) -> None:
+        self.data = data
+        self.metrics = metrics
+        self.cache_dir = Path(cache_dir)
+        self.workers = workers
+        self._designs = {}
+
+    def design(self, project: Optional[str] = None) -> tuple[pd.DataFrame, pd.Series]:
+        """
+        Standardized metrics and labels of all data (project=None) or of one project
+        """
+        if project not in self._designs:
+            data = self.data
+            if project is not None:
+                data = data.loc[data["project"] == project]
+            self._designs[project] = (standardize(data[self.metrics]), data["buggy"])
+        return self._designs[project]
+
+    @staticmethod
+    def key(X: pd.DataFrame, y: pd.Series, method: str) -> str:
+        hasher = hashlib.sha1()
+        hasher.update(pd.util.hash_pandas_object(X, index=False).values.tobytes())
+        hasher.update(pd.util.hash_pandas_object(y, index=False).values.tobytes())
+        versions = [np.__version__, statsmodels.__version__, sklearn.__version__]
+        hasher.update(json.dumps([list(X.columns), method, versions]).encode())
+        return hasher.hexdigest()
+
+    def run(
+        self, subsets: dict, projects: list = [None], method: str = "logistic_regression"
+    ) -> dict:
+        """
+        (subset name, project) -> correlation() results, for every metric subset and project
+        """
+        jobs, keys, results = {}, {}, {}
+        for project in projects:
+            X, y = self.design(project)
+            for name, metrics in subsets.items():
+                key = self.key(X[metrics], y, method)
+                path = self.cache_dir / f"{key}.json"
+                if path.exists():
+                    with open(path) as f:
+                        results[(name, project)] = json.load(f)
+                else:
+                    jobs[(name, project)] = (X[metrics], y, metrics, method)
+                    keys[(name, project)] = key
+
+        if self.workers > 1 and len(jobs) > 1:
+            with ProcessPoolExecutor(max_workers=self.workers) as executor:
+                fitted = list(executor.map(_correlation_job, jobs.values()))
+        else:
+            fitted = list(map(_correlation_job, jobs.values()))
+
+        self.cache_dir.mkdir(parents=True, exist_ok=True)
+        for task, result in zip(jobs, fitted):
+            results[task] = result
+            # Failed fits (None) are not cached
+            if result is not None:
+                result = {
+                    metric: {name: float(value) for name, value in values.items()}
+                    for metric, values in result.items()
+                }
+                with open(self.cache_dir / f"{keys[task]}.json", "w") as f:
+                    json.dump(result, f)
+        return results
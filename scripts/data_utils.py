@@ -2,55 +2,72 @@
 # Licensed under the Apache License, Version 2.0
 # See the LICENSE file in the project root for license terms.
 
+import os
 import json
+import hashlib
+from datetime import tzinfo
 from pathlib import Path
-from datetime import datetime
-from typing import List
+from typing import List, Optional
 from typing_extensions import Annotated
+from zoneinfo import ZoneInfo, ZoneInfoNotFoundError
 
+import numpy as np
 import pandas as pd
+from dateutil.tz import tzlocal
 from rich.progress import track
 from rich.console import Console
 from typer import Typer, Argument, Option
 
 from neurojit.commit import Mining
+from neurojit.tools.data_utils import KFoldDateSplit
 
 from environment import PROJECTS
+from journal import Journal, Watermarks, processed_rows
+from results_store import ResultsStore
+from snapshot import DatasetSnapshot
 
 app = Typer(add_completion=False, help="Data preprocessing and caching")
 
+# Trailing UTC offset of a timestamp: Z, +09:00 or +0900
+TZ_OFFSET = r"(?:Z|[+-]\d{2}:?\d{2})$"
+
 
 @app.command()
 def prepare_data(
     dataset_dir: Annotated[
         Path, Option(..., help="Path to the dataset directory")
     ] = Path("data/dataset"),
+    chunksize: Annotated[
+        Optional[int],
+        Option(help="Stream the input CSVs in chunks of this many rows"),
+    ] = None,
 ):
     """
     ApacheJIT(+bug_date column) dataset
     """
-    apachejit = pd.read_csv(dataset_dir / "apachejit_date.csv")
-    apachejit["fix_date"] = pd.to_datetime(apachejit["fix_date"])
-    apachejit["fix_date"] = apachejit["fix_date"].apply(lambda x: x.tz_localize(None))
-
-    apachejit["date"] = apachejit["date"].apply(lambda x: datetime.fromtimestamp(x))
-    apachejit = apachejit.drop(columns=["bug_date", "year"])
-
-    apachejit["gap"] = apachejit["fix_date"] - apachejit["date"]
-    apachejit["gap"] = apachejit["gap"].apply(lambda x: x.days)
-
-    apachejit["project"] = apachejit["project"].apply(
-        lambda x: x.replace("apache/", "")
+    apachejit = read_csv_chunks(
+        dataset_dir / "apachejit_date.csv", chunksize, preprocess_apachejit
     )
-    apachejit = apachejit.loc[apachejit["project"].isin(PROJECTS)]
     apachejit = apachejit.sort_index()
     apachejit = apachejit.sort_values(by="date")
     apachejit.to_csv(dataset_dir / "apachejit_gap.csv", index=False)
 
-    metrics = pd.read_csv(dataset_dir / "apache_metrics_kamei.csv")
-    apachejit_metrics = pd.merge(apachejit, metrics).drop(
-        columns=["fix_date", "author_date"]
-    )
+    metrics_path = dataset_dir / "apache_metrics_kamei.csv"
+    if chunksize is None:
+        apachejit_metrics = pd.merge(apachejit, pd.read_csv(metrics_path))
+    else:
+        # An inner merge keeps the order of the left rows; restore it across chunks
+        left = apachejit.assign(_row=np.arange(len(apachejit)))
+        apachejit_metrics = pd.concat(
+            [
+                pd.merge(left, metrics)
+                for metrics in pd.read_csv(metrics_path, chunksize=chunksize)
+            ],
+            ignore_index=True,
+        )
+        apachejit_metrics = apachejit_metrics.sort_values("_row", kind="stable")
+        apachejit_metrics = apachejit_metrics.drop(columns="_row")
+    apachejit_metrics = apachejit_metrics.drop(columns=["fix_date", "author_date"])
 
     meta_features = ["commit_id", "project", "repo", "gap", "buggy", "date"]
 
@@ -64,6 +81,57 @@ def prepare_data(
     apachejit_metrics.to_csv(dataset_dir / "baseline.csv", index=False)
 
 
+def preprocess_apachejit(apachejit: pd.DataFrame) -> pd.DataFrame:
+    """
+    Local commit dates, naive fix dates, fixing gaps in days and project names
+    """
+    # Drop the UTC offsets, keeping the wall-clock times
+    fix_date = apachejit["fix_date"].str.replace(TZ_OFFSET, "", regex=True)
+    apachejit["fix_date"] = pd.to_datetime(fix_date)
+
+    # The local time of the epoch seconds, as datetime.fromtimestamp
+    apachejit["date"] = (
+        pd.to_datetime(apachejit["date"], unit="s", utc=True)
+        .dt.tz_convert(local_timezone())
+        .dt.tz_localize(None)
+    )
+    apachejit = apachejit.drop(columns=["bug_date", "year"])
+
+    apachejit["gap"] = (apachejit["fix_date"] - apachejit["date"]).dt.days
+
+    apachejit["project"] = apachejit["project"].str.replace("apache/", "", regex=False)
+    return apachejit.loc[apachejit["project"].isin(PROJECTS)]
+
+
+def local_timezone() -> tzinfo:
+    """
+    The local time zone (TZ or /etc/localtime) with its full history of UTC offsets;
+    tzlocal() would apply today's offsets to every date
+    """
+    name = os.environ.get("TZ", "").removeprefix(":")
+    try:
+        if name.startswith("/"):
+            with open(name, "rb") as f:
+                return ZoneInfo.from_file(f)
+        if name:
+            return ZoneInfo(name)
+        with open("/etc/localtime", "rb") as f:
+            return ZoneInfo.from_file(f)
+    except (OSError, ValueError, ZoneInfoNotFoundError):
+        # A POSIX TZ rule such as "UTC-3" has no history to follow anyway
+        return tzlocal()
+
+
+def read_csv_chunks(path: Path, chunksize: Optional[int], transform) -> pd.DataFrame:
+    """
+    transform(pd.read_csv(path)), reading and transforming `chunksize` rows at a time
+    when given (row-wise transforms only: the index continues across chunks)
+    """
+    if chunksize is None:
+        return transform(pd.read_csv(path))
+    return pd.concat(transform(chunk) for chunk in pd.read_csv(path, chunksize=chunksize))
+
+
 @app.command()
 def filter_commits(
     project: Annotated[
@@ -76,6 +144,9 @@ def filter_commits(
     commits_dir: Annotated[Path, Option(help="Path to the commits directory")] = Path(
         "data/dataset/commits"
     ),
+    checkpoint: Annotated[
+        int, Option(help="Materialize the CSV every N journaled commits")
+    ] = 1000,
 ):
     """
     Filter method changes for each commit in the dataset and save methods to cache
@@ -83,9 +154,12 @@ def filter_commits(
     console = Console()
     commit_csv = commits_dir / f"{project}.csv"
     if not Path(commit_csv).exists():
-        split_commits(apachejit, commits_dir)
+        split_commits(apachejit, commits_dir, projects=[project])
     df = pd.read_csv(commit_csv, index_col="commit_id")
 
+    journal = Journal(commit_csv, every=checkpoint)
+    df = journal.replay(df)
+
     mining = Mining()
     try:
         for commit_id, row in track(
@@ -98,17 +172,21 @@ def filter_commits(
             )
             if method_changes_commit is None:
                 df.loc[commit_id, "target"] = "no"
-                df.to_csv(commit_csv)
+                journal.append(commit_id, target="no")
+                journal.checkpoint(df)
                 continue
 
             mining.save(method_changes_commit, "data/cache")
             df.loc[commit_id, "target"] = "yes"
-            df.to_csv(commit_csv)
+            journal.append(commit_id, target="yes")
+            journal.checkpoint(df)
+
+        journal.materialize(df)
 
-    except Exception as e:
-        console.print(e)
-        df.to_csv(commit_csv)
+    except Exception:
+        journal.materialize(df)
         console.log(f"Saved progress to {commit_csv}")
+        raise
 
 
 @app.command()
@@ -147,6 +225,25 @@ def save_methods(
         mining.save(method_changes_commit, "data/cache")
 
 
+@app.command()
+def save_stats(
+    projects: Annotated[
+        List[str], Option("--project", help="Projects to backfill (default: all)")
+    ] = list(PROJECTS),
+    cache_dir: Annotated[Path, Option(help="Path to the method cache")] = Path(
+        "data/cache"
+    ),
+):
+    """
+    Rebuild the change statistics sidecars of the method cache (for caches saved before them)
+    """
+    console = Console()
+    for project in track(projects, "Backfilling...", console=console):
+        stats = Mining.write_stats(str(cache_dir), project)
+        path = Mining.stats_path(str(cache_dir), project)
+        console.print(f"{project}: {len(stats)} commits -> {path}")
+
+
 @app.command()
 def combine_dataset(
     baseline_dir: Annotated[Path, Option(help="Path to the baseline directory")] = Path(
@@ -158,6 +255,9 @@ def combine_dataset(
     combined_dir: Annotated[Path, Option(help="Path to the combined directory")] = Path(
         "data/dataset/combined"
     ),
+    incremental: Annotated[
+        bool, Option(help="Only append rows for CUF rows added since the last run")
+    ] = False,
 ):
     """
     Combine the baseline and CUF datasets
@@ -165,11 +265,26 @@ def combine_dataset(
     console = Console()
     if not combined_dir.exists():
         combined_dir.mkdir(parents=True)
+    watermarks = Watermarks(combined_dir / ".watermarks.json")
 
     for project in track(PROJECTS, f"Combining datasets...", console=console):
+        combined_path = combined_dir / f"{project}.csv"
         baseline_data = pd.read_csv(baseline_dir / f"{project}.csv", index_col=0)
         cuf_data = pd.read_csv(cuf_dir / f"{project}.csv", index_col=0)
-        cuf_data = cuf_data.drop(
+
+        start = 0
+        if incremental and combined_path.exists():
+            start = watermarks.position(project, cuf_data.index)
+            if start is None:
+                start = processed_rows(cuf_data.index, combined_path)
+        cuf_rows = cuf_data.iloc[start:]
+
+        # Stop before the first new row whose baseline features are not ready yet
+        missing = np.flatnonzero(~cuf_rows.index.isin(baseline_data.index))
+        end = start + (missing[0] if len(missing) and incremental else len(cuf_rows))
+        if end < len(cuf_data) and incremental:
+            console.print(f"{project}: baseline missing for {cuf_data.index[end]}")
+        cuf_rows = cuf_data.iloc[start:end].drop(
             labels=[
                 "buggy",
                 "target",
@@ -181,33 +296,88 @@ def combine_dataset(
         )
 
         # Concatenate the two dataframes based cuf_data's index
-        data = pd.concat([baseline_data, cuf_data], axis=1, join="inner")
-        assert data.shape[0] == cuf_data.shape[0]
+        data = pd.concat([baseline_data, cuf_rows], axis=1, join="inner")
+        assert data.shape[0] == cuf_rows.shape[0]
 
-        data.to_csv(combined_dir / f"{project}.csv")
-        console.print(f"combined {project}")
+        if incremental and combined_path.exists():
+            columns = pd.read_csv(combined_path, index_col=0, nrows=0).columns
+            data.reindex(columns=columns).to_csv(combined_path, mode="a", header=False)
+            console.print(f"appended {data.shape[0]} rows to {project}")
+        else:
+            data.to_csv(combined_path)
+            console.print(f"combined {project}")
+        watermarks.update(project, cuf_data.index, rows=end)
 
 
+@app.command()
 def split_commits(
-    apachejit: str = "data/dataset/apachejit_gap.csv",
-    commits_dir: Path = Path("data/dataset/commits"),
+    apachejit: Annotated[
+        str, Option(help="Path to ApacheJIT dataset")
+    ] = "data/dataset/apachejit_gap.csv",
+    commits_dir: Annotated[Path, Option(help="Path to the commits directory")] = Path(
+        "data/dataset/commits"
+    ),
+    projects: Annotated[
+        Optional[List[str]], Option("--project", help="Projects to split (default: all)")
+    ] = None,
 ):
+    """
+    Split ApacheJIT into per-project commit lists, keeping the status of listed commits
+    """
     df = pd.read_csv(apachejit, index_col="commit_id")
-    for project in df["project"].unique():
+    commits_dir.mkdir(exist_ok=True, parents=True)
+    for project in projects or df["project"].unique():
         project_df = df[df["project"] == project].copy()
         project_df["target"] = "not_yet"
-        commits_dir.mkdir(exist_ok=True)
-        project_df.to_csv(commits_dir / f"{project}.csv")
 
+        # New commits are mined by the next filter-commits run
+        commit_csv = commits_dir / f"{project}.csv"
+        if commit_csv.exists():
+            targets = pd.read_csv(
+                commit_csv, index_col="commit_id", usecols=["commit_id", "target"]
+            )["target"]
+            listed = project_df.index.intersection(targets.index)
+            project_df.loc[listed, "target"] = targets[listed]
+        project_df.to_csv(commit_csv)
 
-def load_project_data(base_dir: str = "data/dataset/combined") -> pd.DataFrame:
-    total = []
-    for project in PROJECTS:
-        data = pd.read_csv(f"{base_dir}/{project}.csv")
-        total.append(data)
-    data = pd.concat(total)
 
-    return data
+def load_project_data(
+    base_dir: str = "data/dataset/combined", dtype: str = "float64"
+) -> pd.DataFrame:
+    """
+    The combined dataset of all projects, from its typed snapshot: categorical project
+    and commit ids, dates parsed, and numeric columns exactly as read from the CSVs
+    or, with dtype="float32", as float32
+    """
+    return DatasetSnapshot(base_dir).load(dtype)
+
+
+def project_folds(
+    project: str,
+    data: pd.DataFrame,
+    manifest_dir: Path = Path("data/cache/folds"),
+) -> tuple[KFoldDateSplit, list]:
+    """
+    The 20-fold splitter of a project with its fold positions, reused from a manifest
+    as long as the data did not change
+    """
+    params = dict(k=20, start_gap=3, end_gap=3, is_mid_gap=True, sliding_months=1)
+    splitter = KFoldDateSplit(data, **params)
+    fingerprint = hashlib.sha1(
+        pd.util.hash_pandas_object(
+            splitter.data[["commit_id", "buggy", "gap"]], index=True
+        ).values.tobytes()
+        + json.dumps(params, sort_keys=True).encode()
+    ).hexdigest()
+
+    manifest_path = manifest_dir / f"{project}.json"
+    if manifest_path.exists():
+        folds, meta = KFoldDateSplit.load_manifest(manifest_path)
+        if meta.get("fingerprint") == fingerprint:
+            return splitter, folds
+
+    folds = splitter.save_manifest(manifest_path, fingerprint=fingerprint, **params)
+    return splitter, folds
 
 
 def load_jsons(
@@ -221,5 +391,30 @@ def load_jsons(
     return pd.DataFrame(data)
 
 
+def load_results(
+    jsons: List[Path],
+    columns: Optional[List[str]] = None,
+    results_dir: Optional[Path] = None,
+) -> pd.DataFrame:
+    """
+    Scores of <model>_<features>.json outputs. With `results_dir`, they are read from
+    that columnar results store when it holds them (only `columns`), otherwise from
+    the JSON files. Samples are commit ids either way.
+    """
+    frames = []
+    for json_file in jsons:
+        model, features = json_file.stem.rsplit("_", 1)
+        store = ResultsStore(results_dir) if results_dir is not None else None
+        if store is not None and store.contains(model, features):
+            df = store.read(model, features, columns, decode=True).drop(columns=["model"])
+        else:
+            df = load_jsons([json_file])
+            if columns is not None:
+                keys = ["project", "fold", "features"]
+                df = df[keys + [column for column in columns if column not in keys]]
+        frames.append(df)
+    return pd.concat(frames, ignore_index=True)
+
+
 if __name__ == "__main__":
     app()
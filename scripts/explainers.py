@@ -0,0 +1,156 @@
+# Copyright (c) 2024 Hansae Ju
+# Licensed under the Apache License, Version 2.0
+# See the LICENSE file in the project root for license terms.
+
+import numpy as np
+from sklearn.preprocessing import StandardScaler
+
+from environment import SEED
+
+
+class BatchedLimeExplainer:
+    """
+    LimeTabularExplainer(discretize_continuous=False) for many rows at once
+
+    Perturbations of all rows are drawn from the same RandomState stream as consecutive
+    explain_instance calls, scored with one predict_proba call per batch, and the
+    weighted Ridge(alpha=1) surrogates are solved together. LIME keeps every feature
+    when num_features is the number of features, so no feature selection is needed.
+    """
+
+    def __init__(
+        self,
+        training_data: np.ndarray,
+        num_samples: int = 5000,
+        kernel_width: float = None,
+        random_state: int = SEED,
+        batch_size: int = 32,
+    ) -> None:
+        self.scaler = StandardScaler(with_mean=False).fit(training_data)
+        self.num_samples = num_samples
+        self.kernel_width = (
+            np.sqrt(training_data.shape[1]) * 0.75
+            if kernel_width is None
+            else float(kernel_width)
+        )
+        self.random_state = np.random.RandomState(random_state)
+        self.batch_size = batch_size
+
+    def coefficients(self, rows: np.ndarray, predict_proba, label: int = 1) -> np.ndarray:
+        """
+        (n_rows, n_features) local surrogate coefficients for `label`
+        """
+        rows = np.asarray(rows, dtype=float)
+        coefs = [
+            self._coefficients(rows[start : start + self.batch_size], predict_proba, label)
+            for start in range(0, len(rows), self.batch_size)
+        ]
+        return np.concatenate(coefs) if coefs else np.empty((0, rows.shape[1]))
+
+    def top_features(
+        self, rows: np.ndarray, predict_proba, k: int = 5, label: int = 1
+    ) -> np.ndarray:
+        """
+        (n_rows, k) feature indices ordered by decreasing |coefficient|, as in as_map()
+        """
+        coefs = self.coefficients(rows, predict_proba, label)
+        return np.argsort(-np.abs(coefs), axis=1, kind="stable")[:, :k]
+
+    def _coefficients(self, rows: np.ndarray, predict_proba, label: int) -> np.ndarray:
+        n_rows, n_features = rows.shape
+        mean, scale = self.scaler.mean_, self.scaler.scale_
+
+        # The same draws as one normal(0, 1, num_samples * n_features) call per row
+        data = self.random_state.normal(0, 1, n_rows * self.num_samples * n_features)
+        data = data.reshape(n_rows, self.num_samples, n_features) * scale + mean
+        data[:, 0] = rows
+
+        scaled = (data - mean) / scale
+        distances = np.linalg.norm(scaled - scaled[:, :1], axis=2)
+        weights = np.sqrt(np.exp(-(distances**2) / self.kernel_width**2))
+
+        labels = predict_proba(data.reshape(-1, n_features))[:, label]
+        labels = labels.reshape(n_rows, self.num_samples)
+
+        # Weighted ridge on the scaled neighbourhood with an unpenalized intercept:
+        # center with the weighted means, then solve the normal equations
+        total = weights.sum(axis=1, keepdims=True)
+        X_offset = np.einsum("rs,rsf->rf", weights, scaled) / total
+        y_offset = np.einsum("rs,rs->r", weights, labels)[:, None] / total
+        sqrt_weights = np.sqrt(weights)
+        X = (scaled - X_offset[:, None]) * sqrt_weights[..., None]
+        y = (labels - y_offset) * sqrt_weights
+
+        gram = np.einsum("rsf,rsg->rfg", X, X) + np.eye(n_features)
+        moments = np.einsum("rsf,rs->rf", X, y)
+        return np.linalg.solve(gram, moments[..., None])[..., 0]
+
+
+class TreeContributionExplainer:
+    """
+    Exact per-feature contributions of tree ensembles for the buggy class
+
+    XGBoost models use the booster's pred_contribs (SHAP values of the margin).
+    Random forests use decision-path contributions: every split adds the change of
+    the buggy-class probability between a node and its child to the split feature,
+    averaged over the trees.
+    """
+
+    def __init__(self, pipeline) -> None:
+        self.pipeline = pipeline
+        self.model = pipeline.steps[-1][1]
+
+    def transform(self, X) -> np.ndarray:
+        # The preprocessing the model sees at prediction time (samplers only act in fit)
+        for _, step in self.pipeline.steps[:-1]:
+            if hasattr(step, "transform"):
+                X = step.transform(X)
+        return np.asarray(X, dtype=float)
+
+    def contributions(self, X) -> np.ndarray:
+        """
+        (n_rows, n_features) contributions to the buggy-class prediction
+        """
+        X = self.transform(X)
+        if hasattr(self.model, "get_booster"):
+            from xgboost import DMatrix
+
+            contribs = self.model.get_booster().predict(DMatrix(X), pred_contribs=True)
+            # The last column is the bias
+            return contribs[:, :-1]
+        if hasattr(self.model, "estimators_"):
+            return self._forest_contributions(X)
+        raise ValueError(f"Not supported model: {type(self.model).__name__}")
+
+    def top_features(self, X, k: int = 5) -> np.ndarray:
+        """
+        (n_rows, k) feature indices ordered by decreasing |contribution|
+        """
+        contribs = self.contributions(X)
+        return np.argsort(-np.abs(contribs), axis=1, kind="stable")[:, :k]
+
+    def _forest_contributions(self, X: np.ndarray) -> np.ndarray:
+        buggy = list(self.model.classes_).index(1)
+        contribs = np.zeros(X.shape)
+        for estimator in self.model.estimators_:
+            tree = estimator.tree_
+            value = tree.value[:, 0, :]
+            proba = value[:, buggy] / value.sum(axis=1)
+
+            # Each child node gets the change from its parent on its parent's split feature
+            parent = np.full(tree.node_count, -1)
+            parent[tree.children_left[tree.children_left >= 0]] = np.flatnonzero(
+                tree.children_left >= 0
+            )
+            parent[tree.children_right[tree.children_right >= 0]] = np.flatnonzero(
+                tree.children_right >= 0
+            )
+            children = np.flatnonzero(parent >= 0)
+            deltas = np.zeros((tree.node_count, X.shape[1]))
+            deltas[children, tree.feature[parent[children]]] = (
+                proba[children] - proba[parent[children]]
+            )
+
+            paths = estimator.decision_path(X.astype(np.float32))
+            contribs += paths @ deltas
+        return contribs / len(self.model.estimators_)
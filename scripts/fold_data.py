@@ -0,0 +1,75 @@
+# Copyright (c) 2024 Hansae Ju
+# Licensed under the Apache License, Version 2.0
+# See the LICENSE file in the project root for license terms.
+
+from copy import deepcopy
+from functools import cached_property
+
+import numpy as np
+import pandas as pd
+from sklearn.pipeline import Pipeline
+from sklearn.preprocessing import StandardScaler
+from imblearn.over_sampling import SMOTE
+from imblearn.pipeline import Pipeline as ImbPipeline
+
+from environment import COMBINED, SEED
+
+
+class FoldDataCache:
+    """
+    Preprocessed training data of one fold, shared by every model and feature set
+
+    StandardScaler statistics are per column, so they are fitted once on COMBINED and
+    sliced for each feature set. SMOTE interpolates between neighbours found in the
+    whole feature space, so its output is cached per feature set and shared by models.
+    """
+
+    def __init__(self, train: pd.DataFrame, smote: bool = True) -> None:
+        self.X_train = train[COMBINED]
+        self.y_train = train["buggy"]
+        self.smote = smote
+        self._resampled = {}
+
+    @cached_property
+    def scaler(self) -> StandardScaler:
+        return StandardScaler().fit(self.X_train)
+
+    def scaler_for(self, features: list) -> StandardScaler:
+        """
+        A fitted scaler for a column subset, equal to StandardScaler().fit(X[features])
+        """
+        columns = [COMBINED.index(feature) for feature in features]
+        scaler = deepcopy(self.scaler)
+        scaler.mean_ = self.scaler.mean_[columns]
+        scaler.var_ = self.scaler.var_[columns]
+        scaler.scale_ = self.scaler.scale_[columns]
+        scaler.n_features_in_ = len(columns)
+        scaler.feature_names_in_ = np.asarray(features, dtype=object)
+        return scaler
+
+    def resampled(self, features: list) -> tuple[np.ndarray, pd.Series]:
+        """
+        Scaled (and SMOTE-resampled) training data for a feature set
+        """
+        key = tuple(features)
+        if key not in self._resampled:
+            X = self.scaler_for(features).transform(self.X_train[features])
+            y = self.y_train
+            if self.smote:
+                X, y = SMOTE(random_state=SEED).fit_resample(X, y)
+            self._resampled[key] = (X, y)
+        return self._resampled[key]
+
+    def fit(self, base_model, features: list):
+        """
+        The fitted equivalent of simple_pipeline(base_model, smote).fit(X_train[features], y_train)
+        """
+        X, y = self.resampled(features)
+        base_model.fit(X, y)
+        steps = [("scaler", self.scaler_for(features))]
+        if self.smote:
+            steps.append(("smote", SMOTE(random_state=SEED)))
+            steps.append(("model", base_model))
+            return ImbPipeline(steps)
+        steps.append(("model", base_model))
+        return Pipeline(steps)
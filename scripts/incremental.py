@@ -0,0 +1,107 @@
+# Copyright (c) 2024 Hansae Ju
+# Licensed under the Apache License, Version 2.0
+# See the LICENSE file in the project root for license terms.
+
+from copy import deepcopy
+
+import pandas as pd
+from sklearn.pipeline import Pipeline
+from sklearn.preprocessing import StandardScaler
+from sklearn.ensemble import RandomForestClassifier
+from xgboost import XGBClassifier
+from imblearn.over_sampling import SMOTE
+
+from environment import SEED
+
+
+def model_key(model: str, incremental: bool = False) -> str:
+    """
+    Name of a model's outputs (pickles, results, probabilities); warm-started models
+    get their own, so they never overwrite those of full retraining
+    """
+    return f"{model}_incremental" if incremental else model
+
+
+class IncrementalModel:
+    """
+    Warm-started training over consecutive sliding-window folds of one project
+
+    The scaler is refitted on every fold, so models are trained in the raw feature
+    space: SMOTE still runs on scaled data, and the resampled rows are mapped back
+    with the scaler's inverse transform.
+        - random_forest: the first fold trains all trees; every later fold trains
+          n_estimators / keep_folds new trees and retires the oldest batch, so the
+          forest only holds trees of the last keep_folds windows
+        - xgboost: the first fold trains a full booster; every later fold continues
+          boosting from the previous booster for boost_rounds rounds
+    """
+
+    def __init__(
+        self,
+        model: str,
+        smote: bool = True,
+        n_estimators: int = 100,
+        keep_folds: int = 5,
+        boost_rounds: int = 20,
+    ) -> None:
+        if model not in ("random_forest", "xgboost"):
+            raise ValueError(f"Not supported model for incremental training: {model}")
+        self.model = model
+        self.smote = smote
+        self.n_estimators = n_estimators
+        self.keep_folds = keep_folds
+        self.boost_rounds = boost_rounds
+        self.fold = 0
+        self.batches = []
+        self.booster = None
+
+    def resample(self, X_train: pd.DataFrame, y_train: pd.Series) -> tuple[pd.DataFrame, pd.Series]:
+        scaler = StandardScaler().fit(X_train)
+        X, y = scaler.transform(X_train), y_train
+        if self.smote:
+            X, y = SMOTE(random_state=SEED).fit_resample(X, y)
+        X = pd.DataFrame(scaler.inverse_transform(X), columns=X_train.columns)
+        return X, y
+
+    def fit(self, X_train: pd.DataFrame, y_train: pd.Series) -> Pipeline:
+        """
+        Update the model with the next fold and return a pipeline for this fold
+        """
+        X, y = self.resample(X_train, y_train)
+        if self.model == "random_forest":
+            estimator = self._fit_forest(X, y)
+        else:
+            estimator = self._fit_booster(X, y)
+        self.fold += 1
+        return Pipeline([("model", estimator)])
+
+    def _fit_forest(self, X: pd.DataFrame, y: pd.Series) -> RandomForestClassifier:
+        batch_size = max(1, self.n_estimators // self.keep_folds)
+        if not self.batches:
+            forest = RandomForestClassifier(
+                n_estimators=batch_size * self.keep_folds, random_state=SEED, n_jobs=1
+            ).fit(X, y)
+            self.batches = [
+                forest.estimators_[i : i + batch_size]
+                for i in range(0, len(forest.estimators_), batch_size)
+            ]
+        else:
+            forest = RandomForestClassifier(
+                n_estimators=batch_size, random_state=SEED + self.fold, n_jobs=1
+            ).fit(X, y)
+            self.batches = self.batches[1:] + [forest.estimators_]
+
+        ensemble = deepcopy(forest)
+        ensemble.estimators_ = [tree for batch in self.batches for tree in batch]
+        ensemble.n_estimators = len(ensemble.estimators_)
+        return ensemble
+
+    def _fit_booster(self, X: pd.DataFrame, y: pd.Series) -> XGBClassifier:
+        if self.booster is None:
+            model = XGBClassifier(random_state=SEED, n_jobs=1).fit(X, y)
+        else:
+            model = XGBClassifier(
+                n_estimators=self.boost_rounds, random_state=SEED, n_jobs=1
+            ).fit(X, y, xgb_model=self.booster)
+        self.booster = model.get_booster()
+        return model
@@ -3,15 +3,21 @@
 # See the LICENSE file in the project root for license terms.
 
 import json
+import time
 import pickle
 import warnings
+from concurrent.futures import ProcessPoolExecutor
+from functools import partial
+from itertools import groupby
 from pathlib import Path
+from typing import List, Optional
 from typing_extensions import Annotated
 
 import pandas as pd
 import numpy as np
 from rich.console import Console
 from rich.progress import track
+from tabulate import tabulate
 from sklearn.pipeline import Pipeline
 from sklearn.ensemble import RandomForestClassifier
 from sklearn.naive_bayes import GaussianNB
@@ -33,7 +39,6 @@ from imblearn.pipeline import Pipeline as ImbPipeline
 from lime.lime_tabular import LimeTabularExplainer
 from typer import Typer, Argument, Option
 
-from neurojit.tools.data_utils import KFoldDateSplit
 from environment import (
     BASELINE,
     COMBINED,
@@ -43,7 +48,13 @@ from environment import (
     SEED,
     PERFORMANCE_METRICS,
 )
-from data_utils import load_project_data
+from data_utils import load_project_data, project_folds
+from fold_data import FoldDataCache
+from incremental import IncrementalModel, model_key
+from explainers import BatchedLimeExplainer, TreeContributionExplainer
+from model_cache import ModelCache
+from results_store import ResultsStore
+from probability_cache import ProbabilityCache, evaluate_folds
 
 warnings.filterwarnings("ignore")
 app = Typer(add_completion=False, help="Experiments for Just-In-Time Software Defect Prediction (JIT-SDP)")
@@ -63,72 +74,275 @@ def train_test(
     save_model: Annotated[bool, Option(help="Save models")] = False,
     load_model: Annotated[bool, Option(help="Load models")] = True,
     save_dir: Annotated[Path, Option(help="Save directory")] = Path("data/pickles"),
+    workers: Annotated[
+        int, Option(help="Number of processes training (project, fold) jobs")
+    ] = 1,
+    incremental: Annotated[
+        bool,
+        Option(
+            help="Warm-start each fold's model from the previous fold, saving outputs as <model>_incremental"
+        ),
+    ] = False,
+    cache: Annotated[
+        bool, Option(help="Reuse models from the content-hashed model cache")
+    ] = False,
+    cache_dir: Annotated[Path, Option(help="Model cache directory")] = Path(
+        "data/cache/models"
+    ),
+    results_dir: Annotated[
+        Path, Option(help="Columnar results store (default: <output-dir>/results)")
+    ] = None,
+    proba_dir: Annotated[
+        Path, Option(help="Directory of the per-sample probability cache")
+    ] = Path("data/cache/probabilities"),
+    dtype: Annotated[
+        str, Option(help="Numeric dtype of the dataset: float64|float32")
+    ] = "float64",
 ):
     """
     Train and test the baseline/cuf/combined model with 20 folds JIT-SDP
     """
     console = Console(quiet=not display)
-    scores = []
-    total_data = load_project_data()
-    for project in track(
-        PROJECTS,
-        description="Projects...",
-        console=console,
-        total=len(PROJECTS),
-    ):
-        data = total_data.loc[total_data["project"] == project].copy()
-        data["date"] = pd.to_datetime(data["date"])
-        data = data.set_index(["date"])
-
-        splitter = KFoldDateSplit(
-            data, k=20, start_gap=3, end_gap=3, is_mid_gap=True, sliding_months=1
+    total_data = load_project_data(dtype=dtype)
+    jobs = list(fold_jobs(total_data))
+    if incremental:
+        # Folds of a project depend on each other, so a job is a whole project
+        jobs = [list(folds) for _, folds in groupby(jobs, key=lambda job: job[0])]
+        run = partial(
+            train_test_incremental,
+            model=model,
+            features=features,
+            smote=smote,
+            save_model=save_model,
+            save_dir=save_dir,
+            proba_dir=proba_dir,
         )
-
-        for i, (train, test) in enumerate(splitter.split()):
-            X_train, y_train = train[FEATURE_SET[features]], train["buggy"]
-            X_test, y_test = test[FEATURE_SET[features]], test["buggy"]
-
-            if load_model:
-                pickes_dir = save_dir / model / features / project
-                load_path = pickes_dir / f"{i}.pkl"
-                with open(load_path, "rb") as f:
-                    pipeline = pickle.load(f)
-            else:
-                pipeline = simple_pipeline(get_model(model), smote=smote)
-                pipeline.fit(X_train, y_train)
-
-            y_pred = pipeline.predict(X_test)
-            y_pred_proba = pipeline.predict_proba(X_test)[:, 1]
-            score = evaluate(y_test, y_pred, y_pred_proba)
-            # True positive samples
-            tp_index = (y_test == 1) & (y_pred == 1)
-            score["tp_samples"] = test.loc[tp_index, "commit_id"].tolist()     
-            # Positive samples
-            pos_index = y_pred == 1
-            score["pos_samples"] = test.loc[pos_index, "commit_id"].tolist()
-
-            score["test"] = len(y_test)
-            score["buggy"] = sum(y_test)
-            score["project"] = project
-            score["fold"] = i
-            score["features"] = features
-
-            scores.append(score)
-
-            if save_model:
-                pickes_dir = save_dir / model / features / project
-                pickes_dir.mkdir(exist_ok=True, parents=True)
-                save_path = pickes_dir / f"{i}.pkl"
-                with open(save_path, "wb") as f:
-                    pickle.dump(pipeline, f)
+    else:
+        run = partial(
+            train_test_fold,
+            model=model,
+            features=features,
+            smote=smote,
+            save_model=save_model,
+            load_model=load_model,
+            save_dir=save_dir,
+            cache_dir=cache_dir if cache else None,
+            proba_dir=proba_dir,
+        )
+    if workers > 1:
+        executor = ProcessPoolExecutor(max_workers=workers)
+        results = executor.map(run, jobs)
+    else:
+        executor = None
+        results = map(run, jobs)
+    results = track(results, description="Folds...", console=console, total=len(jobs))
+    if incremental:
+        results = (score for project_scores in results for score in project_scores)
+    # Both map in job order, so scores come out in (project, fold) order
+    store = ResultsStore(results_dir or output_dir / "results")
+    scores = store_by_project(store, model_key(model, incremental), results)
+    if executor is not None:
+        executor.shutdown()
 
     output_dir.mkdir(exist_ok=True, parents=True)
-    save_path = output_dir / f"{model}_{features}.json"
+    save_path = output_dir / f"{model_key(model, incremental)}_{features}.json"
     with open(save_path, "w") as f:
         json.dump(scores, f, indent=4)
     console.print(f"Results saved at {save_path}")
 
 
+@app.command()
+def sweep(
+    models: Annotated[
+        List[str], Option("--model", help="Models to use: random_forest|xgboost")
+    ] = ["random_forest", "xgboost"],
+    feature_sets: Annotated[
+        List[str], Option("--features", help="Feature sets to use: baseline|cuf|combined")
+    ] = ["baseline", "cuf", "combined"],
+    smote: Annotated[bool, Option(help="Use SMOTE for oversampling")] = True,
+    display: Annotated[bool, Option(help="Display progress bar")] = False,
+    output_dir: Annotated[Path, Option(help="Output directory")] = Path("data/output"),
+    save_model: Annotated[bool, Option(help="Save models")] = False,
+    save_dir: Annotated[Path, Option(help="Save directory")] = Path("data/pickles"),
+    workers: Annotated[
+        int, Option(help="Number of processes training (project, fold) jobs")
+    ] = 1,
+    results_dir: Annotated[
+        Path, Option(help="Columnar results store (default: <output-dir>/results)")
+    ] = None,
+    proba_dir: Annotated[
+        Path, Option(help="Directory of the per-sample probability cache")
+    ] = Path("data/cache/probabilities"),
+    dtype: Annotated[
+        str, Option(help="Numeric dtype of the dataset: float64|float32")
+    ] = "float64",
+):
+    """
+    Train and test every model and feature set, sharing the scaling and SMOTE of each fold
+    """
+    console = Console(quiet=not display)
+    total_data = load_project_data(dtype=dtype)
+    jobs = list(fold_jobs(total_data))
+    run = partial(
+        sweep_fold,
+        models=models,
+        feature_sets=feature_sets,
+        smote=smote,
+        save_model=save_model,
+        save_dir=save_dir,
+        proba_dir=proba_dir,
+    )
+    if workers > 1:
+        executor = ProcessPoolExecutor(max_workers=workers)
+        results = executor.map(run, jobs)
+    else:
+        executor = None
+        results = map(run, jobs)
+    results = track(results, description="Folds...", console=console, total=len(jobs))
+    store = ResultsStore(results_dir or output_dir / "results")
+    fold_scores = {(model, features): [] for model in models for features in feature_sets}
+    for _, folds in groupby(results, key=lambda fold: fold["project"]):
+        folds = list(folds)
+        for model, features in fold_scores:
+            scores = [fold[(model, features)] for fold in folds]
+            store.append(model, scores)
+            fold_scores[(model, features)].extend(scores)
+    if executor is not None:
+        executor.shutdown()
+
+    output_dir.mkdir(exist_ok=True, parents=True)
+    for model in models:
+        for features in feature_sets:
+            scores = fold_scores[(model, features)]
+            save_path = output_dir / f"{model}_{features}.json"
+            with open(save_path, "w") as f:
+                json.dump(scores, f, indent=4)
+            console.print(f"Results saved at {save_path}")
+
+
+@app.command()
+def benchmark_incremental(
+    model: Annotated[str, Argument(help="Model to use: random_forest|xgboost")],
+    features: Annotated[
+        str, Argument(help="Feature set to use: baseline|cuf|combined")
+    ],
+    smote: Annotated[bool, Option(help="Use SMOTE for oversampling")] = True,
+    keep_folds: Annotated[
+        int, Option(help="random_forest: folds whose trees stay in the forest")
+    ] = 5,
+    boost_rounds: Annotated[
+        int, Option(help="xgboost: boosting rounds added per fold")
+    ] = 20,
+    fmt: Annotated[str, Option()] = "github",
+    display: Annotated[bool, Option(help="Display progress bar")] = False,
+):
+    """
+    Compare incremental training with full retraining per fold (performance and time)
+    """
+    console = Console(quiet=not display)
+    total_data = load_project_data()
+    jobs = list(fold_jobs(total_data))
+    feature_set = FEATURE_SET[features]
+
+    rows = []
+    for project, project_jobs in groupby(
+        track(jobs, description="Folds...", console=console), key=lambda job: job[0]
+    ):
+        np.random.seed(SEED)
+        incremental_model = IncrementalModel(
+            model, smote=smote, keep_folds=keep_folds, boost_rounds=boost_rounds
+        )
+        for _, i, train, test in project_jobs:
+            X_train, y_train = train[feature_set], train["buggy"]
+
+            start = time.perf_counter()
+            full = simple_pipeline(get_model(model), smote=smote).fit(X_train, y_train)
+            full_time = time.perf_counter() - start
+
+            start = time.perf_counter()
+            warm = incremental_model.fit(X_train, y_train)
+            warm_time = time.perf_counter() - start
+
+            for mode, pipeline, elapsed in (
+                ("full", full, full_time),
+                ("incremental", warm, warm_time),
+            ):
+                score = score_fold(pipeline, test, project, i, features)
+                rows.append(
+                    {
+                        "project": project,
+                        "mode": mode,
+                        "time": elapsed,
+                        **{metric: score[metric] for metric in PERFORMANCE_METRICS},
+                    }
+                )
+
+    results = pd.DataFrame(rows)
+    means = results.groupby(["project", "mode"], sort=False).agg(
+        {"time": "sum", **{metric: "mean" for metric in PERFORMANCE_METRICS}}
+    )
+    totals = results.groupby("mode", sort=False).agg(
+        {"time": "sum", **{metric: "mean" for metric in PERFORMANCE_METRICS}}
+    )
+
+    table = []
+    for (project, mode), row in means.iterrows():
+        table.append([PROJECTS[project], mode, *row.values])
+    for mode, row in totals.iterrows():
+        table.append(["Total", mode, *row.values])
+    output = tabulate(
+        table,
+        headers=["Project", "Mode", "Time (s)", *PERFORMANCE_METRICS],
+        tablefmt=fmt,
+        floatfmt=".3f",
+    )
+    print(output)
+    speedup = totals.loc["full", "time"] / totals.loc["incremental", "time"]
+    print(f"Speedup of incremental training: {speedup:.2f}x")
+    return output
+
+
+@app.command()
+def rescore(
+    model: Annotated[str, Argument(help="Model to use: random_forest|xgboost")],
+    features: Annotated[
+        str, Argument(help="Feature set to use: baseline|cuf|combined")
+    ],
+    threshold: Annotated[
+        float, Option(help="Probability above which a commit is predicted buggy")
+    ] = 0.5,
+    proba_dir: Annotated[
+        Path, Option(help="Directory of the per-sample probability cache")
+    ] = Path("data/cache/probabilities"),
+    incremental: Annotated[
+        bool, Option(help="Use the probabilities of train-test --incremental")
+    ] = False,
+    save_path: Annotated[
+        Optional[Path], Option(help="Save the fold scores as csv")
+    ] = None,
+    fmt: Annotated[str, Option()] = "github",
+):
+    """
+    Recompute the fold scores of train_test from cached probabilities, without models
+    """
+    folds = ProbabilityCache(proba_dir).load(model_key(model, incremental), features)
+    scores = evaluate_folds(folds, threshold=threshold)
+    if save_path is not None:
+        save_path.parent.mkdir(parents=True, exist_ok=True)
+        scores.to_csv(save_path, index=False)
+
+    means = scores.groupby("project", sort=False)[PERFORMANCE_METRICS].agg("mean")
+    table = [[PROJECTS[project], *row.values] for project, row in means.iterrows()]
+    output = tabulate(
+        table,
+        headers=["Project", *PERFORMANCE_METRICS],
+        tablefmt=fmt,
+        floatfmt=".3f",
+    )
+    print(output)
+    return output
+
+
 @app.command()
 def actionable(
     model: Annotated[str, Argument(help="Model to use: random_forest|xgboost")],
@@ -139,12 +353,333 @@ def actionable(
     pickles_dir: Annotated[Path, Option(help="Pickles directory")] = Path(
         "data/pickles"
     ),
+    explainer: Annotated[
+        str, Option(help="Explainer for the top 5 features: lime|batch|tree")
+    ] = "lime",
+    incremental: Annotated[
+        bool, Option(help="Explain the warm-started models of train-test --incremental")
+    ] = False,
 ):
     """
     Compute the ratios of actionable features for the baseline and combined models for the true positive samples in the 20 folds JIT-SDP
     """
     console = Console(quiet=not display)
     scores = []
+    for project, i, train, tp_samples, combined_model, baseline_model in actionable_folds(
+        model, smote, load_model, pickles_dir, console, incremental
+    ):
+        our_top5_features = top_features(
+            explainer, combined_model, train[COMBINED], tp_samples[COMBINED]
+        )
+        baseline_top5_features = top_features(
+            explainer, baseline_model, train[BASELINE], tp_samples[BASELINE]
+        )
+
+        for commit_id, our_top5, baseline_top5 in zip(
+            tp_samples["commit_id"], our_top5_features, baseline_top5_features
+        ):
+            our_actionable_ratio = (
+                len(set(our_top5) & set(ACTIONABLE_FEATURES)) / 5
+            )
+            baseline_actionable_ratio = (
+                len(set(baseline_top5) & set(ACTIONABLE_FEATURES)) / 5
+            )
+
+            scores.append(
+                {
+                    "commit_id": commit_id,
+                    "project": project,
+                    "fold": i,
+                    "our_actionable_ratio": our_actionable_ratio,
+                    "baseline_actionable_ratio": baseline_actionable_ratio,
+                }
+            )
+
+    scores_df = pd.DataFrame(scores)
+    output_dir.mkdir(exist_ok=True, parents=True)
+    save_path = output_dir / f"actionable_{model_key(model, incremental)}.csv"
+    scores_df.to_csv(save_path, index=False)
+    console.print(f"Results saved at {save_path}")
+
+
+@app.command()
+def compare_explainers(
+    model: Annotated[str, Argument(help="Model to use: random_forest|xgboost")],
+    explainer: Annotated[
+        str, Option(help="Explainer to compare with LIME: batch|tree")
+    ] = "tree",
+    smote: Annotated[bool, Option(help="Use SMOTE for oversampling")] = True,
+    display: Annotated[bool, Option(help="Display progress bar")] = False,
+    load_model: Annotated[bool, Option(help="Load models")] = True,
+    pickles_dir: Annotated[Path, Option(help="Pickles directory")] = Path(
+        "data/pickles"
+    ),
+    fmt: Annotated[str, Option()] = "github",
+):
+    """
+    Compare an explainer with LIME on the actionable analysis: time and top 5 agreement
+    """
+    console = Console(quiet=not display)
+    rows = []
+    for project, i, train, tp_samples, combined_model, baseline_model in actionable_folds(
+        model, smote, load_model, pickles_dir, console
+    ):
+        for features, pipeline in (
+            ("combined", combined_model),
+            ("baseline", baseline_model),
+        ):
+            feature_set = FEATURE_SET[features]
+            times = {}
+            tops = {}
+            for name in ("lime", explainer):
+                start = time.perf_counter()
+                tops[name] = top_features(
+                    name, pipeline, train[feature_set], tp_samples[feature_set]
+                )
+                times[name] = time.perf_counter() - start
+
+            for lime_top5, other_top5 in zip(tops["lime"], tops[explainer]):
+                rows.append(
+                    {
+                        "project": project,
+                        "features": features,
+                        "lime_time": times["lime"] / len(tp_samples),
+                        "time": times[explainer] / len(tp_samples),
+                        "overlap": len(set(lime_top5) & set(other_top5)) / 5,
+                        "same_ratio": len(set(lime_top5) & set(ACTIONABLE_FEATURES))
+                        == len(set(other_top5) & set(ACTIONABLE_FEATURES)),
+                    }
+                )
+
+    results = pd.DataFrame(rows)
+    table = []
+    for (project, features), group in results.groupby(["project", "features"], sort=False):
+        table.append(
+            [
+                PROJECTS[project],
+                features,
+                group["lime_time"].sum(),
+                group["time"].sum(),
+                group["lime_time"].sum() / group["time"].sum(),
+                group["overlap"].mean(),
+                group["same_ratio"].mean(),
+            ]
+        )
+    lime_total, other_total = results["lime_time"].sum(), results["time"].sum()
+    table.append(
+        [
+            "Total",
+            "",
+            lime_total,
+            other_total,
+            lime_total / other_total,
+            results["overlap"].mean(),
+            results["same_ratio"].mean(),
+        ]
+    )
+    output = tabulate(
+        table,
+        headers=[
+            "Project",
+            "Features",
+            "LIME (s)",
+            f"{explainer} (s)",
+            "Speedup",
+            "Top 5 Overlap",
+            "Same Actionable Ratio",
+        ],
+        tablefmt=fmt,
+        floatfmt=".3f",
+    )
+    print(output)
+    return output
+
+
+def fold_jobs(total_data: pd.DataFrame):
+    """
+    (project, fold, train, test) for every fold of every project, in canonical order
+    """
+    for project in PROJECTS:
+        data = total_data.loc[total_data["project"] == project].copy()
+        data["date"] = pd.to_datetime(data["date"])
+        data = data.set_index(["date"])
+
+        splitter, folds = project_folds(project, data)
+
+        for i, (train, test) in enumerate(splitter.split(folds)):
+            yield project, i, train, test
+
+
+def store_by_project(store: ResultsStore, model: str, results) -> list:
+    """
+    Collect fold scores, appending each project's scores to the store once it is complete
+    """
+    scores = []
+    for _, project_scores in groupby(results, key=lambda score: score["project"]):
+        project_scores = list(project_scores)
+        store.append(model, project_scores)
+        scores.extend(project_scores)
+    return scores
+
+
+def train_test_fold(
+    job: tuple,
+    model: str,
+    features: str,
+    smote: bool,
+    save_model: bool,
+    load_model: bool,
+    save_dir: Path,
+    cache_dir: Optional[Path] = None,
+    proba_dir: Optional[Path] = None,
+) -> dict:
+    project, i, train, test = job
+    # Every job starts from the same random state, wherever and in whatever order it runs
+    np.random.seed(SEED)
+
+    X_train, y_train = train[FEATURE_SET[features]], train["buggy"]
+
+    if cache_dir is not None:
+        pipeline = ModelCache(cache_dir).get_or_fit(
+            model,
+            features,
+            project,
+            i,
+            X_train,
+            y_train,
+            lambda: simple_pipeline(get_model(model), smote=smote),
+        )
+    elif load_model:
+        pickes_dir = save_dir / model / features / project
+        load_path = pickes_dir / f"{i}.pkl"
+        with open(load_path, "rb") as f:
+            pipeline = pickle.load(f)
+    else:
+        pipeline = simple_pipeline(get_model(model), smote=smote)
+        pipeline.fit(X_train, y_train)
+
+    proba_path = probability_path(proba_dir, model, features, project, i)
+    score = score_fold(pipeline, test, project, i, features, proba_path)
+
+    if save_model:
+        pickes_dir = save_dir / model / features / project
+        pickes_dir.mkdir(exist_ok=True, parents=True)
+        save_path = pickes_dir / f"{i}.pkl"
+        with open(save_path, "wb") as f:
+            pickle.dump(pipeline, f)
+
+    return score
+
+
+def train_test_incremental(
+    project_jobs: list,
+    model: str,
+    features: str,
+    smote: bool,
+    save_model: bool,
+    save_dir: Path,
+    proba_dir: Optional[Path] = None,
+) -> list:
+    np.random.seed(SEED)
+    incremental_model = IncrementalModel(model, smote=smote)
+    key = model_key(model, incremental=True)
+    scores = []
+    for project, i, train, test in project_jobs:
+        pipeline = incremental_model.fit(train[FEATURE_SET[features]], train["buggy"])
+        proba_path = probability_path(proba_dir, key, features, project, i)
+        scores.append(score_fold(pipeline, test, project, i, features, proba_path))
+
+        if save_model:
+            pickes_dir = save_dir / key / features / project
+            pickes_dir.mkdir(exist_ok=True, parents=True)
+            with open(pickes_dir / f"{i}.pkl", "wb") as f:
+                pickle.dump(pipeline, f)
+    return scores
+
+
+def sweep_fold(
+    job: tuple,
+    models: List[str],
+    feature_sets: List[str],
+    smote: bool,
+    save_model: bool,
+    save_dir: Path,
+    proba_dir: Optional[Path] = None,
+) -> dict:
+    project, i, train, test = job
+    np.random.seed(SEED)
+
+    fold_data = FoldDataCache(train, smote=smote)
+    scores = {"project": project}
+    for features in feature_sets:
+        for model in models:
+            pipeline = fold_data.fit(get_model(model), FEATURE_SET[features])
+            proba_path = probability_path(proba_dir, model, features, project, i)
+            scores[(model, features)] = score_fold(
+                pipeline, test, project, i, features, proba_path
+            )
+
+            if save_model:
+                pickes_dir = save_dir / model / features / project
+                pickes_dir.mkdir(exist_ok=True, parents=True)
+                with open(pickes_dir / f"{i}.pkl", "wb") as f:
+                    pickle.dump(pipeline, f)
+    return scores
+
+
+def probability_path(
+    proba_dir: Optional[Path], model: str, features: str, project: str, i: int
+) -> Optional[Path]:
+    if proba_dir is None:
+        return None
+    return ProbabilityCache(proba_dir).path(model, features, project, i)
+
+
+def score_fold(
+    pipeline,
+    test: pd.DataFrame,
+    project: str,
+    i: int,
+    features: str,
+    proba_path: Optional[Path] = None,
+) -> dict:
+    X_test, y_test = test[FEATURE_SET[features]], test["buggy"]
+
+    y_pred = pipeline.predict(X_test)
+    y_pred_proba = pipeline.predict_proba(X_test)[:, 1]
+    if proba_path is not None:
+        ProbabilityCache.save(proba_path, test["commit_id"], y_test, y_pred_proba)
+    score = evaluate(y_test, y_pred, y_pred_proba)
+    # True positive samples
+    tp_index = (y_test == 1) & (y_pred == 1)
+    score["tp_samples"] = test.loc[tp_index, "commit_id"].tolist()
+    # Positive samples
+    pos_index = y_pred == 1
+    score["pos_samples"] = test.loc[pos_index, "commit_id"].tolist()
+
+    score["test"] = len(y_test)
+    score["buggy"] = sum(y_test)
+    score["project"] = project
+    score["fold"] = i
+    score["features"] = features
+    return score
+
+
+def actionable_folds(
+    model: str,
+    smote: bool,
+    load_model: bool,
+    pickles_dir: Path,
+    console: Console,
+    incremental: bool = False,
+):
+    """
+    (project, fold, train, common true positives, combined model, baseline model) of
+    every fold with at least one true positive predicted by both models
+
+    With `incremental`, the models are the warm-started ones of train_test --incremental.
+    """
+    key = model_key(model, incremental)
     total_data = load_project_data()
     for project in track(
         PROJECTS,
@@ -156,11 +691,12 @@ def actionable(
         data["date"] = pd.to_datetime(data["date"])
         data = data.set_index(["date"])
 
-        splitter = KFoldDateSplit(
-            data, k=20, start_gap=3, end_gap=3, is_mid_gap=True, sliding_months=1
-        )
+        splitter, folds = project_folds(project, data)
+        if incremental and not load_model:
+            combined_incremental = IncrementalModel(model, smote=smote)
+            baseline_incremental = IncrementalModel(model, smote=smote)
 
-        for i, (train, test) in enumerate(splitter.split()):
+        for i, (train, test) in enumerate(splitter.split(folds)):
 
             combined_X_train, baseline_X_train, y_train = (
                 train[COMBINED],
@@ -172,16 +708,21 @@ def actionable(
                 test[BASELINE],
                 test["buggy"],
             )
-  
+
             if load_model:
-                load_path = pickles_dir / model / "combined" / project / f"{i}.pkl"
+                load_path = pickles_dir / key / "combined" / project / f"{i}.pkl"
                 with open(load_path, "rb") as f:
                     combined_model = pickle.load(f)
-                
-                load_path = pickles_dir / model / "baseline" / project / f"{i}.pkl"
+
+                load_path = pickles_dir / key / "baseline" / project / f"{i}.pkl"
                 with open(load_path, "rb") as f:
                     baseline_model = pickle.load(f)
 
+            elif incremental:
+                # Every fold is fitted, even those without common true positives
+                combined_model = combined_incremental.fit(combined_X_train, y_train)
+                baseline_model = baseline_incremental.fit(baseline_X_train, y_train)
+
             else:
                 combined_model = simple_pipeline(get_model(model), smote=smote)
                 baseline_model = simple_pipeline(get_model(model), smote=smote)
@@ -192,78 +733,47 @@ def actionable(
             cuf_y_pred = combined_model.predict(combined_X_test)
             base_y_pred = baseline_model.predict(baseline_X_test)
 
-            # LIME explanation
-            our_explainer = LimeTabularExplainer(
-                combined_X_train.values,
-                feature_names=combined_X_train.columns,
-                class_names=["not buggy", "buggy"],
-                mode="classification",
-                discretize_continuous=False,
-                random_state=SEED,
-            )
-
-            baseline_explainer = LimeTabularExplainer(
-                baseline_X_train.values,
-                feature_names=baseline_X_train.columns,
-                class_names=["not buggy", "buggy"],
-                mode="classification",
-                discretize_continuous=False,
-                random_state=SEED,
-            )
-
             # Get the explanation for the common tp samples
             tp_index = (y_test == 1) & (cuf_y_pred == 1) & (base_y_pred == 1)
             if sum(tp_index) == 0:
                 continue
 
-            for idx, row in test.loc[tp_index].iterrows():
-                commit_id = row.commit_id
-                our_explanation = our_explainer.explain_instance(
-                    row[COMBINED],
-                    combined_model.predict_proba,
-                    num_features=len(COMBINED),
-                )
-
-                baseline_explanation = baseline_explainer.explain_instance(
-                    row[BASELINE],
-                    baseline_model.predict_proba,
-                    num_features=len(BASELINE),
-                )
-
-                our_top_features = our_explanation.as_map()[1]
-                our_top_feature_index = [f[0] for f in our_top_features]
-                our_top5_features = combined_X_train.columns[
-                    our_top_feature_index
-                ].tolist()[:5]
+            yield project, i, train, test.loc[tp_index], combined_model, baseline_model
 
-                baseline_top_features = baseline_explanation.as_map()[1]
-                baseline_top_feature_index = [f[0] for f in baseline_top_features]
-                baseline_top5_features = baseline_X_train.columns[
-                    baseline_top_feature_index
-                ].tolist()[:5]
-
-                our_actionable_ratio = (
-                    len(set(our_top5_features) & set(ACTIONABLE_FEATURES)) / 5
-                )
-                baseline_actionable_ratio = (
-                    len(set(baseline_top5_features) & set(ACTIONABLE_FEATURES)) / 5
-                )
-
-                scores.append(
-                    {
-                        "commit_id": commit_id,
-                        "project": project,
-                        "fold": i,
-                        "our_actionable_ratio": our_actionable_ratio,
-                        "baseline_actionable_ratio": baseline_actionable_ratio,
-                    }
-                )
 
-    scores_df = pd.DataFrame(scores)
-    output_dir.mkdir(exist_ok=True, parents=True)
-    save_path = output_dir / f"actionable_{model}.csv"
-    scores_df.to_csv(save_path, index=False)
-    console.print(f"Results saved at {save_path}")
+def top_features(
+    explainer: str, model, X_train: pd.DataFrame, samples: pd.DataFrame, k: int = 5
+) -> list:
+    """
+    The top-k features of each sample by the absolute LIME weights (or tree
+    contributions) for the buggy class
+    """
+    if explainer == "batch":
+        batched_explainer = BatchedLimeExplainer(X_train.values)
+        top_index = batched_explainer.top_features(samples.values, model.predict_proba, k=k)
+        return [X_train.columns[index].tolist() for index in top_index]
+    if explainer == "tree":
+        top_index = TreeContributionExplainer(model).top_features(samples, k=k)
+        return [X_train.columns[index].tolist() for index in top_index]
+
+    if explainer != "lime":
+        raise ValueError(f"Not supported explainer: {explainer}")
+    lime_explainer = LimeTabularExplainer(
+        X_train.values,
+        feature_names=X_train.columns,
+        class_names=["not buggy", "buggy"],
+        mode="classification",
+        discretize_continuous=False,
+        random_state=SEED,
+    )
+    top = []
+    for _, row in samples.iterrows():
+        explanation = lime_explainer.explain_instance(
+            row, model.predict_proba, num_features=len(X_train.columns)
+        )
+        top_feature_index = [f[0] for f in explanation.as_map()[1]]
+        top.append(X_train.columns[top_feature_index].tolist()[:k])
+    return top
 
 
 def evaluate(y_test, y_pred, y_pred_proba):
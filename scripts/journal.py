@@ -0,0 +1,134 @@
+# Copyright (c) 2024 Hansae Ju
+# Licensed under the Apache License, Version 2.0
+# See the LICENSE file in the project root for license terms.
+
+import os
+import json
+from pathlib import Path
+from typing import Optional
+
+import numpy as np
+import pandas as pd
+
+
+class Journal:
+    """
+    Append-only journal of per-commit results kept next to a CSV output.
+
+    Every processed commit is appended as one JSON line instead of rewriting
+    the whole CSV. The CSV is materialized every `every` records and when the
+    job finishes; after a crash, `replay` restores the unmaterialized records.
+    """
+
+    def __init__(self, csv_path: Path, every: int = 1000) -> None:
+        self.csv_path = Path(csv_path)
+        self.path = self.csv_path.with_suffix(".journal.jsonl")
+        self.every = every
+        self.pending = 0
+        self._file = None
+
+    def records(self) -> dict:
+        records = {}
+        if not self.path.exists():
+            return records
+        with open(self.path) as f:
+            for line in f:
+                try:
+                    record = json.loads(line)
+                except json.JSONDecodeError:
+                    # a torn last line from an interrupted write
+                    continue
+                commit_id = record.pop("commit_id")
+                records.setdefault(commit_id, {}).update(record)
+        return records
+
+    def replay(self, df: pd.DataFrame) -> pd.DataFrame:
+        for commit_id, record in self.records().items():
+            if commit_id not in df.index:
+                continue
+            for column, value in record.items():
+                df.loc[commit_id, column] = value
+        return df
+
+    def append(self, commit_id: str, **values) -> None:
+        if self._file is None:
+            self.path.parent.mkdir(exist_ok=True, parents=True)
+            self._file = open(self.path, "a")
+        record = {"commit_id": commit_id, **values}
+        self._file.write(json.dumps(record, default=_to_builtin) + "\n")
+        self._file.flush()
+        self.pending += 1
+
+    def checkpoint(self, df: pd.DataFrame) -> None:
+        if self.pending >= self.every:
+            self.materialize(df)
+
+    def materialize(self, df: pd.DataFrame) -> None:
+        tmp_path = self.csv_path.with_suffix(".csv.tmp")
+        df.to_csv(tmp_path)
+        os.replace(tmp_path, self.csv_path)
+        self.close()
+        self.path.unlink(missing_ok=True)
+        self.pending = 0
+
+    def close(self) -> None:
+        if self._file is not None:
+            self._file.close()
+            self._file = None
+
+
+def _to_builtin(value):
+    # numpy scalars
+    if hasattr(value, "item"):
+        return value.item()
+    raise TypeError(f"Object of type {type(value).__name__} is not JSON serializable")
+
+
+class Watermarks:
+    """
+    Per-project watermarks: how many rows of an input table have already been
+    processed, together with the last processed commit to detect rewrites.
+    """
+
+    def __init__(self, path: Path) -> None:
+        self.path = Path(path)
+
+    def _load(self) -> dict:
+        if not self.path.exists():
+            return {}
+        with open(self.path) as f:
+            return json.load(f)
+
+    def position(self, project: str, index: pd.Index) -> Optional[int]:
+        """
+        Number of leading rows of `index` already processed, or None if unknown
+        or if the input was not only appended to since the watermark was set.
+        """
+        mark = self._load().get(project)
+        if mark is None or mark["rows"] > len(index):
+            return None
+        if mark["rows"] > 0 and index[mark["rows"] - 1] != mark["last_commit"]:
+            return None
+        return mark["rows"]
+
+    def update(self, project: str, index: pd.Index, rows: Optional[int] = None) -> None:
+        rows = len(index) if rows is None else rows
+        marks = self._load()
+        marks[project] = {
+            "rows": rows,
+            "last_commit": index[rows - 1] if rows > 0 else None,
+        }
+        self.path.parent.mkdir(exist_ok=True, parents=True)
+        tmp_path = self.path.with_suffix(".tmp")
+        with open(tmp_path, "w") as f:
+            json.dump(marks, f, indent=4)
+        os.replace(tmp_path, self.path)
+
+
+def processed_rows(index: pd.Index, output_csv: Path) -> int:
+    """
+    Fallback watermark: rows of `index` up to the last one already in `output_csv`
+    """
+    done = pd.read_csv(output_csv, usecols=[0]).iloc[:, 0]
+    processed = np.flatnonzero(index.isin(done))
+    return int(processed[-1]) + 1 if len(processed) else 0
@@ -0,0 +1,70 @@
+# Copyright (c) 2024 Hansae Ju
+# Licensed under the Apache License, Version 2.0
+# See the LICENSE file in the project root for license terms.
+
+import json
+import hashlib
+from pathlib import Path
+from typing import Callable
+
+import joblib
+import numpy as np
+import pandas as pd
+import sklearn
+import xgboost
+import imblearn
+
+
+class ModelCache:
+    """
+    Fitted fold pipelines keyed by what they were trained from
+
+    The key hashes the training rows, the feature list, the pipeline parameters and
+    the library versions, so a model is only reused if retraining would reproduce it.
+    Models are stored with joblib and loaded memory-mapped.
+    """
+
+    def __init__(self, cache_dir: Path = Path("data/cache/models")) -> None:
+        self.cache_dir = Path(cache_dir)
+
+    @staticmethod
+    def key(pipeline, X_train: pd.DataFrame, y_train: pd.Series) -> str:
+        hasher = hashlib.sha1()
+        hasher.update(pd.util.hash_pandas_object(X_train, index=False).values.tobytes())
+        hasher.update(pd.util.hash_pandas_object(y_train, index=False).values.tobytes())
+        hasher.update(json.dumps(list(X_train.columns)).encode())
+        params = {name: repr(value) for name, value in pipeline.get_params(deep=True).items()}
+        hasher.update(json.dumps(params, sort_keys=True).encode())
+        versions = [np.__version__, sklearn.__version__, xgboost.__version__, imblearn.__version__]
+        hasher.update(json.dumps(versions).encode())
+        return hasher.hexdigest()
+
+    def path(self, model: str, features: str, project: str, fold: int) -> Path:
+        return self.cache_dir / model / features / project / f"{fold}.joblib"
+
+    def get_or_fit(
+        self,
+        model: str,
+        features: str,
+        project: str,
+        fold: int,
+        X_train: pd.DataFrame,
+        y_train: pd.Series,
+        make_pipeline: Callable,
+    ):
+        """
+        The cached pipeline if its key matches, otherwise a freshly fitted (and cached) one
+        """
+        pipeline = make_pipeline()
+        key = self.key(pipeline, X_train, y_train)
+        path = self.path(model, features, project, fold)
+        key_path = path.with_suffix(".key")
+
+        if path.exists() and key_path.exists() and key_path.read_text() == key:
+            return joblib.load(path, mmap_mode="r")
+
+        pipeline.fit(X_train, y_train)
+        path.parent.mkdir(parents=True, exist_ok=True)
+        joblib.dump(pipeline, path)
+        key_path.write_text(key)
+        return pipeline
@@ -0,0 +1,403 @@
+# Copyright (c) 2024 Hansae Ju
+# Licensed under the Apache License, Version 2.0
+# See the LICENSE file in the project root for license terms.
+
+import sys
+import json
+import time
+import hashlib
+import subprocess
+from pathlib import Path
+from dataclasses import dataclass, field
+from concurrent.futures import ThreadPoolExecutor, FIRST_COMPLETED, wait
+from typing import List, Optional
+from typing_extensions import Annotated
+
+import pandas as pd
+from typer import Typer, Option
+from rich.console import Console
+from rich.table import Table
+
+from environment import PROJECTS
+
+app = Typer(
+    add_completion=False,
+    help="Build the dataset from ApacheJIT to the combined CSVs as a cached DAG",
+)
+
+SCRIPTS_DIR = Path(__file__).parent
+
+
+@dataclass
+class Stage:
+    """
+    One step of the dataset pipeline: a script command with the files it reads and writes
+    """
+
+    name: str
+    command: List[str]
+    inputs: List[Path]
+    outputs: List[Path]
+    deps: List[str] = field(default_factory=list)
+    # Arguments that do not change the outputs (workers, progress), left out of the stamp
+    runtime_args: List[str] = field(default_factory=list)
+    # The command only adds rows for input rows appended since its last run
+    incremental: bool = False
+    # Rows with target == "error" in the outputs mean the stage failed
+    fail_on_errors: bool = False
+
+    def stamp(self) -> str:
+        # What the outputs were built from: the command and the contents of every input
+        hasher = hashlib.sha1(json.dumps(self.command).encode())
+        for path in sorted(self.inputs):
+            hasher.update(str(path).encode())
+            hasher.update(file_hash(path).encode())
+        return hasher.hexdigest()
+
+
+def file_hash(path: Path, size: Optional[int] = None) -> str:
+    """
+    SHA1 of the file, or of its first `size` bytes
+    """
+    if not path.exists():
+        return "missing"
+    hasher = hashlib.sha1()
+    remaining = path.stat().st_size if size is None else size
+    with open(path, "rb") as f:
+        while remaining > 0:
+            chunk = f.read(min(1 << 20, remaining))
+            if not chunk:
+                break
+            hasher.update(chunk)
+            remaining -= len(chunk)
+    return hasher.hexdigest()
+
+
+def error_rows(path: Path) -> int:
+    if not path.exists():
+        return 0
+    df = pd.read_csv(path, usecols=lambda column: column == "target")
+    if "target" not in df:
+        return 0
+    return int((df["target"] == "error").sum())
+
+
+def script(name: str, *args: str) -> List[str]:
+    return [sys.executable, str(SCRIPTS_DIR / name), *args]
+
+
+def build_stages(
+    projects: List[str], dataset_dir: Path, engine: str, cuf_workers: int
+) -> List[Stage]:
+    """
+    prepare-data -> split-commits -> filter-commits -> {cuf-all, LT} per project
+    -> combine-dataset
+    """
+    apachejit_gap = dataset_dir / "apachejit_gap.csv"
+    baseline = dataset_dir / "baseline.csv"
+    stages = [
+        Stage(
+            "prepare-data",
+            script("data_utils.py", "prepare-data", "--dataset-dir", str(dataset_dir)),
+            inputs=[
+                dataset_dir / "apachejit_date.csv",
+                dataset_dir / "apache_metrics_kamei.csv",
+            ],
+            outputs=[apachejit_gap, baseline],
+        ),
+        Stage(
+            "split-commits",
+            script(
+                "data_utils.py",
+                "split-commits",
+                "--apachejit",
+                str(apachejit_gap),
+                "--commits-dir",
+                str(dataset_dir / "commits"),
+            ),
+            inputs=[apachejit_gap],
+            # The commit lists are updated in place by filter-commits afterwards
+            outputs=[],
+            deps=["prepare-data"],
+        ),
+    ]
+    for project in projects:
+        commits = dataset_dir / "commits" / f"{project}.csv"
+        stages += [
+            Stage(
+                f"filter-commits:{project}",
+                script(
+                    "data_utils.py",
+                    "filter-commits",
+                    project,
+                    "--apachejit",
+                    str(apachejit_gap),
+                    "--commits-dir",
+                    str(commits.parent),
+                ),
+                inputs=[apachejit_gap],
+                outputs=[commits],
+                deps=["split-commits"],
+            ),
+            Stage(
+                f"cuf-all:{project}",
+                script(
+                    "calculate.py",
+                    "cuf-all",
+                    project,
+                    "--save-dir",
+                    str(dataset_dir / "cuf"),
+                    "--engine",
+                    engine,
+                    "--incremental",
+                ),
+                inputs=[commits],
+                outputs=[dataset_dir / "cuf" / f"{project}.csv"],
+                deps=[f"filter-commits:{project}"],
+                runtime_args=["--workers", str(cuf_workers), "--quiet"],
+                incremental=True,
+                # Every listed commit changes methods, so an error is a failed commit
+                fail_on_errors=True,
+            ),
+            Stage(
+                f"LT:{project}",
+                script(
+                    "calculate.py",
+                    "LT",
+                    project,
+                    "--save-dir",
+                    str(dataset_dir / "baseline"),
+                    "--baseline-csv",
+                    str(baseline),
+                    "--incremental",
+                ),
+                # LT reads the method cache written by filter-commits
+                inputs=[baseline, commits],
+                outputs=[dataset_dir / "baseline" / f"{project}.csv"],
+                deps=["prepare-data", f"filter-commits:{project}"],
+                runtime_args=["--quiet"],
+                # Commits without method changes have no cache and stay "error" here
+                incremental=True,
+            ),
+        ]
+    stages.append(
+        Stage(
+            "combine-dataset",
+            script(
+                "data_utils.py",
+                "combine-dataset",
+                "--baseline-dir",
+                str(dataset_dir / "baseline"),
+                "--cuf-dir",
+                str(dataset_dir / "cuf"),
+                "--combined-dir",
+                str(dataset_dir / "combined"),
+                "--incremental",
+            ),
+            inputs=[dataset_dir / "baseline" / f"{p}.csv" for p in PROJECTS]
+            + [dataset_dir / "cuf" / f"{p}.csv" for p in PROJECTS],
+            outputs=[dataset_dir / "combined" / f"{p}.csv" for p in PROJECTS],
+            deps=[f"cuf-all:{p}" for p in projects] + [f"LT:{p}" for p in projects],
+            incremental=True,
+        )
+    )
+    return stages
+
+
+class Runner:
+    """
+    Run stages in dependency order, skipping those whose stamp and outputs are unchanged
+    """
+
+    def __init__(self, stages: List[Stage], cache_dir: Path, console: Console) -> None:
+        self.stages = {stage.name: stage for stage in stages}
+        self.cache_dir = cache_dir
+        self.console = console
+        self.cache_dir.mkdir(exist_ok=True, parents=True)
+        (self.cache_dir / "logs").mkdir(exist_ok=True)
+
+    def _record_path(self, stage: Stage) -> Path:
+        return self.cache_dir / f"{stage.name.replace(':', '.')}.json"
+
+    def _load_record(self, stage: Stage) -> Optional[dict]:
+        path = self._record_path(stage)
+        if not path.exists():
+            return None
+        with open(path) as f:
+            return json.load(f)
+
+    def up_to_date(self, stage: Stage, stamp: str) -> bool:
+        record = self._load_record(stage)
+        if record is None or record["stamp"] != stamp:
+            return False
+        # Outputs must still be the ones this stage produced
+        return all(
+            file_hash(path) == record["outputs"].get(str(path))
+            for path in stage.outputs
+        )
+
+    def only_appended(self, stage: Stage, record: dict) -> bool:
+        """
+        Whether the last run used the same command and every input only grew since
+        """
+        if record.get("command") != stage.command or "inputs" not in record:
+            return False
+        for path in stage.inputs:
+            previous = record["inputs"].get(str(path))
+            if previous is None or not path.exists():
+                return False
+            if path.stat().st_size < previous["size"]:
+                return False
+            if file_hash(path, previous["size"]) != previous["hash"]:
+                return False
+        return True
+
+    def clear_outputs(self, stage: Stage) -> None:
+        # Incremental commands keep existing rows, so they must start from scratch
+        for path in stage.outputs:
+            path.unlink(missing_ok=True)
+            path.with_suffix(".journal.jsonl").unlink(missing_ok=True)
+
+    def run_stage(self, stage: Stage, force: bool, dry_run: bool) -> tuple[str, float]:
+        start = time.perf_counter()
+        stamp = stage.stamp()
+        if not force and self.up_to_date(stage, stamp):
+            return "cached", time.perf_counter() - start
+        if dry_run:
+            return "would run", time.perf_counter() - start
+
+        record = self._load_record(stage)
+        if stage.incremental and record is not None and not self.only_appended(stage, record):
+            self.clear_outputs(stage)
+
+        log_path = self.cache_dir / "logs" / f"{stage.name.replace(':', '.')}.log"
+        with open(log_path, "w") as log:
+            process = subprocess.run(
+                stage.command + stage.runtime_args, stdout=log, stderr=subprocess.STDOUT
+            )
+        if process.returncode != 0:
+            return f"failed (see {log_path})", time.perf_counter() - start
+        errors = sum(error_rows(path) for path in stage.outputs) if stage.fail_on_errors else 0
+
+        record = {
+            # Without a stamp the next run retries the error rows incrementally
+            "stamp": None if errors else stamp,
+            "command": stage.command,
+            "inputs": {
+                str(path): {"size": path.stat().st_size, "hash": file_hash(path)}
+                for path in stage.inputs
+                if path.exists()
+            },
+            "outputs": {str(path): file_hash(path) for path in stage.outputs},
+        }
+        with open(self._record_path(stage), "w") as f:
+            json.dump(record, f, indent=4)
+        if errors:
+            return f"failed ({errors} error rows)", time.perf_counter() - start
+        return "done", time.perf_counter() - start
+
+    def run(self, workers: int, force: bool = False, dry_run: bool = False) -> dict:
+        results = {}
+        pending = dict(self.stages)
+        running = {}
+
+        with ThreadPoolExecutor(max_workers=workers) as executor:
+            while pending or running:
+                for name, stage in list(pending.items()):
+                    deps = [dep for dep in stage.deps if dep in self.stages]
+                    if any(dep not in results for dep in deps):
+                        continue
+                    del pending[name]
+                    if any(results[dep][0] not in ("done", "cached", "would run") for dep in deps):
+                        results[name] = ("skipped", 0.0)
+                        continue
+                    if dry_run and any(results[dep][0] == "would run" for dep in deps):
+                        # Its inputs are about to be rebuilt
+                        results[name] = ("would run", 0.0)
+                        continue
+                    running[executor.submit(self.run_stage, stage, force, dry_run)] = name
+
+                if not running:
+                    continue
+                finished, _ = wait(running, return_when=FIRST_COMPLETED)
+                for future in finished:
+                    name = running.pop(future)
+                    results[name] = future.result()
+                    status, elapsed = results[name]
+                    self.console.log(f"{name}: {status} ({elapsed:.1f}s)")
+
+        return {name: results[name] for name in self.stages}
+
+
+@app.command()
+def run(
+    projects: Annotated[
+        Optional[List[str]], Option("--project", help="Projects to build (default: all)")
+    ] = None,
+    dataset_dir: Annotated[Path, Option(help="Path to the dataset directory")] = Path(
+        "data/dataset"
+    ),
+    cache_dir: Annotated[Path, Option(help="Path to the pipeline cache")] = Path(
+        "data/cache/pipeline"
+    ),
+    engine: Annotated[
+        str, Option(help="Indentation engine for II: checkstyle|native")
+    ] = "checkstyle",
+    workers: Annotated[
+        int, Option(help="Number of stages to run concurrently")
+    ] = 4,
+    cuf_workers: Annotated[
+        int, Option(help="Worker processes for each cuf-all stage")
+    ] = 1,
+    force: Annotated[bool, Option(help="Run every stage even if it is up to date")] = False,
+):
+    """
+    Run the dataset pipeline, skipping stages whose inputs did not change
+    """
+    console = Console()
+    projects = projects or list(PROJECTS)
+    stages = build_stages(projects, dataset_dir, engine, cuf_workers)
+    results = Runner(stages, cache_dir, console).run(workers, force)
+    print_results(results, console)
+
+    if any(status.startswith("failed") for status, _ in results.values()):
+        raise SystemExit(1)
+
+
+@app.command()
+def status(
+    projects: Annotated[
+        Optional[List[str]], Option("--project", help="Projects to check (default: all)")
+    ] = None,
+    dataset_dir: Annotated[Path, Option(help="Path to the dataset directory")] = Path(
+        "data/dataset"
+    ),
+    cache_dir: Annotated[Path, Option(help="Path to the pipeline cache")] = Path(
+        "data/cache/pipeline"
+    ),
+    engine: Annotated[
+        str, Option(help="Indentation engine for II: checkstyle|native")
+    ] = "checkstyle",
+):
+    """
+    Show which stages of the dataset pipeline are up to date without running them
+    """
+    console = Console()
+    projects = projects or list(PROJECTS)
+    stages = build_stages(projects, dataset_dir, engine, cuf_workers=1)
+    results = Runner(stages, cache_dir, console).run(workers=1, dry_run=True)
+    print_results(results, console)
+
+
+def print_results(results: dict, console: Console) -> None:
+    table = Table(title="Pipeline")
+    table.add_column("Stage")
+    table.add_column("Status")
+    table.add_column("Time (s)", justify="right")
+    for name, (status, elapsed) in results.items():
+        table.add_row(name, status, f"{elapsed:.1f}")
+    console.print(table)
+
+
+if __name__ == "__main__":
+    app()
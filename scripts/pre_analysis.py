@@ -10,13 +10,17 @@ from typing_extensions import Annotated
 import typer
 import pandas as pd
 from tabulate import tabulate
-from scipy.stats import ranksums
-from cliffs_delta import cliffs_delta
 
 from neurojit.commit import Mining
 from data_utils import load_project_data
 from visualization import corr_plot, visualize_hmap
-from correlation import group_difference, significances
+from correlation import (
+    CorrelationRunner,
+    cliffs_size,
+    format_difference,
+    group_differences,
+    significance_table,
+)
 from environment import BASE_ALL, CUF_ALL, PROJECTS, COMBINED, CUF, BASELINE
 
 warnings.filterwarnings("ignore")
@@ -27,31 +31,39 @@ app = typer.Typer(
 
 
 @app.command()
-def plot_corr():
+def plot_corr(
+    per_project: Annotated[
+        bool, typer.Option(help="Also plot the correlations within each project")
+    ] = False,
+    workers: Annotated[int, typer.Option(help="Number of processes fitting models")] = 1,
+    cache_dir: Annotated[Path, typer.Option(help="Correlation cache directory")] = Path(
+        "data/cache/correlation"
+    ),
+):
     """
     (RQ1) Generate plots for Correlations between cuf Features and Defect-inducing Risks
     """
     data = load_project_data()
 
-    y = data["buggy"]
-    X = data[CUF]
-
-    results_cuf = significances(X, y, metrics=CUF)
-
-    X = data[COMBINED]
-    results_combined = significances(X, y, metrics=COMBINED)
+    runner = CorrelationRunner(data, COMBINED, cache_dir=cache_dir, workers=workers)
+    subsets = {"cuf": CUF, "combined": COMBINED}
+    projects = [None, *PROJECTS] if per_project else [None]
+    results = runner.run(subsets, projects=projects)
 
     save_dir = Path("data/output/plots/pre_analysis/significance")
-    save_dir.mkdir(exist_ok=True, parents=True)
+    for project in projects:
+        if results[("cuf", project)] is None or results[("combined", project)] is None:
+            print(f"Skipped {project}: the logistic regression failed")
+            continue
+        results_cuf = significance_table(results[("cuf", project)], CUF)
+        results_combined = significance_table(results[("combined", project)], COMBINED)
 
-    corr_plot(results_cuf, results_combined, save_dir=save_dir, top_k=9)
+        project_dir = save_dir if project is None else save_dir / project
+        project_dir.mkdir(exist_ok=True, parents=True)
+        corr_plot(results_cuf, results_combined, save_dir=project_dir, top_k=9)
 
     from rich import console
 
-    df_cuf = pd.DataFrame(results_cuf)
-    df_cuf = df_cuf.drop(["adjusted_odds", "abs_odds"], axis=1)
-    df_combined = pd.DataFrame(results_combined)
-    df_combined = df_combined.drop(["adjusted_odds", "abs_odds", "jit-sdp"], axis=1)
     console = console.Console()
 
     console.print("Saved plots to data/output/plots/pre_analysis/significance")
@@ -86,11 +98,10 @@ def table_group_diff(
     data = load_project_data()
     no_defects = data.loc[data["buggy"] == 0]
     defects = data.loc[data["buggy"] == 1]
+    p_values, deltas = group_differences(no_defects[CUF], defects[CUF])
     table = []
-    for metric in CUF:
-        gd = ranksums(no_defects[metric], defects[metric]).pvalue
-        d, res = cliffs_delta(no_defects[metric], defects[metric])
-        table.append([metric, gd, abs(d), res])
+    for metric, gd, d in zip(CUF, p_values, deltas):
+        table.append([metric, gd, abs(d), cliffs_size(d)])
 
     # sort by delta
     table = sorted(table, key=lambda x: x[2], reverse=True)
@@ -124,9 +135,9 @@ def table_group_diff_projects(
         no_defects = data.loc[(data["buggy"] == 0) & (data["project"] == project)]
         defects = data.loc[(data["buggy"] == 1) & (data["project"] == project)]
         row = [PROJECTS[project]]
-        for metric in CUF:
-            gd = group_difference(no_defects[metric], defects[metric], fmt="pair")
-            row.append(gd)
+        p_values, deltas = group_differences(no_defects[CUF], defects[CUF])
+        for p, d in zip(p_values, deltas):
+            row.append(format_difference(p, d, fmt="pair"))
         table.append(row)
     output = tabulate(
         table,
@@ -169,35 +180,18 @@ def table_distribution(
         avg_gap = data.loc[data["buggy"] == 1, "gap"].mean()
         commits_gap = round(avg_gap * commits_day, 1)
 
-        changed_methods = []
-        changed_lines = []
-        method_lts = []
-
         data = data.set_index("commit_id")
-        for commit_id, row in data.iterrows():
-            commit = Mining.load("data/cache", row["project"], commit_id)
-            if commit is None:
-                continue
-            la = 0
-            ld = 0
-            lt = 0
-            changed_methods.append(len(commit.methods_before))
-            for method in commit.methods_after:
-                la += len(method.added_lines)
-            for method in commit.methods_before:
-                ld += len(method.deleted_lines)
-                lt += method.loc
-            changed_lines.append(la + ld)
-            method_lts.append(lt)
+        # Commits without a cache file have NaN statistics, which the sums skip
+        stats = Mining.commit_stats("data/cache", project, data.index)
 
         table.append(
             [
                 PROJECTS[project],
                 f"{buggy} ({buggy / len(data) * 100:.2f}%)",
                 f"{len(data) - buggy} ({(len(data) - buggy) / len(data) * 100:.2f}%)",
-                sum(changed_methods) / len(data),
-                sum(changed_lines) / len(data),
-                sum(method_lts) / len(data),
+                stats["methods"].sum() / len(data),
+                (stats["LA"] + stats["LD"]).sum() / len(data),
+                stats["method_loc"].sum() / len(data),
                 commits_gap,
                 f"{start_date.date()} ~ {end_date.date()}",
             ]
@@ -0,0 +1,126 @@
+# Copyright (c) 2024 Hansae Ju
+# Licensed under the Apache License, Version 2.0
+# See the LICENSE file in the project root for license terms.
+
+from dataclasses import dataclass
+from pathlib import Path
+from typing import List
+
+import numpy as np
+import pandas as pd
+
+from environment import PROJECTS, PERFORMANCE_METRICS
+
+
+@dataclass
+class FoldProbabilities:
+    """
+    Test-set probabilities of every fold, concatenated in (project, fold) order
+
+    `keys` holds one (project, fold) row per fold and `group` maps every sample to
+    its row in `keys`.
+    """
+
+    keys: pd.DataFrame
+    group: np.ndarray
+    commit_id: np.ndarray
+    y_true: np.ndarray
+    proba: np.ndarray
+
+
+class ProbabilityCache:
+    """
+    Per-sample buggy-class probabilities of the test folds, one .npz file per fold
+    """
+
+    def __init__(self, cache_dir: Path = Path("data/cache/probabilities")) -> None:
+        self.cache_dir = Path(cache_dir)
+
+    def path(self, model: str, features: str, project: str, fold: int) -> Path:
+        return self.cache_dir / model / features / project / f"{fold}.npz"
+
+    @staticmethod
+    def save(path: Path, commit_ids, y_true, proba) -> None:
+        path.parent.mkdir(parents=True, exist_ok=True)
+        np.savez_compressed(
+            path,
+            commit_id=np.asarray(commit_ids, dtype="S40"),
+            y_true=np.asarray(y_true, dtype=np.int8),
+            proba=np.asarray(proba, dtype=np.float64),
+        )
+
+    def load(self, model: str, features: str) -> FoldProbabilities:
+        keys, groups, commit_ids, y_trues, probas = [], [], [], [], []
+        for project in PROJECTS:
+            project_dir = self.cache_dir / model / features / project
+            paths = sorted(project_dir.glob("*.npz"), key=lambda path: int(path.stem))
+            for path in paths:
+                with np.load(path) as fold:
+                    groups.append(np.full(len(fold["proba"]), len(keys)))
+                    commit_ids.append(fold["commit_id"])
+                    y_trues.append(fold["y_true"])
+                    probas.append(fold["proba"])
+                keys.append((project, int(path.stem)))
+        if not keys:
+            raise FileNotFoundError(
+                f"No probabilities of {model}_{features} in {self.cache_dir}"
+            )
+        return FoldProbabilities(
+            keys=pd.DataFrame(keys, columns=["project", "fold"]),
+            group=np.concatenate(groups),
+            commit_id=np.concatenate(commit_ids).astype(str),
+            y_true=np.concatenate(y_trues).astype(bool),
+            proba=np.concatenate(probas),
+        )
+
+
+def confusion_scores(tp, fp, fn, tn, squared_error) -> dict:
+    """
+    The metrics of evaluate() from confusion counts and summed squared errors of the
+    probabilities, for arrays of any shape
+    """
+    with np.errstate(divide="ignore", invalid="ignore"):
+        # sklearn scores undefined ratios as 0
+        f1_buggy = np.nan_to_num(2 * tp / (2 * tp + fp + fn))
+        f1_clean = np.nan_to_num(2 * tn / (2 * tn + fp + fn))
+        mcc = np.nan_to_num(
+            (tp * tn - fp * fn) / np.sqrt((tp + fp) * (tp + fn) * (tn + fp) * (tn + fn))
+        )
+        # ROC AUC of binary predictions is the balanced accuracy
+        auc = (tp / (tp + fn) + tn / (tn + fp)) / 2
+        fpr = fp / (fp + tn)
+        brier = squared_error / (tp + fp + fn + tn)
+    return {
+        "f1_macro": (f1_buggy + f1_clean) / 2,
+        "mcc": mcc,
+        "brier": brier,
+        "fpr": fpr,
+        "auc": auc,
+    }
+
+
+def evaluate_folds(
+    folds: FoldProbabilities,
+    threshold: float = 0.5,
+    metrics: List[str] = PERFORMANCE_METRICS,
+) -> pd.DataFrame:
+    """
+    The metrics of evaluate() for every fold at once, predicting buggy when proba > threshold
+    """
+    n_folds = len(folds.keys)
+    y_true, y_pred = folds.y_true, folds.proba > threshold
+
+    def count(values):
+        return np.bincount(folds.group, weights=values, minlength=n_folds)
+
+    scores = confusion_scores(
+        tp=count(y_true & y_pred),
+        fp=count(~y_true & y_pred),
+        fn=count(y_true & ~y_pred),
+        tn=count(~y_true & ~y_pred),
+        squared_error=count((folds.proba - y_true) ** 2),
+    )
+    result = folds.keys.copy()
+    for metric in metrics:
+        result[metric] = scores[metric]
+    return result
@@ -0,0 +1,197 @@
+# Copyright (c) 2024 Hansae Ju
+# Licensed under the Apache License, Version 2.0
+# See the LICENSE file in the project root for license terms.
+
+import time
+from pathlib import Path
+from typing import List, Optional
+
+import numpy as np
+import pandas as pd
+
+SAMPLE_COLUMNS = ["tp_samples", "pos_samples"]
+
+# Commit ids are coded by their first 15 hex digits (60 bits), which fit in an int64
+CODE_DIGITS = 15
+
+
+def commit_codes(commit_ids) -> np.ndarray:
+    return np.array([int(commit_id[:CODE_DIGITS], 16) for commit_id in commit_ids], dtype=np.int64)
+
+
+class ResultsStore:
+    """
+    Columnar fold scores: one row per (model, features, project, fold)
+
+    Scores are appended as parquet part files partitioned by model and features, with
+    the tp/pos commit lists stored as int64 commit codes. A code dictionary is kept
+    alongside to decode them. When a fold is written again, the latest part wins.
+    Once a partition (or the dictionary) has more than `max_parts` parts, they are
+    compacted into one.
+
+    pyarrow is imported on first use, so only commands using the store need it.
+    """
+
+    def __init__(self, root: Path = Path("data/output/results"), max_parts: int = 8) -> None:
+        self.root = Path(root)
+        self.max_parts = max_parts
+
+    @property
+    def dictionary_dir(self) -> Path:
+        return self.root / "_commits"
+
+    def append(self, model: str, scores: List[dict]) -> None:
+        import pyarrow as pa
+        import pyarrow.parquet as pq
+
+        if not scores:
+            return
+        df = pd.DataFrame(scores)
+        features = df["features"].iloc[0]
+        stamp = time.time_ns()
+
+        commit_ids = sorted(
+            {commit_id for column in SAMPLE_COLUMNS for ids in df[column] for commit_id in ids}
+        )
+        self.check_codes(commit_ids)
+        for column in SAMPLE_COLUMNS:
+            df[column] = df[column].map(commit_codes)
+        df["written"] = stamp
+        df = df.drop(columns=["features"])
+
+        part_dir = self.root / f"model={model}" / f"features={features}"
+        part_dir.mkdir(parents=True, exist_ok=True)
+        table = pa.Table.from_pandas(df, preserve_index=False)
+        pq.write_table(table, part_dir / f"part-{stamp}.parquet")
+
+        if commit_ids:
+            self.dictionary_dir.mkdir(parents=True, exist_ok=True)
+            dictionary = pd.DataFrame(
+                {"code": commit_codes(commit_ids), "commit_id": commit_ids}
+            )
+            dictionary.to_parquet(self.dictionary_dir / f"part-{stamp}.parquet", index=False)
+
+        if len(list(part_dir.glob("part-*.parquet"))) > self.max_parts:
+            self.compact_partition(part_dir)
+        if len(list(self.dictionary_dir.glob("part-*.parquet"))) > self.max_parts:
+            self.compact_dictionary()
+
+    def check_codes(self, commit_ids: List[str]) -> None:
+        """
+        Raise if two different commit ids would share a commit code
+        """
+        codes = pd.Series(commit_ids, index=commit_codes(commit_ids), dtype=object)
+        if self.dictionary_dir.exists() and any(self.dictionary_dir.glob("part-*.parquet")):
+            known = self.commit_ids()
+            codes = pd.concat([codes, known[known.index.isin(codes.index)]])
+        codes = codes.drop_duplicates()
+        collisions = codes[codes.index.duplicated(keep=False)]
+        if len(collisions):
+            pairs = collisions.groupby(level=0).agg(", ".join).to_list()
+            raise ValueError(f"Commit ids share their first {CODE_DIGITS} hex digits: {pairs}")
+
+    def compact(self) -> None:
+        """
+        Rewrite every partition and the dictionary as a single part
+        """
+        for part_dir in self.root.glob("model=*/features=*"):
+            self.compact_partition(part_dir)
+        if self.dictionary_dir.exists():
+            self.compact_dictionary()
+
+    def compact_partition(self, part_dir: Path) -> None:
+        parts = sorted(part_dir.glob("part-*.parquet"))
+        if len(parts) < 2:
+            return
+        df = pd.concat([pd.read_parquet(part) for part in parts], ignore_index=True)
+        df = df.sort_values("written", kind="stable")
+        df = df.drop_duplicates(["project", "fold"], keep="last").reset_index(drop=True)
+        self._replace_parts(parts, df)
+
+    def compact_dictionary(self) -> None:
+        parts = sorted(self.dictionary_dir.glob("part-*.parquet"))
+        if len(parts) < 2:
+            return
+        df = pd.concat([pd.read_parquet(part) for part in parts], ignore_index=True)
+        self._replace_parts(parts, df.drop_duplicates("code").reset_index(drop=True))
+
+    @staticmethod
+    def _replace_parts(parts: List[Path], df: pd.DataFrame) -> None:
+        # Readers skip dot files; an interrupted compaction leaves duplicates, never gaps
+        part_dir = parts[0].parent
+        stamp = time.time_ns()
+        tmp_path = part_dir / f".part-{stamp}.parquet"
+        df.to_parquet(tmp_path, index=False)
+        tmp_path.replace(part_dir / f"part-{stamp}.parquet")
+        for part in parts:
+            part.unlink()
+
+    def contains(self, model: str, features: str) -> bool:
+        part_dir = self.root / f"model={model}" / f"features={features}"
+        return part_dir.exists() and any(part_dir.glob("part-*.parquet"))
+
+    def read(
+        self,
+        model: Optional[str] = None,
+        features: Optional[str] = None,
+        columns: Optional[List[str]] = None,
+        decode: bool = False,
+    ) -> pd.DataFrame:
+        """
+        Latest scores, reading only `columns` (plus the keys) from the partitions asked for.
+        Sample columns hold commit codes unless `decode` maps them back to commit ids.
+        """
+        import pyarrow.dataset as ds
+
+        dataset = ds.dataset(
+            self.root, format="parquet", partitioning="hive", exclude_invalid_files=True,
+            ignore_prefixes=["_", "."],
+        )
+        keys = ["model", "features", "project", "fold", "written"]
+        if columns is not None:
+            columns = keys + [column for column in columns if column not in keys]
+        expression = None
+        for name, value in (("model", model), ("features", features)):
+            if value is not None:
+                condition = ds.field(name) == value
+                expression = condition if expression is None else expression & condition
+        df = dataset.to_table(columns=columns, filter=expression).to_pandas()
+        for name in ("model", "features"):
+            df[name] = df[name].astype(str)
+
+        df = df.sort_values("written", kind="stable")
+        df = df.drop_duplicates(["model", "features", "project", "fold"], keep="last")
+        df = df.sort_values(["model", "features"], kind="stable")
+        df = df.drop(columns=["written"]).reset_index(drop=True)
+        if decode:
+            df = self.decode(df)
+        return df
+
+    def commit_ids(self) -> pd.Series:
+        """
+        commit code -> commit id
+        """
+        dictionary = pd.read_parquet(self.dictionary_dir)
+        dictionary = dictionary.drop_duplicates()
+        if dictionary["code"].duplicated().any():
+            raise ValueError(f"Commit codes with several commit ids in {self.dictionary_dir}")
+        return dictionary.set_index("code")["commit_id"]
+
+    def decode(self, df: pd.DataFrame) -> pd.DataFrame:
+        """
+        Sample columns of `df` as lists of commit ids, like the JSON outputs
+        """
+        columns = [column for column in SAMPLE_COLUMNS if column in df.columns]
+        if not columns:
+            return df
+        commit_ids = self.commit_ids()
+        df = df.copy()
+        for column in columns:
+            codes = [np.asarray(values, dtype=np.int64) for values in df[column]]
+            positions = commit_ids.index.get_indexer(np.concatenate(codes) if codes else [])
+            if np.any(positions < 0):
+                raise KeyError(f"Commit codes of {column} missing from {self.dictionary_dir}")
+            ids = commit_ids.values[positions].tolist()
+            bounds = np.cumsum([0] + [len(values) for values in codes])
+            df[column] = [ids[start:end] for start, end in zip(bounds[:-1], bounds[1:])]
+        return df
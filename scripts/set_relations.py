@@ -0,0 +1,92 @@
+# Copyright (c) 2024 Hansae Ju
+# Licensed under the Apache License, Version 2.0
+# See the LICENSE file in the project root for license terms.
+
+from typing import List, Tuple
+
+import numpy as np
+import pandas as pd
+
+from environment import PROJECTS
+
+
+class SetRelations:
+    """
+    Relationships between the sample sets of fold results (e.g. tp_samples of two feature sets)
+
+    Commit ids are encoded as integers once, and each side is stored as a sorted array
+    of unique (fold group, commit code) keys, so every pair of sides is compared over
+    all (project, fold) groups with one intersection.
+
+    As with set(df[samples].explode()), a fold whose list is empty contributes a NaN
+    that matches nothing on the other side.
+    """
+
+    def __init__(
+        self, result_df: pd.DataFrame, samples: str = "tp_samples", key: str = "features"
+    ) -> None:
+        groups = result_df[["project", "fold"]].drop_duplicates()
+        project_order = {project: i for i, project in enumerate(PROJECTS)}
+        groups = groups.assign(order=groups["project"].map(project_order))
+        groups = groups.sort_values(["order", "fold"], kind="stable")
+        self.groups = groups[["project", "fold"]].reset_index(drop=True)
+
+        group_index = pd.MultiIndex.from_frame(self.groups).get_indexer(
+            pd.MultiIndex.from_frame(result_df[["project", "fold"]])
+        )
+        exploded = pd.DataFrame(
+            {
+                "side": result_df[key].values,
+                "group": group_index,
+                "sample": result_df[samples].values,
+            }
+        ).explode("sample")
+        # Missing samples (empty lists) get code -1
+        codes, _ = pd.factorize(exploded["sample"])
+        exploded["code"] = codes
+
+        self.sides = {}
+        self.empty = {}
+        for side, side_df in exploded.groupby("side", sort=False):
+            group, code = side_df["group"].values.astype(np.int64), side_df["code"].values
+            present = code >= 0
+            self.sides[side] = np.unique((group[present] << 32) | code[present])
+            self.empty[side] = np.bincount(group[~present], minlength=len(self.groups))
+
+    def sizes(self, side) -> np.ndarray:
+        return (
+            np.bincount(self.sides[side] >> 32, minlength=len(self.groups)) + self.empty[side]
+        )
+
+    def compare(self, side_a, side_b) -> pd.DataFrame:
+        """
+        only_a / intersection / only_b ratios of the union per (project, fold) group,
+        leaving out groups whose union is empty
+        """
+        common = np.intersect1d(self.sides[side_a], self.sides[side_b], assume_unique=True)
+        intersection = np.bincount(common >> 32, minlength=len(self.groups))
+        size_a, size_b = self.sizes(side_a), self.sizes(side_b)
+        union = size_a + size_b - intersection
+
+        result = self.groups.copy()
+        result["only_a"] = (size_a - intersection) / np.where(union == 0, 1, union)
+        result["intersection"] = intersection / np.where(union == 0, 1, union)
+        result["only_b"] = (size_b - intersection) / np.where(union == 0, 1, union)
+        return result.loc[union > 0].reset_index(drop=True)
+
+    def compare_all(self, pairs: List[Tuple]) -> pd.DataFrame:
+        """
+        compare() for many (side_a, side_b) pairs, in one frame
+        """
+        frames = [
+            self.compare(side_a, side_b).assign(side_a=side_a, side_b=side_b)
+            for side_a, side_b in pairs
+        ]
+        return pd.concat(frames, ignore_index=True)
+
+    def project_means(self, side_a, side_b) -> pd.DataFrame:
+        """
+        Mean ratios over the folds of each project, in PROJECTS order
+        """
+        ratios = self.compare(side_a, side_b)
+        return ratios.groupby("project", sort=False)[["only_a", "intersection", "only_b"]].mean()
@@ -0,0 +1,145 @@
+# Copyright (c) 2024 Hansae Ju
+# Licensed under the Apache License, Version 2.0
+# See the LICENSE file in the project root for license terms.
+
+import os
+import json
+import shutil
+import hashlib
+from pathlib import Path
+
+import numpy as np
+import pandas as pd
+
+from environment import PROJECTS
+
+DATE_COLUMNS = ["date", "fix_date"]
+
+
+class DatasetSnapshot:
+    """
+    Typed binary snapshot of the combined dataset (all projects, in PROJECTS order)
+
+    Every column is stored as a .npy file next to a meta.json describing it:
+        - commit_id: int32 codes into a sorted array of the commit hashes
+        - text columns (project, repo, ...): int16 codes of a categorical
+        - date columns: datetime64[ns]
+        - bool and numeric columns: their CSV dtype, plus one float32 matrix of all
+          numeric columns
+    Snapshots live in a directory named after the sizes and modification times of the
+    CSVs, so editing the dataset creates a new snapshot instead of reading a stale one
+    without reading the CSVs on every load. Arrays are memory-mapped copy-on-write
+    and the frame is built on them without copying.
+    """
+
+    def __init__(
+        self,
+        base_dir: str = "data/dataset/combined",
+        cache_dir: Path = Path("data/cache/snapshots"),
+    ) -> None:
+        self.base_dir = Path(base_dir)
+        self.cache_dir = Path(cache_dir)
+
+    def csv_paths(self) -> list[Path]:
+        return [self.base_dir / f"{project}.csv" for project in PROJECTS]
+
+    def version(self) -> str:
+        hasher = hashlib.sha1()
+        for path in self.csv_paths():
+            stat = path.stat()
+            hasher.update(f"{path.name}:{stat.st_size}:{stat.st_mtime_ns}".encode())
+        return hasher.hexdigest()[:16]
+
+    def load(self, dtype: str = "float64") -> pd.DataFrame:
+        """
+        The dataset with numeric columns with their CSV dtypes (dtype="float64", values
+        identical to reading the CSVs) or as float32 (dtype="float32")
+        """
+        path = self.cache_dir / self.version()
+        if not (path / "meta.json").exists():
+            self.build(path)
+        return self.read(path, dtype)
+
+    def build(self, path: Path) -> None:
+        frames = [pd.read_csv(csv_path) for csv_path in self.csv_paths()]
+        data = pd.concat(frames)
+
+        tmp_path = path.with_name(path.name + ".tmp")
+        shutil.rmtree(tmp_path, ignore_errors=True)
+        tmp_path.mkdir(parents=True)
+
+        columns, numeric = [], []
+        for name in data.columns:
+            values = data[name]
+            column = {"name": name}
+            if name == "commit_id":
+                column["kind"] = "commit"
+                hashes, codes = np.unique(values.to_numpy(dtype=str), return_inverse=True)
+                np.save(tmp_path / "commit_hashes.npy", hashes.astype("S"))
+                np.save(tmp_path / f"{name}.npy", codes.astype(np.int32))
+            elif name in DATE_COLUMNS:
+                column["kind"] = "datetime"
+                np.save(tmp_path / f"{name}.npy", pd.to_datetime(values).to_numpy())
+            elif values.dtype == object:
+                column["kind"] = "category"
+                categories = list(PROJECTS) if name == "project" else None
+                categorical = pd.Categorical(values, categories=categories)
+                column["categories"] = categorical.categories.tolist()
+                np.save(tmp_path / f"{name}.npy", categorical.codes.astype(np.int16))
+            elif values.dtype == bool:
+                column["kind"] = "bool"
+                np.save(tmp_path / f"{name}.npy", values.to_numpy())
+            else:
+                column["kind"] = "numeric"
+                column["dtype"] = str(values.dtype)
+                np.save(tmp_path / f"{name}.npy", values.to_numpy())
+                numeric.append(name)
+            columns.append(column)
+        np.save(tmp_path / "numeric_float32.npy", data[numeric].to_numpy(dtype=np.float32))
+
+        meta = {
+            "columns": columns,
+            "numeric": numeric,
+            "rows": [len(frame) for frame in frames],
+            "sources": [str(csv_path) for csv_path in self.csv_paths()],
+        }
+        with open(tmp_path / "meta.json", "w") as f:
+            json.dump(meta, f, indent=4)
+        shutil.rmtree(path, ignore_errors=True)
+        os.replace(tmp_path, path)
+
+    @staticmethod
+    def read(path: Path, dtype: str = "float64") -> pd.DataFrame:
+        with open(path / "meta.json") as f:
+            meta = json.load(f)
+
+        def array(name):
+            return np.load(path / f"{name}.npy", mmap_mode="c")
+
+        if dtype == "float32":
+            numeric = dict(zip(meta["numeric"], array("numeric_float32").T))
+        elif dtype == "float64":
+            numeric = {name: array(name) for name in meta["numeric"]}
+        else:
+            raise ValueError(f"Not supported dtype: {dtype}")
+
+        data = {}
+        for column in meta["columns"]:
+            name = column["name"]
+            match column["kind"]:
+                case "commit":
+                    hashes = array("commit_hashes").astype(str)
+                    data[name] = pd.Categorical.from_codes(array(name), categories=hashes)
+                case "category":
+                    data[name] = pd.Categorical.from_codes(
+                        array(name), categories=column["categories"]
+                    )
+                case "numeric":
+                    data[name] = numeric[name]
+                case _:
+                    data[name] = array(name)
+
+        # The index of concatenating the project CSVs
+        index = np.concatenate([np.arange(n) for n in meta["rows"]])
+        # Without copy=False, the columns would be consolidated into copied 2D blocks
+        return pd.DataFrame(data, index=index, copy=False)
@@ -4,14 +4,17 @@
 
 from dataclasses import dataclass
 from itertools import zip_longest
+import json
 import pickle
 import re
+import subprocess
 from typing import Union
 from git import Repo
 from javalang.parser import JavaSyntaxError
 from javalang.parse import parse
 from typing import Set, Optional
 from pathlib import Path
+import pandas as pd
 from pydriller.domain.commit import Commit, ModificationType
 from pydriller import Git
 import javalang
@@ -201,6 +204,25 @@ class MethodChangesCommit:
     methods_before: Set[Method]
     methods_after: Set[Method]
 
+    def stats(self) -> dict:
+        """
+        Change statistics: changed methods, added/deleted lines in them, lines of the
+        files they belong to (LT) and lines of the methods themselves
+        """
+        before_code_files = {method.code for method in self.methods_before}
+        return {
+            "commit_hash": self.commit_hash,
+            "methods": len(self.methods_before),
+            "LA": sum(len(method.added_lines) for method in self.methods_after),
+            "LD": sum(len(method.deleted_lines) for method in self.methods_before),
+            "LT": sum(len(code.splitlines()) for code in before_code_files),
+            "method_loc": sum(method.loc for method in self.methods_before),
+        }
+
+
+# Columns of the per-project change statistics sidecar written by Mining.save
+STATS_COLUMNS = ["commit_hash", "methods", "LA", "LD", "LT", "method_loc"]
+
 
 class Mining:
     """
@@ -313,10 +335,77 @@ class Mining:
             path.parent.mkdir(parents=True, exist_ok=True)
             with open(path, "wb") as f:
                 pickle.dump(commit, f)
+            Mining.append_stats(commit, base_dir)
         except Exception as e:
             print(e)
             raise e
 
+    @staticmethod
+    def stats_path(base_dir: str, repo: str) -> Path:
+        return Path(base_dir) / f"{repo}.stats.csv"
+
+    @staticmethod
+    def append_stats(commit: MethodChangesCommit, base_dir: str = "data/cache") -> None:
+        """
+        Append the commit's change statistics to the sidecar of its repository
+        """
+        path = Mining.stats_path(base_dir, commit.repo)
+        stats = commit.stats()
+        with open(path, "a") as f:
+            if f.tell() == 0:
+                f.write(",".join(STATS_COLUMNS) + "\n")
+            f.write(",".join(str(stats[column]) for column in STATS_COLUMNS) + "\n")
+
+    @staticmethod
+    def load_stats(base_dir: str, repo: str) -> pd.DataFrame:
+        """
+        Change statistics of the cached commits of a repository, indexed by commit hash
+        """
+        path = Mining.stats_path(base_dir, repo)
+        if not path.exists():
+            return pd.DataFrame(columns=STATS_COLUMNS).set_index("commit_hash")
+        # A torn last line from an interrupted write has missing fields
+        stats = pd.read_csv(path, dtype={"commit_hash": str}, on_bad_lines="skip")
+        stats = stats.dropna()
+        stats = stats.drop_duplicates("commit_hash", keep="last")
+        return stats.set_index("commit_hash").astype(int)
+
+    @staticmethod
+    def commit_stats(base_dir: str, repo: str, commit_hashes) -> pd.DataFrame:
+        """
+        Change statistics of `commit_hashes` (NaN rows for commits without a cache file).
+        Cached commits missing from the sidecar are loaded once and added to it.
+        """
+        stats = Mining.load_stats(base_dir, repo)
+        missing = pd.Index(commit_hashes).difference(stats.index)
+        added = []
+        for commit_hash in missing:
+            if not Mining.check(base_dir, repo, commit_hash):
+                continue
+            commit = Mining.load(base_dir, repo, commit_hash)
+            Mining.append_stats(commit, base_dir)
+            added.append(commit.stats())
+        if added:
+            added = pd.DataFrame(added, columns=STATS_COLUMNS).set_index("commit_hash")
+            stats = pd.concat([stats, added])
+        return stats.reindex(commit_hashes)
+
+    @staticmethod
+    def write_stats(base_dir: str, repo: str) -> pd.DataFrame:
+        """
+        (Re)build the sidecar of a repository from all of its cache files
+        """
+        stats = []
+        for path in sorted((Path(base_dir) / repo).glob("*.pkl")):
+            with open(path, "rb") as f:
+                stats.append(pickle.load(f).stats())
+        stats = pd.DataFrame(stats, columns=STATS_COLUMNS)
+        path = Mining.stats_path(base_dir, repo)
+        tmp_path = path.with_suffix(".tmp")
+        stats.to_csv(tmp_path, index=False)
+        tmp_path.replace(path)
+        return stats.set_index("commit_hash")
+
     @staticmethod
     def load(
         base_dir: str, repo: str, commit_hash: str
@@ -335,12 +424,17 @@ class Mining:
         return path.exists()
 
 
-def commit_from(
-    project: str, commit_hash: str, base_dir: str = "data/repo", author: str = 'apache'
-) -> Union[Commit, Exception]:
+def clone_repo(project: str, base_dir: str = "data/repo", author: str = "apache") -> str:
     repo_path = f"{base_dir}/{project}"
     if not Path(repo_path).exists():
         Repo.clone_from(f"https://github.com/{author}/{project}.git", repo_path)
+    return repo_path
+
+
+def commit_from(
+    project: str, commit_hash: str, base_dir: str = "data/repo", author: str = 'apache'
+) -> Union[Commit, Exception]:
+    repo_path = clone_repo(project, base_dir, author)
     try:
         return Git(repo_path).get_commit(commit_hash)
 
@@ -353,13 +447,109 @@ def commit_from(
             return type(e)
 
 
-def issue_key_from(project: str, commit_hash: str) -> str:
-    commit = commit_from(project, commit_hash)
+# Jira issue key pattern
+ISSUE_KEY = re.compile(r"([A-Z]+-\d+)")
+
+
+def issue_key_from(
+    project: str, commit_hash: str, base_dir: str = "data/repo", author: str = "apache"
+) -> Optional[str]:
+    commit = commit_from(project, commit_hash, base_dir, author)
+    try:
+        message = commit.msg
+    except (AttributeError, ValueError):
+        # commit_from returned an error, or the commit is not in the clone
+        return None
 
-    # Jira issue key pattern
-    pattern = re.compile(r"([A-Z]+-\d+)")
-    match = pattern.search(commit.msg)
+    match = ISSUE_KEY.search(message)
     if match:
         return match.group(1)
     else:
         return None
+
+
+class IssueKeyIndex:
+    """
+    Commit hash -> Jira issue key of every commit on any ref of a repository, built from
+    one `git log --all` pass and persisted as JSON
+    """
+
+    def __init__(
+        self,
+        project: str,
+        base_dir: str = "data/repo",
+        cache_dir: str = "data/cache/issues",
+        author: str = "apache",
+    ):
+        self.project = project
+        self.base_dir = base_dir
+        self.author = author
+        self.path = Path(cache_dir) / f"{project}.json"
+        self.keys = None
+        self.fresh = False
+
+    def __getitem__(self, commit_hash: str) -> Optional[str]:
+        return self.get(commit_hash)
+
+    def __contains__(self, commit_hash: str) -> bool:
+        return commit_hash in self.load()
+
+    def get(self, commit_hash: str) -> Optional[str]:
+        keys = self.load()
+        if commit_hash not in keys and not self.fresh:
+            # The index may predate the commit; rebuild it at most once
+            keys = self.build()
+        if commit_hash not in keys:
+            # Not reachable from any ref, e.g. a commit of a deleted branch
+            return issue_key_from(self.project, commit_hash, self.base_dir, self.author)
+        return keys[commit_hash]
+
+    def load(self) -> dict:
+        if self.keys is None:
+            if self.path.exists():
+                with open(self.path) as f:
+                    self.keys = json.load(f)
+            else:
+                self.build()
+        return self.keys
+
+    def build(self) -> dict:
+        repo_path = clone_repo(self.project, self.base_dir, self.author)
+        process = subprocess.Popen(
+            ["git", "log", "--all", "--format=%H%x00%B%x1e"],
+            cwd=repo_path,
+            stdout=subprocess.PIPE,
+            text=True,
+            errors="replace",
+        )
+        keys = {}
+        for record in _records(process.stdout, "\x1e"):
+            commit_hash, _, message = record.lstrip("\n").partition("\x00")
+            if not commit_hash:
+                continue
+            match = ISSUE_KEY.search(message)
+            keys[commit_hash] = match.group(1) if match else None
+        if process.wait() != 0:
+            raise RuntimeError(f"git log failed in {repo_path}")
+
+        self.keys = keys
+        self.fresh = True
+        self.save()
+        return keys
+
+    def save(self) -> None:
+        self.path.parent.mkdir(parents=True, exist_ok=True)
+        tmp_path = self.path.with_suffix(".tmp")
+        with open(tmp_path, "w") as f:
+            json.dump(self.keys, f)
+        tmp_path.replace(self.path)
+
+
+def _records(stream, separator: str, chunk_size: int = 1 << 20):
+    buffer = ""
+    for chunk in iter(lambda: stream.read(chunk_size), ""):
+        buffer += chunk
+        *records, buffer = buffer.split(separator)
+        yield from records
+    if buffer:
+        yield buffer
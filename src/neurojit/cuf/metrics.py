@@ -2,6 +2,9 @@
 # Licensed under the Apache License, Version 2.0
 # See the LICENSE file in the project root for license terms.
 
+import asyncio
+from functools import cached_property
+
 import numpy as np
 
 from javalang.tree import (
@@ -14,7 +17,14 @@ from javalang.tree import (
 from neurojit.cuf.halstead import halstead
 from neurojit.cuf.cfg import CFG, use_def_graph
 from neurojit.commit import Method, MethodChangesCommit
-from neurojit.cuf.rii import incorrect_indentation_ratio
+from neurojit.cuf.rii import (
+    incorrect_indentation_ratio,
+    incorrect_indentation_ratios_async,
+    CheckstyleScheduler,
+    run_sync,
+)
+
+METRICS = ["HV", "TE", "DD", "DD_HV", "MDNL", "NB", "EC", "NOP", "NOGV", "NOMT", "II"]
 
 
 class MethodUnderstandabilityFeatures:
@@ -29,15 +39,24 @@ class MethodUnderstandabilityFeatures:
         checkstyle_path: str,
         xml_path: str,
         checkstyle_cache_dir: str,
+        engine: str = "checkstyle",
     ) -> None:
         self.method = method
-        self.cfg = CFG(self.method)
-        self.cfg.compute_reaching_definitions()
-        self.halstead = halstead(self.method)
         self.commit_hash = commit_hash
         self.checkstyle_path = checkstyle_path
         self.xml_path = xml_path
         self.checkstyle_cache_dir = checkstyle_cache_dir
+        self.engine = engine
+
+    @cached_property
+    def cfg(self) -> CFG:
+        cfg = CFG(self.method)
+        cfg.compute_reaching_definitions()
+        return cfg
+
+    @cached_property
+    def halstead(self) -> dict:
+        return halstead(self.method)
 
     @property
     def HV(self):
@@ -148,7 +167,7 @@ class MethodUnderstandabilityFeatures:
     @property
     def II(self):
         """
-        IncorrectIndentations (II): The number of warnings for incorrect indentations examined by Checkstyle.
+        IncorrectIndentations (II): The number of warnings for incorrect indentations examined by Checkstyle (or its native reimplementation if engine="native").
         """
         return incorrect_indentation_ratio(
             self.method,
@@ -156,6 +175,7 @@ class MethodUnderstandabilityFeatures:
             cache_dir=self.checkstyle_cache_dir,
             checkstyle_path=self.checkstyle_path,
             xml_path=self.xml_path,
+            engine=self.engine,
         )
 
 
@@ -171,9 +191,13 @@ class CommitUnderstandabilityFeatures:
         xml_path="indentation_config.xml",
         checkstyle_cache_dir="data/cache/checkstyle",
         by="mean",
+        engine="checkstyle",
+        max_concurrency=4,
     ) -> None:
         self.commit = commit
         self.by = by
+        self.engine = engine
+        self.max_concurrency = max_concurrency
 
         self.method_metrics = [
             MethodUnderstandabilityFeatures(
@@ -182,6 +206,7 @@ class CommitUnderstandabilityFeatures:
                 checkstyle_path,
                 xml_path,
                 checkstyle_cache_dir,
+                engine,
             )
             for method in self.commit.methods_after
         ]
@@ -191,14 +216,21 @@ class CommitUnderstandabilityFeatures:
         checkstyle_path="checkstyle.jar",
         xml_path="indentation_config.xml",
         checkstyle_cache_dir="data/cache/checkstyle",
+        engine=None,
     ):
+        if engine is not None:
+            self.engine = engine
         for metric in self.method_metrics:
             metric.checkstyle_path = checkstyle_path
             metric.xml_path = xml_path
             metric.checkstyle_cache_dir = checkstyle_cache_dir
+            metric.engine = self.engine
 
     def _aggregate(self, metric: str):
         values = [getattr(method, metric) for method in self.method_metrics]
+        return self._aggregate_values(values)
+
+    def _aggregate_values(self, values: list):
         if self.by == "max":
             return max(values)
         elif self.by == "min":
@@ -214,19 +246,37 @@ class CommitUnderstandabilityFeatures:
 
     @property
     def all(self):
-        return {
-            "HV": self.HV,
-            "TE": self.TE,
-            "DD": self.DD,
-            "DD_HV": self.DD_HV,
-            "MDNL": self.MDNL,
-            "NB": self.NB,
-            "EC": self.EC,
-            "NOP": self.NOP,
-            "NOGV": self.NOGV,
-            "NOMT": self.NOMT,
-            "II": self.II,
-        }
+        return run_sync(self.all_async())
+
+    async def all_async(self):
+        """
+        All features of the commit. The CFG-based features of the methods are
+        computed in a worker thread while the Checkstyle jobs for II run on the
+        event loop. If anything fails, the II jobs are cancelled.
+        """
+        ii = asyncio.create_task(self.II_async())
+        try:
+            metrics = [metric for metric in METRICS if metric != "II"]
+            values = await asyncio.get_running_loop().run_in_executor(
+                None, self._method_values, metrics
+            )
+            features = {
+                metric: self._aggregate_values(method_values)
+                for metric, method_values in values.items()
+            }
+            features["II"] = await ii
+        finally:
+            if not ii.done():
+                ii.cancel()
+                await asyncio.gather(ii, return_exceptions=True)
+        return features
+
+    def _method_values(self, metrics: list) -> dict:
+        values = {metric: [] for metric in metrics}
+        for method in self.method_metrics:
+            for metric in metrics:
+                values[metric].append(getattr(method, metric))
+        return values
 
     @property
     def HV(self):
@@ -270,4 +320,22 @@ class CommitUnderstandabilityFeatures:
 
     @property
     def II(self):
-        return self._aggregate("II")
+        return run_sync(self.II_async())
+
+    async def II_async(self):
+        if not self.method_metrics:
+            return self._aggregate_values([])
+        # All methods share the same paths, so evaluate them as one batch
+        metric = self.method_metrics[0]
+        values = await incorrect_indentation_ratios_async(
+            [method.method for method in self.method_metrics],
+            self.commit.commit_hash,
+            cache_dir=metric.checkstyle_cache_dir,
+            checkstyle_path=metric.checkstyle_path,
+            xml_path=metric.xml_path,
+            engine=metric.engine,
+            scheduler=CheckstyleScheduler(
+                metric.checkstyle_path, metric.xml_path, self.max_concurrency
+            ),
+        )
+        return self._aggregate_values(values)
@@ -2,51 +2,327 @@
 # Licensed under the Apache License, Version 2.0
 # See the LICENSE file in the project root for license terms.
 
+import os
+import json
+import asyncio
+import hashlib
+import shutil
+import sqlite3
 import subprocess
+import threading
+from concurrent.futures import ThreadPoolExecutor
+from functools import lru_cache
 from pathlib import Path
+from tempfile import TemporaryDirectory
+from typing import Optional
+
+import javalang
+from javalang.tokenizer import Identifier
 
 from neurojit.commit import Method
 
+ENGINES = ("checkstyle", "native")
 
-def shorten(file_path: Path, max_length=250) -> Path:
-    if len(str(file_path)) <= max_length:
-        return file_path
-    left_length = max_length - len(str(file_path.parent)) - len(file_path.suffix) - 3
-    window = left_length // 3
-    shortened_file_path = (
-        file_path.stem[:window] + "..." + file_path.stem[-window:] + file_path.suffix
-    )
+# Defaults of the Checkstyle Indentation module (basicOffset, caseIndent,
+# throwsIndent, arrayInitIndent, lineWrappingIndentation) and its tabWidth
+INDENT_SIZE = 4
+TAB_WIDTH = 8
+
+CONTROL_KEYWORDS = {"if", "while", "for", "switch", "catch", "synchronized"}
+BODY_KEYWORDS = {"else", "do", "try", "finally"}
+
+
+class IndentationStore:
+    """
+    A single SQLite store of II values and raw violation lines, keyed by the
+    method content hash and the engine configuration hash.
+    """
+
+    _connections = {}
+
+    def __init__(self, cache_dir) -> None:
+        self.path = Path(cache_dir) / "indentation.sqlite"
+        self.path.parent.mkdir(exist_ok=True, parents=True)
+        # connections must not be shared across forked processes or threads
+        key = (str(self.path), os.getpid(), threading.get_ident())
+        if key not in self._connections:
+            connection = sqlite3.connect(self.path, timeout=60)
+            connection.execute(
+                "CREATE TABLE IF NOT EXISTS results ("
+                "method_key TEXT, config_key TEXT, commit_hash TEXT, "
+                "value REAL, violations TEXT, "
+                "PRIMARY KEY (method_key, config_key))"
+            )
+            connection.execute(
+                "CREATE INDEX IF NOT EXISTS results_commit ON results (commit_hash)"
+            )
+            connection.execute(
+                "CREATE TABLE IF NOT EXISTS conformance_runs ("
+                "config_key TEXT PRIMARY KEY, project TEXT, "
+                "fixtures INTEGER, fixtures_matched INTEGER, "
+                "methods INTEGER, methods_matched INTEGER, min_agreement REAL)"
+            )
+            connection.commit()
+            self._connections[key] = connection
+        self.connection = self._connections[key]
+
+    @staticmethod
+    def method_key(method: Method) -> str:
+        # II depends on the whole file (Checkstyle parses it) and the method range
+        content = f"{method.start_line}:{method.end_line}:{method.code}"
+        return hashlib.sha1(content.encode()).hexdigest()
+
+    @staticmethod
+    def config_key(checkstyle_path, xml_path, engine="checkstyle") -> str:
+        xml = Path(xml_path)
+        config = xml.read_text() if xml.exists() else str(xml_path)
+        content = f"{engine}:{Path(checkstyle_path).name}:{config}"
+        return hashlib.sha1(content.encode()).hexdigest()
+
+    def get(self, method_key: str, config_key: str) -> Optional[float]:
+        row = self.connection.execute(
+            "SELECT value FROM results WHERE method_key = ? AND config_key = ?",
+            (method_key, config_key),
+        ).fetchone()
+        return None if row is None else row[0]
 
-    return file_path.parent / shortened_file_path
+    def load_commit(self, commit_hash: str, config_key: str) -> dict[str, float]:
+        rows = self.connection.execute(
+            "SELECT method_key, value FROM results WHERE commit_hash = ? AND config_key = ?",
+            (commit_hash, config_key),
+        )
+        return dict(rows.fetchall())
+
+    def violations(self, method_key: str, config_key: str) -> Optional[list[int]]:
+        row = self.connection.execute(
+            "SELECT violations FROM results WHERE method_key = ? AND config_key = ?",
+            (method_key, config_key),
+        ).fetchone()
+        return None if row is None else json.loads(row[0])
+
+    def put_many(self, records: list[tuple]) -> None:
+        """
+        records: (method_key, config_key, commit_hash, value, violations)
+        """
+        self.connection.executemany(
+            "INSERT OR REPLACE INTO results VALUES (?, ?, ?, ?, ?)",
+            [
+                (method_key, config_key, commit_hash, value, json.dumps(violations))
+                for method_key, config_key, commit_hash, value, violations in records
+            ],
+        )
+        self.connection.commit()
+
+    def put_conformance(
+        self, config_key: str, project: str, fixtures, methods, min_agreement: float
+    ) -> None:
+        """
+        fixtures, methods: (checked, matched) counts of an ii-conformance run, with the
+        method agreement rate the native engine needs to be used
+        """
+        self.connection.execute(
+            "INSERT OR REPLACE INTO conformance_runs VALUES (?, ?, ?, ?, ?, ?, ?)",
+            (config_key, project, *fixtures, *methods, min_agreement),
+        )
+        self.connection.commit()
+
+    def conformance(self, config_key: str) -> Optional[dict]:
+        keys = [
+            "project",
+            "fixtures",
+            "fixtures_matched",
+            "methods",
+            "methods_matched",
+            "min_agreement",
+        ]
+        row = self.connection.execute(
+            f"SELECT {', '.join(keys)} FROM conformance_runs WHERE config_key = ?",
+            (config_key,),
+        ).fetchone()
+        return None if row is None else dict(zip(keys, row))
+
+
+def require_conformance(cache_dir, checkstyle_path, xml_path) -> dict:
+    """
+    The ii-conformance record of the native engine, which must agree with Checkstyle
+    on every fixture and on at least `min_agreement` of the sampled methods before
+    the engine computes II
+    """
+    store = IndentationStore(cache_dir)
+    record = store.conformance(store.config_key(checkstyle_path, xml_path, "native"))
+    if record is None:
+        raise ValueError(
+            "The native indentation engine has not been checked against Checkstyle: "
+            "run `calculate.py ii-conformance` first"
+        )
+    if record["fixtures_matched"] != record["fixtures"]:
+        raise ValueError(
+            "The native indentation engine disagrees with Checkstyle on "
+            f"{record['fixtures'] - record['fixtures_matched']}/{record['fixtures']} fixtures"
+        )
+    agreement = record["methods_matched"] / record["methods"] if record["methods"] else 0.0
+    if agreement < record["min_agreement"]:
+        raise ValueError(
+            "The native indentation engine agrees with Checkstyle on "
+            f"{record['methods_matched']}/{record['methods']} sampled methods of "
+            f"{record['project']} ({agreement:.1%} < {record['min_agreement']:.1%})"
+        )
+    return record
+
+
+def _ratio(method: Method, errors) -> tuple[float, list[int]]:
+    violations = [
+        line for line in range(method.start_line, method.end_line + 1) if line in errors
+    ]
+    return len(violations) / method.loc, violations
 
 
 def incorrect_indentation_ratio(
-    method: Method, commit_hash: str, cache_dir, checkstyle_path, xml_path
+    method: Method,
+    commit_hash: str,
+    cache_dir,
+    checkstyle_path,
+    xml_path,
+    engine: str = "checkstyle",
 ) -> float:
-    cache = Path(cache_dir)
-    java_file = cache / commit_hash / f"{method.signature}.java"
-    java_file = shorten(java_file)
-    save_file = cache / commit_hash / f"{method.signature}.txt"
-    save_file = shorten(save_file)
-
-    java_file.parent.mkdir(exist_ok=True, parents=True)
-
-    if not save_file.exists():
-        if not java_file.exists():
-            java_file.write_text(method.code)
-        ck_output = run_checkstyle(java_file, checkstyle_path, xml_path)
-
-        incorrect = sum(
-            1
-            for line in range(method.start_line, method.end_line + 1)
-            if line in ck_output
+    return incorrect_indentation_ratios(
+        [method], commit_hash, cache_dir, checkstyle_path, xml_path, engine
+    )[0]
+
+
+def incorrect_indentation_ratios(
+    methods: list[Method],
+    commit_hash: str,
+    cache_dir,
+    checkstyle_path,
+    xml_path,
+    engine: str = "checkstyle",
+    max_concurrency: int = 4,
+) -> list[float]:
+    """
+    II of several methods of a commit. Stored values are read in bulk, and
+    Checkstyle runs once per distinct source file among the remaining methods.
+    """
+    return run_sync(
+        incorrect_indentation_ratios_async(
+            methods,
+            commit_hash,
+            cache_dir,
+            checkstyle_path,
+            xml_path,
+            engine,
+            CheckstyleScheduler(checkstyle_path, xml_path, max_concurrency),
         )
-        value = incorrect / method.loc
-        save_file.write_text(str(value))
-    else:
-        value = float(save_file.read_text())
+    )
+
+
+async def incorrect_indentation_ratios_async(
+    methods: list[Method],
+    commit_hash: str,
+    cache_dir,
+    checkstyle_path,
+    xml_path,
+    engine: str = "checkstyle",
+    scheduler: Optional["CheckstyleScheduler"] = None,
+) -> list[float]:
+    if engine == "native":
+        require_conformance(cache_dir, checkstyle_path, xml_path)
+        return [
+            _ratio(method, set(native_indentation_errors(method.code)))[0]
+            for method in methods
+        ]
+    elif engine != "checkstyle":
+        raise ValueError(f"Invalid indentation engine: {engine}")
+
+    if scheduler is None:
+        scheduler = CheckstyleScheduler(checkstyle_path, xml_path)
+
+    store = IndentationStore(cache_dir)
+    config_key = store.config_key(checkstyle_path, xml_path, engine)
+    stored = store.load_commit(commit_hash, config_key)
+    keys = [store.method_key(method) for method in methods]
+
+    missing = {}
+    for key, method in zip(keys, methods):
+        if key not in stored:
+            value = store.get(key, config_key)
+            if value is None:
+                missing.setdefault(method.code, []).append((key, method))
+            else:
+                stored[key] = value
+
+    if missing:
+        records = []
+        with TemporaryDirectory() as tmp_dir:
+            java_files = []
+            for i, code in enumerate(missing):
+                java_file = Path(tmp_dir) / f"{i}.java"
+                java_file.write_text(code)
+                java_files.append(java_file)
+            outputs = await asyncio.gather(
+                *[scheduler.run(java_file) for java_file in java_files]
+            )
+        for file_methods, errors in zip(missing.values(), outputs):
+            errors = set(errors)
+            for key, method in file_methods:
+                value, violations = _ratio(method, errors)
+                stored[key] = value
+                records.append((key, config_key, commit_hash, value, violations))
+        store.put_many(records)
+
+    return [stored[key] for key in keys]
+
+
+class CheckstyleScheduler:
+    """
+    Runs Checkstyle processes concurrently, at most `max_concurrency` at a time.
+    """
+
+    def __init__(
+        self,
+        checkstyle_path="checkstyle.jar",
+        xml_path="indentation_config.xml",
+        max_concurrency: int = 4,
+    ) -> None:
+        self.checkstyle_path = checkstyle_path
+        self.xml_path = xml_path
+        self.semaphore = asyncio.Semaphore(max_concurrency)
+
+    async def run(self, java_file: Path) -> list[int]:
+        async with self.semaphore:
+            return await run_checkstyle_async(
+                java_file, self.checkstyle_path, self.xml_path
+            )
 
-    return value
+
+def run_sync(coroutine):
+    """
+    Run a coroutine to completion, also from code already inside an event loop.
+    """
+    try:
+        asyncio.get_running_loop()
+    except RuntimeError:
+        return asyncio.run(coroutine)
+    with ThreadPoolExecutor(max_workers=1) as executor:
+        return executor.submit(asyncio.run, coroutine).result()
+
+
+class CheckstyleError(Exception):
+    """
+    Checkstyle could not run at all (no JVM, no jar or an invalid configuration),
+    as opposed to a failure on one source file
+    """
+
+
+def check_checkstyle(checkstyle_path="checkstyle.jar", xml_path="indentation_config.xml") -> None:
+    """
+    Fail before a run if Checkstyle cannot be started
+    """
+    if shutil.which("java") is None:
+        raise CheckstyleError("java is not on the PATH")
+    for path in (checkstyle_path, xml_path):
+        if not Path(path).is_file():
+            raise CheckstyleError(f"{path} does not exist")
 
 
 def run_checkstyle(
@@ -60,12 +336,288 @@ def run_checkstyle(
         xml_path,
         str(java_file),
     ]
-    result = subprocess.run(command, capture_output=True, text=True)
-    if result.stdout.startswith("Files to process must be specified"):
-        raise Exception("Checkstyle failed to run")
+    try:
+        result = subprocess.run(command, capture_output=True, text=True)
+    except FileNotFoundError as e:
+        raise CheckstyleError("java is not on the PATH") from e
+    return _parse_checkstyle(result.stdout, result.stderr)
+
+
+async def run_checkstyle_async(
+    java_file: Path, checkstyle_path="checkstyle.jar", xml_path="indentation_config.xml"
+) -> list[int]:
+    try:
+        process = await asyncio.create_subprocess_exec(
+            "java",
+            "-jar",
+            checkstyle_path,
+            "-c",
+            xml_path,
+            str(java_file),
+            stdout=asyncio.subprocess.PIPE,
+            stderr=asyncio.subprocess.PIPE,
+        )
+    except FileNotFoundError as e:
+        raise CheckstyleError("java is not on the PATH") from e
+    try:
+        stdout, stderr = await process.communicate()
+    except asyncio.CancelledError:
+        process.kill()
+        await process.wait()
+        raise
+    return _parse_checkstyle(stdout.decode(), stderr.decode())
+
+
+def _parse_checkstyle(stdout: str, stderr: str = "") -> list[int]:
+    # Every audit, even of a file that fails to parse, starts with this line
+    if not stdout.startswith("Starting audit..."):
+        message = (stderr or stdout).strip().splitlines()
+        raise CheckstyleError(
+            f"Checkstyle failed to run: {message[0] if message else 'no output'}"
+        )
 
     errors = [
         int(line.split(".java:")[1].split(":")[0])
-        for line in result.stdout.splitlines()[1:-1]
+        for line in stdout.splitlines()[1:-1]
     ]
     return errors
+
+
+class _Frame:
+    """
+    A brace-delimited region (block, switch body, enum body or array initializer)
+    together with the statement state of the enclosing region to restore on close.
+    """
+
+    def __init__(self, kind: str, base: int, saved: dict = None) -> None:
+        self.kind = kind
+        self.base = base
+        self.level = base + INDENT_SIZE
+        self.saved = saved or {}
+
+
+@lru_cache(maxsize=256)
+def native_indentation_errors(code: str) -> list[int]:
+    """
+    Line numbers violating the Checkstyle Indentation module with its default
+    properties (`indentation_config.xml`), computed over the javalang token stream.
+
+    Statements, braces and case labels must sit exactly at their expected level.
+    Wrapped lines only need to be indented by at least the line wrapping offset,
+    like Checkstyle with `forceStrictCondition=false`. Comments are not checked.
+    """
+    lines = code.split("\n")
+    tokens = list(javalang.tokenizer.tokenize(code))
+
+    frames = [_Frame("block", -INDENT_SIZE)]
+    errors = []
+
+    at_start = True
+    body_pending = False
+    header_next = False
+    label_pending = False
+    enum_pending = False
+    annotation = None
+    extra = 0
+    stmt_indent = 0
+    stmt_expected = 0
+    parens = []
+    last_closed = None
+    line_base = {}
+
+    def indent_of(token) -> int:
+        line = lines[token.position.line - 1]
+        return len(line[: token.position.column - 1].expandtabs(TAB_WIDTH))
+
+    def first_token_of_line(index: int):
+        line = tokens[index].position.line
+        while index > 0 and tokens[index - 1].position.line == line:
+            index -= 1
+        return tokens[index]
+
+    def statement_level(frame: _Frame) -> int:
+        if frame.kind == "switch":
+            return frame.level + INDENT_SIZE
+        return frame.level
+
+    def opens_new_expression(index: int) -> bool:
+        # `new Type<...>(` : walk back over the type to find `new`
+        j = index - 1
+        while j >= 0 and (
+            isinstance(tokens[j], Identifier) or tokens[j].value in {".", "<", ">", ">>", ">>>", ",", "?"}
+        ):
+            j -= 1
+        return j >= 0 and tokens[j].value == "new"
+
+    previous = None
+    for index, token in enumerate(tokens):
+        value = token.value
+        frame = frames[-1]
+        first_on_line = previous is None or token.position.line != previous.position.line
+        actual = indent_of(token)
+
+        if annotation is not None:
+            # @Name(.Name)* ( ... ) ends either after the name or its arguments
+            if annotation == "name" and isinstance(token, Identifier):
+                annotation = "after_name"
+            elif annotation == "after_name" and value == ".":
+                annotation = "name"
+            elif annotation == "after_name" and value == "(":
+                annotation = len(parens)
+            elif annotation == "after_name":
+                annotation = None
+                at_start = True
+            elif annotation == "name" and value == "interface":
+                annotation = None
+
+        is_array = value == "{" and (
+            (previous is not None and previous.value in {"=", "]"})
+            or (frame.kind == "array" and previous is not None and previous.value in {"{", ","})
+            or (parens and previous is not None and previous.value in {"(", ","})
+        )
+
+        role = "continuation"
+        if body_pending and value != "{" and not (value == "(" and previous.value == "try"):
+            role = "start"
+            if first_on_line:
+                extra += INDENT_SIZE
+            body_pending = False
+        elif body_pending and value == "{":
+            # the body of the statement, which may start on a wrapped header line
+            role = "body"
+            body_pending = False
+        elif at_start:
+            role = "start"
+
+        if first_on_line:
+            if frame.kind == "array":
+                expected = frame.base if value == "}" else frame.level
+                if actual < expected:
+                    errors.append(token.position.line)
+                line_base[token.position.line] = actual
+            elif value == "}":
+                if actual != frame.base:
+                    errors.append(token.position.line)
+                line_base[token.position.line] = frame.base
+            elif role == "start" or (value == "{" and not is_array):
+                if role == "start":
+                    if frame.kind == "switch" and value in {"case", "default"}:
+                        expected = frame.level
+                    else:
+                        expected = statement_level(frame) + extra
+                else:
+                    expected = stmt_expected
+                if actual != expected:
+                    errors.append(token.position.line)
+                line_base[token.position.line] = expected
+            else:
+                minimum = stmt_indent + (0 if value in {")", "]"} else INDENT_SIZE)
+                if actual < minimum:
+                    errors.append(token.position.line)
+                line_base[token.position.line] = actual
+
+        if role == "start" and value not in {"}", ";"}:
+            at_start = False
+            stmt_indent = indent_of(first_token_of_line(index))
+            stmt_expected = line_base.get(token.position.line, stmt_indent)
+            label_pending = frame.kind == "switch" and value in {"case", "default"}
+            enum_pending = False
+            if value == "@" and index + 1 < len(tokens) and tokens[index + 1].value != "interface":
+                annotation = "name"
+
+        if value == "enum" and not parens:
+            enum_pending = True
+
+        if header_next and value != "(":
+            header_next = False
+
+        if value in CONTROL_KEYWORDS:
+            header_next = value
+        elif value in BODY_KEYWORDS:
+            body_pending = True
+            if value == "try":
+                header_next = value
+        elif value == "(":
+            parens.append(
+                "header:" + header_next
+                if header_next
+                else ("new" if opens_new_expression(index) else "call")
+            )
+            header_next = False
+        elif value == ")":
+            last_closed = parens.pop() if parens else None
+            if annotation == len(parens):
+                annotation = None
+                at_start = True
+            elif last_closed and last_closed.startswith("header:"):
+                if last_closed == "header:switch":
+                    last_closed = "switch"
+                else:
+                    body_pending = True
+        elif value == "{":
+            saved = {
+                "at_start": False,
+                "stmt_indent": stmt_indent,
+                "stmt_expected": stmt_expected,
+                "parens": parens,
+                "extra": extra,
+            }
+            base = line_base.get(token.position.line, actual)
+            if is_array:
+                frames.append(_Frame("array", base, saved))
+            else:
+                continues = bool(parens) or (
+                    previous is not None
+                    and (previous.value == "->" or (previous.value == ")" and last_closed == "new"))
+                )
+                if not continues:
+                    # declarations and control statements end with their body
+                    saved["at_start"] = True
+                    saved["extra"] = 0
+                    base = stmt_expected
+                if previous is not None and previous.value == ")" and last_closed == "switch":
+                    kind = "switch"
+                elif enum_pending:
+                    kind = "enum"
+                else:
+                    kind = "block"
+                frames.append(_Frame(kind, base, saved))
+                at_start = True
+                extra = 0
+                parens = []
+            last_closed = None
+        elif value == "}":
+            if len(frames) > 1:
+                closed = frames.pop()
+                at_start = closed.saved["at_start"]
+                stmt_indent = closed.saved["stmt_indent"]
+                stmt_expected = closed.saved["stmt_expected"]
+                parens = closed.saved["parens"]
+                extra = closed.saved["extra"]
+                enum_pending = False
+            body_pending = False
+        elif value == ";" and not parens:
+            at_start = True
+            body_pending = False
+            extra = 0
+            if frame.kind == "enum":
+                frame.kind = "block"
+        elif value == "," and not parens and frame.kind == "enum":
+            at_start = True
+        elif value == ":" and not parens:
+            if label_pending:
+                at_start = True
+                label_pending = False
+            elif (
+                previous is not None
+                and isinstance(previous, Identifier)
+                and index >= 2
+                and tokens[index - 2].value in {";", "{", "}", ":"}
+            ):
+                # labeled statement
+                at_start = True
+
+        previous = token
+
+    return sorted(set(errors))
+
@@ -0,0 +1,315 @@
+# Copyright (c) 2024 Hansae Ju
+# Licensed under the Apache License, Version 2.0
+# See the LICENSE file in the project root for license terms.
+
+import math
+import re
+from bisect import bisect_right, insort
+import subprocess
+from pathlib import Path
+from typing import Iterator, Optional
+
+import numpy as np
+import pandas as pd
+
+KAMEI_METRICS = [
+    "NS",
+    "ND",
+    "NF",
+    "Entropy",
+    "LA",
+    "LD",
+    "LT",
+    "AGE",
+    "NUC",
+    "NDEV",
+    "EXP",
+    "REXP",
+    "SEXP",
+]
+
+SECONDS_PER_DAY = 24 * 60 * 60
+DAYS_PER_YEAR = 365
+
+# Columns of the ApacheJIT reference (apache_metrics_kamei.csv) and their metric names
+REFERENCE_COLUMNS = {
+    "ns": "NS",
+    "nd": "ND",
+    "nf": "NF",
+    "ent": "Entropy",
+    "la": "LA",
+    "ld": "LD",
+    "age": "AGE",
+    "nuc": "NUC",
+    "ndev": "NDEV",
+    "aexp": "EXP",
+    "arexp": "REXP",
+    "asexp": "SEXP",
+}
+
+# Marks the start of a commit header in the `git log` stream
+HEADER = "\x00"
+RENAME = re.compile(r"^(.*)\{(.*) => (.*)\}(.*)$")
+
+
+class _FileState:
+    """
+    What the history pass remembers about a file
+    """
+
+    __slots__ = ("lines", "last_time", "last_commit", "authors")
+
+    def __init__(self) -> None:
+        self.lines = 0
+        self.last_time = None
+        self.last_commit = None
+        self.authors = set()
+
+
+class _AuthorState:
+    """
+    What the history pass remembers about an author
+    """
+
+    __slots__ = ("times", "subsystems")
+
+    def __init__(self) -> None:
+        self.times = []
+        self.subsystems = {}
+
+
+class KameiMetrics:
+    """
+    Change metrics of Kamei et al. computed in one chronological pass over the history
+
+    Files and authors keep incremental state, so every commit only costs the files it
+    touches:
+        - NS, ND, NF: modified subsystems (top-level directories), directories and files
+        - Entropy: sum(p * log2(1 / p)) of the modified lines over the modified files
+        - LA, LD, LT: added lines, deleted lines and lines of the modified files before the change
+        - AGE: mean days since the last change of the modified files
+        - NUC: number of unique last changes of the modified files
+        - NDEV: number of developers that changed the modified files before
+        - EXP, REXP, SEXP: prior changes of the author, weighted by 1 / (years ago + 1),
+          and restricted to the modified subsystems
+
+    Known deviations from Kamei et al., who follow the ancestry of each commit:
+        - The history is replayed in `git log --reverse` order, so on branchy histories
+          LT, AGE, NUC and NDEV see the last change of a file on any branch, not the
+          last one reachable from the commit
+        - EXP, REXP and SEXP count every earlier commit of the author in that order,
+          including commits on unmerged branches
+        - Merge commits are skipped, so lines changed while resolving merges are missed
+        - Binary files count as 0 lines, and renames carry over the old file state
+
+    `compare_with_reference` measures how far this lands from the ApacheJIT metrics.
+    """
+
+    def __init__(self, repo_path: str) -> None:
+        self.repo_path = Path(repo_path)
+        self.files = {}
+        self.authors = {}
+        self._author_ids = {}
+
+    def log(self) -> Iterator[str]:
+        process = subprocess.Popen(
+            [
+                "git",
+                "-c",
+                "core.quotepath=off",
+                "log",
+                "--reverse",
+                "--no-merges",
+                "--numstat",
+                "-M",
+                "--format=%x00%H%x1f%at%x1f%ae",
+            ],
+            cwd=self.repo_path,
+            stdout=subprocess.PIPE,
+            text=True,
+            errors="replace",
+        )
+        yield from process.stdout
+        if process.wait() != 0:
+            raise RuntimeError(f"git log failed in {self.repo_path}")
+
+    def commits(self) -> Iterator[tuple[str, int, str, list]]:
+        """
+        (commit hash, author timestamp, author email, [(added, deleted, old path, new path)])
+        """
+        header = None
+        changes = []
+        for line in self.log():
+            line = line.rstrip("\n")
+            if line.startswith(HEADER):
+                if header is not None:
+                    yield (*header, changes)
+                commit_hash, timestamp, email = line[1:].split("\x1f")
+                header = (commit_hash, int(timestamp), email.lower())
+                changes = []
+            elif line:
+                added, deleted, path = line.split("\t", 2)
+                # Binary files have no line counts
+                added = int(added) if added != "-" else 0
+                deleted = int(deleted) if deleted != "-" else 0
+                changes.append((added, deleted, *_rename_paths(path)))
+        if header is not None:
+            yield (*header, changes)
+
+    def _author(self, email: str) -> tuple[int, _AuthorState]:
+        author_id = self._author_ids.setdefault(email, len(self._author_ids))
+        if author_id not in self.authors:
+            self.authors[author_id] = _AuthorState()
+        return author_id, self.authors[author_id]
+
+    def update(
+        self, ordinal: int, timestamp: int, email: str, changes: list
+    ) -> dict:
+        """
+        Metrics of one commit, then fold the commit into the file and author state
+        """
+        author_id, author = self._author(email)
+
+        subsystems = set()
+        directories = set()
+        modified = []
+        la = ld = lt = 0
+        ages = []
+        last_commits = set()
+        developers = set()
+        for added, deleted, old_path, new_path in changes:
+            state = self.files.pop(old_path, None) or _FileState()
+            self.files[new_path] = state
+            modified.append(added + deleted)
+            subsystems.add(_subsystem(new_path))
+            directories.add(str(Path(new_path).parent))
+            la += added
+            ld += deleted
+            lt += state.lines
+            if state.last_time is not None:
+                ages.append(max(timestamp - state.last_time, 0) / SECONDS_PER_DAY)
+                last_commits.add(state.last_commit)
+                developers |= state.authors
+
+        total = sum(modified)
+        entropy = float(
+            sum(lines / total * math.log2(total / lines) for lines in modified if lines)
+        )
+
+        metrics = {
+            "NS": len(subsystems),
+            "ND": len(directories),
+            "NF": len(changes),
+            "Entropy": entropy,
+            "LA": la,
+            "LD": ld,
+            "LT": lt,
+            "AGE": sum(ages) / len(ages) if ages else 0.0,
+            "NUC": len(last_commits),
+            "NDEV": len(developers),
+            "EXP": len(author.times),
+            "REXP": _recent_experience(author.times, timestamp),
+            "SEXP": sum(author.subsystems.get(subsystem, 0) for subsystem in subsystems),
+        }
+
+        for added, deleted, _, new_path in changes:
+            state = self.files[new_path]
+            state.lines = max(state.lines + added - deleted, 0)
+            state.last_time = timestamp
+            state.last_commit = ordinal
+            state.authors.add(author_id)
+        insort(author.times, timestamp)
+        for subsystem in subsystems:
+            author.subsystems[subsystem] = author.subsystems.get(subsystem, 0) + 1
+
+        return metrics
+
+    def all(self, commit_hashes: Optional[set] = None) -> pd.DataFrame:
+        """
+        Metrics of every non-merge commit (or only of `commit_hashes`), indexed by commit_id
+        """
+        rows = []
+        index = []
+        for ordinal, (commit_hash, timestamp, email, changes) in enumerate(
+            self.commits()
+        ):
+            # Every commit updates the state, even if its metrics are not wanted
+            metrics = self.update(ordinal, timestamp, email, changes)
+            if commit_hashes is None or commit_hash in commit_hashes:
+                rows.append(metrics)
+                index.append(commit_hash)
+        return pd.DataFrame(
+            rows, index=pd.Index(index, name="commit_id"), columns=KAMEI_METRICS
+        )
+
+
+def _rename_paths(path: str) -> tuple[str, str]:
+    if " => " not in path:
+        return path, path
+    match = RENAME.match(path)
+    if match:
+        prefix, old, new, suffix = match.groups()
+        old_path = f"{prefix}{old}{suffix}".replace("//", "/")
+        new_path = f"{prefix}{new}{suffix}".replace("//", "/")
+        return old_path, new_path
+    old_path, new_path = path.split(" => ", 1)
+    return old_path, new_path
+
+
+def _recent_experience(times: list, timestamp: int) -> float:
+    """
+    sum(1 / (years ago + 1)) over the sorted change times, one bisect per year
+    """
+    year = SECONDS_PER_DAY * DAYS_PER_YEAR
+    # Changes less than a year ago (or dated later) have weight 1
+    upper = bisect_right(times, timestamp - year)
+    experience = float(len(times) - upper)
+    years = 1
+    while upper > 0:
+        lower = bisect_right(times, timestamp - (years + 1) * year)
+        experience += (upper - lower) / (years + 1)
+        upper = lower
+        years += 1
+    return experience
+
+
+def _subsystem(path: str) -> str:
+    return path.split("/", 1)[0] if "/" in path else ""
+
+
+def compare_with_reference(
+    metrics: pd.DataFrame, reference: pd.DataFrame, rtol: float = 1e-3
+) -> pd.DataFrame:
+    """
+    Agreement of `metrics` with the ApacheJIT `reference` on their common commits
+
+    Both frames are indexed by commit_id, the reference with its own column names.
+    Returns, per metric, the number of commits compared, the share within `rtol`
+    and the median absolute difference.
+    """
+    reference = reference.rename(columns=REFERENCE_COLUMNS)
+    common = metrics.index.intersection(reference.index)
+    rows = []
+    for metric in KAMEI_METRICS:
+        if metric not in reference.columns:
+            continue
+        ours = metrics.loc[common, metric].to_numpy(dtype=float)
+        theirs = reference.loc[common, metric].to_numpy(dtype=float)
+        compared = ~np.isnan(theirs)
+        ours, theirs = ours[compared], theirs[compared]
+        agree = np.isclose(ours, theirs, rtol=rtol, atol=1e-6)
+        rows.append(
+            {
+                "metric": metric,
+                "commits": len(theirs),
+                "agreement": agree.mean() if len(theirs) else np.nan,
+                "median_abs_diff": np.median(np.abs(ours - theirs)) if len(theirs) else np.nan,
+            }
+        )
+    return pd.DataFrame(
+        rows, columns=["metric", "commits", "agreement", "median_abs_diff"]
+    ).set_index("metric")
+
+
+def kamei_metrics(repo_path: str, commit_hashes: Optional[set] = None) -> pd.DataFrame:
+    return KameiMetrics(repo_path).all(commit_hashes)
@@ -2,6 +2,10 @@
 # Licensed under the Apache License, Version 2.0
 # See the LICENSE file in the project root for license terms.
 
+import json
+from pathlib import Path
+from typing import Optional, Union
+
 import pandas as pd
 
 
@@ -60,26 +64,81 @@ class KFoldDateSplit:
 
         return self.data.loc[start_date + start_gap : end_date - end_gap]
 
-    def split(self):
-        data = self.truncate()
-        window_start = data.index.min()
-        end_date = data.index.max()
+    def truncate_positions(self) -> tuple[int, int]:
+        # Positions of truncate() in the sorted index
+        index = self.data.index
+        start_gap = pd.Timedelta(days=30 * self.start_gap)
+        end_gap = pd.Timedelta(days=30 * self.end_gap)
+        start = int(index.searchsorted(index.min() + start_gap, side="left"))
+        stop = int(index.searchsorted(index.max() - end_gap, side="right"))
+        return start, max(start, stop)
+
+    def fold_slices(self) -> list[tuple[slice, slice]]:
+        """
+        (train, test) position slices of every fold into the sorted data
+        """
+        index = self.data.index
+        start, stop = self.truncate_positions()
+        if start == stop:
+            return [(slice(start, start), slice(start, start))] * self.k
+
+        window_start = index[start]
+        end_date = index[stop - 1]
         window_end = end_date - pd.Timedelta(days=30 * self.sliding_months * self.k)
+        folds = []
         for i in range(self.k):
             if i == self.k - 1:
                 window_end = end_date
-            window = data.loc[window_start:window_end]
-            commits_window = len(window)
+            lo = max(start, int(index.searchsorted(window_start, side="left")))
+            hi = min(stop, int(index.searchsorted(window_end, side="right")))
+            hi = max(lo, hi)
+            commits_window = hi - lo
 
             train_samples = round(
                 (commits_window - self.commits_gap) * self.train_ratio
             )
             test_samples = commits_window - train_samples - self.commits_gap
 
-            train = window.iloc[:train_samples]
-            test = window.iloc[-test_samples:]
-
-            yield train, test
+            # Same bounds as window.iloc[:train_samples] and window.iloc[-test_samples:]
+            train = range(*slice(None, train_samples).indices(commits_window))
+            test = range(*slice(-test_samples, None).indices(commits_window))
+            folds.append(
+                (
+                    slice(lo + train.start, lo + train.stop),
+                    slice(lo + test.start, lo + test.stop),
+                )
+            )
 
             window_start += pd.Timedelta(days=30 * self.sliding_months)
             window_end += pd.Timedelta(days=30 * self.sliding_months)
+        return folds
+
+    def split(self, folds: Optional[list[tuple[slice, slice]]] = None):
+        folds = self.fold_slices() if folds is None else folds
+        for train, test in folds:
+            yield self.data.iloc[train], self.data.iloc[test]
+
+    def save_manifest(self, path: Union[str, Path], **meta) -> list[tuple[slice, slice]]:
+        """
+        Persist the fold positions so every run reuses the same folds
+        """
+        folds = self.fold_slices()
+        manifest = {
+            **meta,
+            "rows": len(self.data),
+            "folds": [[t.start, t.stop, s.start, s.stop] for t, s in folds],
+        }
+        path = Path(path)
+        path.parent.mkdir(parents=True, exist_ok=True)
+        with open(path, "w") as f:
+            json.dump(manifest, f, indent=4)
+        return folds
+
+    @staticmethod
+    def load_manifest(path: Union[str, Path]) -> tuple[list[tuple[slice, slice]], dict]:
+        with open(path) as f:
+            manifest = json.load(f)
+        folds = [
+            (slice(a, b), slice(c, d)) for a, b, c, d in manifest.pop("folds")
+        ]
+        return folds, manifest
@@ -0,0 +1,191 @@
+# Copyright (c) 2024 Hansae Ju
+# Licensed under the Apache License, Version 2.0
+# See the LICENSE file in the project root for license terms.
+
+from functools import partial
+
+import pandas as pd
+import pytest
+
+import calculate
+from neurojit.cuf.rii import CheckstyleError
+
+
+class FakeFeatures:
+    """
+    CUF stand-in that counts computed commits and fails after `limit` of them
+    """
+
+    computed = []
+    limit = None
+
+    def __init__(self, commit, *args, **kwargs) -> None:
+        if self.limit is not None and len(self.computed) >= self.limit:
+            raise KeyboardInterrupt
+        self.computed.append(commit)
+
+    @property
+    def V(self):
+        return float(len(self.computed))
+
+
+@pytest.fixture
+def project_dir(tmp_path, monkeypatch):
+    monkeypatch.chdir(tmp_path)
+    commits_dir = tmp_path / "data/dataset/commits"
+    commits_dir.mkdir(parents=True)
+    pd.DataFrame(
+        {
+            "commit_id": [f"c{i}" for i in range(6)],
+            "project": "activemq",
+            "target": ["yes", "no", "yes", "yes", "yes", "yes"],
+        }
+    ).to_csv(commits_dir / "activemq.csv", index=False)
+
+    monkeypatch.setattr(calculate.Mining, "load", lambda base_dir, project, commit_id: commit_id)
+    monkeypatch.setattr(calculate, "CommitUnderstandabilityFeatures", FakeFeatures)
+    monkeypatch.setattr(calculate, "check_checkstyle", lambda checkstyle_path, xml_path: None)
+    monkeypatch.setattr(FakeFeatures, "computed", [])
+    return tmp_path
+
+
+def run_cuf_metrics(save_dir):
+    calculate.cuf_metrics("activemq", ["V"], save_dir=save_dir, quiet=True, checkpoint=1000)
+
+
+def test_cuf_metrics_resumes_after_interrupt(project_dir, monkeypatch):
+    save_dir = project_dir / "data/dataset/cuf"
+
+    monkeypatch.setattr(FakeFeatures, "limit", 2)
+    with pytest.raises(KeyboardInterrupt):
+        run_cuf_metrics(save_dir)
+    assert FakeFeatures.computed == ["c0", "c2"]
+    assert (save_dir / "activemq.journal.jsonl").exists()
+
+    monkeypatch.setattr(FakeFeatures, "limit", None)
+    run_cuf_metrics(save_dir)
+    # journaled commits are not computed again
+    assert FakeFeatures.computed == ["c0", "c2", "c3", "c4", "c5"]
+    assert not (save_dir / "activemq.journal.jsonl").exists()
+
+    result = pd.read_csv(save_dir / "activemq.csv", index_col="commit_id")
+    assert result["V"].to_dict() == {"c0": 1.0, "c2": 2.0, "c3": 3.0, "c4": 4.0, "c5": 5.0}
+
+
+def test_lt_incremental_appends_new_baseline_rows(tmp_path, monkeypatch):
+    monkeypatch.chdir(tmp_path)
+    (tmp_path / "data/cache").mkdir(parents=True)
+    commits = [f"c{i}" for i in range(5)]
+    pd.DataFrame(
+        {
+            "commit_hash": commits[:4],
+            "methods": 1,
+            "LA": 1,
+            "LD": 0,
+            "LT": [10, 20, 30, 40],
+            "method_loc": 5,
+        }
+    ).to_csv(tmp_path / "data/cache/activemq.stats.csv", index=False)
+    baseline = pd.DataFrame(
+        {"commit_id": commits, "project": "activemq", "buggy": False, "LA": range(5)}
+    )
+    baseline_csv = tmp_path / "baseline.csv"
+    save_dir = tmp_path / "baseline"
+
+    baseline.iloc[:3].to_csv(baseline_csv, index=False)
+    calculate.LT("activemq", save_dir=save_dir, baseline_csv=baseline_csv, quiet=True)
+    baseline.to_csv(baseline_csv, index=False)
+    calculate.LT(
+        "activemq", save_dir=save_dir, baseline_csv=baseline_csv, quiet=True, incremental=True
+    )
+    calculate.LT("activemq", save_dir=tmp_path / "full", baseline_csv=baseline_csv, quiet=True)
+
+    result = pd.read_csv(save_dir / "activemq.csv", index_col="commit_id")
+    assert result.equals(pd.read_csv(tmp_path / "full/activemq.csv", index_col="commit_id"))
+    assert result["target"].to_list() == ["done"] * 4 + ["error"]
+    assert result["LT"].to_list()[:4] == [10, 20, 30, 40]
+
+
+class BrokenFeatures:
+    error = None
+
+    def __init__(self, commit, *args, **kwargs) -> None:
+        raise self.error
+
+
+@pytest.mark.parametrize(
+    "error, stops",
+    [(ValueError("bad method"), False), (CheckstyleError("java is not on the PATH"), True)],
+)
+def test_cuf_record_stops_only_on_setup_errors(monkeypatch, error, stops):
+    monkeypatch.setattr(calculate.Mining, "load", lambda base_dir, project, commit_id: commit_id)
+    monkeypatch.setattr(calculate, "CommitUnderstandabilityFeatures", BrokenFeatures)
+    monkeypatch.setattr(BrokenFeatures, "error", error)
+    record = partial(
+        calculate.cuf_record,
+        checkstyle_path="checkstyle.jar",
+        xml_path="indentation_config.xml",
+        checkstyle_cache_dir="data/cache/checkstyle",
+        engine="checkstyle",
+        max_concurrency=1,
+    )
+    if stops:
+        with pytest.raises(CheckstyleError):
+            record(("c0", "activemq"))
+    else:
+        assert record(("c0", "activemq")) == ("c0", {"target": "error"})
+
+
+def test_cuf_all_checks_checkstyle_before_running(tmp_path, monkeypatch):
+    monkeypatch.chdir(tmp_path)
+    with pytest.raises(CheckstyleError):
+        calculate.cuf_all("activemq", save_dir=tmp_path / "cuf", checkstyle_path="missing.jar")
+
+
+class FlakyFeatures:
+    """
+    CUF stand-in failing on the commits listed in `failing`
+    """
+
+    failing = set()
+    computed = []
+
+    def __init__(self, commit, *args, **kwargs) -> None:
+        self.commit = commit
+
+    @property
+    def all(self):
+        if self.commit in self.failing:
+            raise RuntimeError("transient failure")
+        self.computed.append(self.commit)
+        return {"V": 1.0}
+
+
+def test_cuf_all_incremental_retries_errors(tmp_path, monkeypatch):
+    monkeypatch.chdir(tmp_path)
+    commits_csv = tmp_path / "data/dataset/commits/activemq.csv"
+    commits_csv.parent.mkdir(parents=True)
+    commits = pd.DataFrame(
+        {"commit_id": [f"c{i}" for i in range(5)], "project": "activemq", "target": "yes"}
+    )
+    monkeypatch.setattr(calculate.Mining, "load", lambda base_dir, project, commit_id: commit_id)
+    monkeypatch.setattr(calculate, "CommitUnderstandabilityFeatures", FlakyFeatures)
+    monkeypatch.setattr(calculate, "check_checkstyle", lambda checkstyle_path, xml_path: None)
+    monkeypatch.setattr(FlakyFeatures, "computed", [])
+    save_dir = tmp_path / "data/dataset/cuf"
+
+    commits.iloc[:3].to_csv(commits_csv, index=False)
+    monkeypatch.setattr(FlakyFeatures, "failing", {"c1"})
+    calculate.cuf_all("activemq", save_dir=save_dir, quiet=True)
+    result = pd.read_csv(save_dir / "activemq.csv", index_col="commit_id")
+    assert result["target"].to_list() == ["done", "error", "done"]
+
+    commits.to_csv(commits_csv, index=False)
+    monkeypatch.setattr(FlakyFeatures, "failing", set())
+    calculate.cuf_all("activemq", save_dir=save_dir, quiet=True, incremental=True)
+    result = pd.read_csv(save_dir / "activemq.csv", index_col="commit_id")
+    assert result.index.to_list() == ["c0", "c1", "c2", "c3", "c4"]
+    assert result["target"].to_list() == ["done"] * 5
+    assert result["V"].to_list() == [1.0] * 5
+    assert FlakyFeatures.computed == ["c0", "c2", "c1", "c3", "c4"]
+    assert not (save_dir / "activemq.journal.jsonl").exists()
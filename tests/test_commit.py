@@ -0,0 +1,44 @@
+# Copyright (c) 2024 Hansae Ju
+# Licensed under the Apache License, Version 2.0
+# See the LICENSE file in the project root for license terms.
+
+import subprocess
+
+from neurojit.commit import IssueKeyIndex
+
+
+def git(repo, *args) -> str:
+    return subprocess.run(
+        ["git", "-c", "user.email=dev@x", "-c", "user.name=dev", *args],
+        cwd=repo,
+        capture_output=True,
+        text=True,
+        check=True,
+    ).stdout.strip()
+
+
+def commit(repo, message: str) -> str:
+    git(repo, "commit", "-q", "--allow-empty", "-m", message)
+    return git(repo, "rev-parse", "HEAD")
+
+
+def test_issue_keys_of_commits_off_head(tmp_path):
+    repo = tmp_path / "repo" / "camel"
+    repo.mkdir(parents=True)
+    git(repo, "init", "-q", "-b", "main")
+    head = commit(repo, "CAMEL-1: fix")
+    git(repo, "checkout", "-q", "-b", "side")
+    side = commit(repo, "CAMEL-2: feature")
+    git(repo, "checkout", "-q", "-b", "dropped")
+    dropped = commit(repo, "CAMEL-3: dropped")
+    git(repo, "checkout", "-q", "main")
+    git(repo, "branch", "-q", "-D", "dropped")
+
+    index = IssueKeyIndex("camel", str(tmp_path / "repo"), str(tmp_path / "issues"))
+    assert index[head] == "CAMEL-1"
+    # on another branch
+    assert index[side] == "CAMEL-2"
+    # unreachable from any ref, looked up on its own
+    assert dropped not in index
+    assert index[dropped] == "CAMEL-3"
+    assert index["0" * 40] is None
@@ -0,0 +1,37 @@
+# Copyright (c) 2024 Hansae Ju
+# Licensed under the Apache License, Version 2.0
+# See the LICENSE file in the project root for license terms.
+
+import numpy as np
+import pytest
+from cliffs_delta import cliffs_delta
+from scipy.stats import ranksums
+
+from correlation import group_difference, group_differences
+
+
+def test_group_differences_match_ranksums_and_cliffs_delta():
+    rng = np.random.default_rng(0)
+    # integer-valued metrics have many ties
+    x1 = rng.integers(0, 6, size=(40, 3)).astype(float)
+    x2 = rng.integers(1, 8, size=(55, 3)).astype(float)
+    x1[[3, 17], 1] = np.nan
+    x2[[0, 9, 30], 1] = np.nan
+    x1[:, 2] = np.nan
+
+    p_values, deltas = group_differences(x1, x2)
+    for column in range(2):
+        a = x1[~np.isnan(x1[:, column]), column]
+        b = x2[~np.isnan(x2[:, column]), column]
+        assert p_values[column] == pytest.approx(ranksums(a, b).pvalue, rel=1e-12)
+        assert deltas[column] == pytest.approx(cliffs_delta(a, b)[0], rel=1e-12)
+    # no x1 values left to compare
+    assert np.isnan(p_values[2]) and np.isnan(deltas[2])
+
+    p, d = group_differences(x1[:, 1], x2[:, 1])
+    assert (p, d) == (p_values[1], deltas[1])
+
+
+def test_empty_group_is_formatted_as_missing():
+    assert group_difference([np.nan, np.nan], [1.0, 2.0]) == "-"
+    assert group_difference([3.0, 4.0, 5.0], [1.0, 2.0, np.nan]) == "0.083 [l]"
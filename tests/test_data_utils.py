@@ -0,0 +1,132 @@
+# Copyright (c) 2024 Hansae Ju
+# Licensed under the Apache License, Version 2.0
+# See the LICENSE file in the project root for license terms.
+
+import json
+import time
+from datetime import datetime
+
+import numpy as np
+import pandas as pd
+import pytest
+from typer.testing import CliRunner
+
+import data_utils
+
+
+@pytest.fixture
+def apachejit(tmp_path):
+    path = tmp_path / "apachejit_gap.csv"
+    pd.DataFrame(
+        {
+            "commit_id": ["a", "b", "c", "d"],
+            "project": ["camel", "hive", "camel", "camel"],
+            "buggy": [True, False, False, True],
+        }
+    ).to_csv(path, index=False)
+    return path
+
+
+def test_split_commits_keeps_status_of_listed_commits(tmp_path, apachejit):
+    commits_dir = tmp_path / "commits"
+    full = pd.read_csv(apachejit)
+    full.iloc[:3].to_csv(apachejit, index=False)
+    data_utils.split_commits(str(apachejit), commits_dir)
+
+    camel = pd.read_csv(commits_dir / "camel.csv", index_col="commit_id")
+    camel.loc[["a", "c"], "target"] = ["yes", "no"]
+    camel.to_csv(commits_dir / "camel.csv")
+
+    full.to_csv(apachejit, index=False)
+    data_utils.split_commits(str(apachejit), commits_dir)
+    camel = pd.read_csv(commits_dir / "camel.csv", index_col="commit_id")
+    assert camel["target"].to_dict() == {"a": "yes", "c": "no", "d": "not_yet"}
+
+
+def test_filter_commits_fails_on_mining_errors(tmp_path, apachejit, monkeypatch):
+    monkeypatch.chdir(tmp_path)
+    commits_dir = tmp_path / "commits"
+    calls = []
+
+    def only_method_changes(self, repo, commit_hash):
+        if calls:
+            raise RuntimeError("mining failed")
+        calls.append(commit_hash)
+        return None
+
+    monkeypatch.setattr(data_utils.Mining, "only_method_changes", only_method_changes)
+    result = CliRunner().invoke(
+        data_utils.app,
+        ["filter-commits", "camel", "--apachejit", str(apachejit), "--commits-dir", str(commits_dir)],
+    )
+    assert result.exit_code != 0
+    assert isinstance(result.exception, RuntimeError)
+
+    # progress is saved before failing, and only the requested project is split
+    camel = pd.read_csv(commits_dir / "camel.csv", index_col="commit_id")
+    assert camel["target"].to_dict() == {"a": "no", "c": "not_yet", "d": "not_yet"}
+    assert not (commits_dir / "hive.csv").exists()
+
+
+def test_load_results_decodes_store_samples(tmp_path):
+    pytest.importorskip("pyarrow")
+    from results_store import ResultsStore
+
+    tp_samples = [
+        "0123456789abcdef0123456789abcdef01234567",
+        "fedcba9876543210fedcba9876543210fedcba98",
+    ]
+    for features in ["cuf", "baseline"]:
+        scores = [
+            {
+                "project": "camel",
+                "fold": 0,
+                "features": features,
+                "mcc": 0.5,
+                "tp_samples": tp_samples,
+                "pos_samples": tp_samples,
+            }
+        ]
+        with open(tmp_path / f"random_forest_{features}.json", "w") as f:
+            json.dump(scores, f)
+    # only one of the two outputs is in the store
+    store = ResultsStore(tmp_path / "results")
+    store.append("random_forest", [{**scores[0], "features": "cuf"}])
+
+    jsons = [tmp_path / "random_forest_cuf.json", tmp_path / "random_forest_baseline.json"]
+    from_store = data_utils.load_results(jsons, ["tp_samples"], results_dir=tmp_path / "results")
+    from_jsons = data_utils.load_results(jsons, ["tp_samples"])
+    assert from_store["tp_samples"].to_list() == [tp_samples, tp_samples]
+    assert from_jsons["tp_samples"].to_list() == [tp_samples, tp_samples]
+
+
+@pytest.fixture
+def local_zone(request, monkeypatch):
+    monkeypatch.setenv("TZ", request.param)
+    time.tzset()
+    yield request.param
+    monkeypatch.undo()
+    time.tzset()
+
+
+@pytest.mark.parametrize(
+    "local_zone",
+    ["Europe/Moscow", "America/Caracas", "Europe/Istanbul", "America/New_York"],
+    indirect=True,
+)
+def test_commit_dates_follow_local_time_history(local_zone):
+    # Every 17 days from 2004 to 2019, across changes of standard time and DST rules
+    timestamps = np.arange(1_072_915_200, 1_577_836_800, 17 * 24 * 60 * 60 + 3607)
+    apachejit = pd.DataFrame(
+        {
+            "commit_id": [f"{i:040x}" for i in range(len(timestamps))],
+            "project": "apache/camel",
+            "date": timestamps,
+            "fix_date": "2020-01-01T00:00:00Z",
+            "bug_date": None,
+            "year": 2020,
+        }
+    )
+    dates = data_utils.preprocess_apachejit(apachejit)["date"]
+    expected = [datetime.fromtimestamp(int(timestamp)) for timestamp in timestamps]
+    assert dates.to_list() == expected
@@ -0,0 +1,75 @@
+# Copyright (c) 2024 Hansae Ju
+# Licensed under the Apache License, Version 2.0
+# See the LICENSE file in the project root for license terms.
+
+import os
+import subprocess
+
+import pandas as pd
+import pytest
+
+from neurojit.kamei import compare_with_reference, kamei_metrics
+
+DAY = 24 * 60 * 60
+START = 1_300_000_000
+
+
+def commit(repo, days: int, email: str, files: dict) -> str:
+    for path, text in files.items():
+        (repo / path).parent.mkdir(exist_ok=True, parents=True)
+        (repo / path).write_text(text)
+    date = f"@{START + days * DAY} +0000"
+    env = {**os.environ, "GIT_AUTHOR_DATE": date, "GIT_COMMITTER_DATE": date}
+    git = ["git", "-c", f"user.email={email}", "-c", "user.name=dev"]
+    subprocess.run([*git, "add", "-A"], cwd=repo, check=True)
+    subprocess.run([*git, "commit", "-q", "-m", "change"], cwd=repo, env=env, check=True)
+    return subprocess.run(
+        ["git", "rev-parse", "HEAD"], cwd=repo, capture_output=True, text=True, check=True
+    ).stdout.strip()
+
+
+@pytest.fixture
+def linear_repo(tmp_path):
+    repo = tmp_path / "repo"
+    repo.mkdir()
+    subprocess.run(["git", "init", "-q"], cwd=repo, check=True)
+    first = commit(repo, 0, "alice@x", {"a/X.java": "1\n2\n3\n", "b/Y.java": "1\n2\n"})
+    second = commit(repo, 1, "bob@x", {"a/X.java": "1\n2\nthree\n"})
+    third = commit(
+        repo, 2, "alice@x", {"a/X.java": "1\n2\nthree\n4\n5\n", "b/Y.java": "1\n2\n3\n"}
+    )
+    return repo, [first, second, third]
+
+
+def test_linear_history_matches_reference(linear_repo):
+    repo, commits = linear_repo
+    # ApacheJIT columns, worked out by hand from the ancestry of each commit
+    reference = pd.DataFrame(
+        {
+            "commit_id": commits[1:],
+            "ns": [1, 2],
+            "nd": [1, 2],
+            "nf": [1, 2],
+            "ent": [0.0, 0.9183],
+            "la": [1, 3],
+            "ld": [1, 0],
+            "age": [1.0, 1.5],
+            "nuc": [1, 2],
+            "ndev": [1, 2],
+            "aexp": [0, 1],
+            "arexp": [0.0, 1.0],
+            "asexp": [0, 2],
+        }
+    ).set_index("commit_id")
+
+    metrics = kamei_metrics(str(repo), set(commits[1:]))
+    assert metrics["LT"].to_list() == [3, 5]
+
+    agreement = compare_with_reference(metrics, reference)
+    assert agreement["commits"].eq(2).all()
+    assert agreement["agreement"].eq(1.0).all()
+
+    reference.loc[commits[2], "nuc"] = 1
+    agreement = compare_with_reference(metrics, reference)
+    assert agreement.loc["NUC", "agreement"] == 0.5
+    assert agreement.loc["NUC", "median_abs_diff"] == 0.5
@@ -0,0 +1,90 @@
+# Copyright (c) 2024 Hansae Ju
+# Licensed under the Apache License, Version 2.0
+# See the LICENSE file in the project root for license terms.
+
+import os
+import time
+import asyncio
+
+import pytest
+
+from neurojit.cuf.metrics import METRICS, CommitUnderstandabilityFeatures
+from neurojit.cuf.rii import run_checkstyle_async
+
+
+class FakeMethod:
+    """
+    Method features that take `delay` seconds of blocking work, or fail
+    """
+
+    def __init__(self, delay: float = 0.0, fail: bool = False) -> None:
+        self.delay = delay
+        self.fail = fail
+
+    def __getattr__(self, metric):
+        if metric not in METRICS:
+            raise AttributeError(metric)
+        if self.fail:
+            raise RuntimeError("broken method")
+        time.sleep(self.delay)
+        return 1.0
+
+
+def commit_features(methods, ii_async) -> CommitUnderstandabilityFeatures:
+    cuf = CommitUnderstandabilityFeatures.__new__(CommitUnderstandabilityFeatures)
+    cuf.by = "mean"
+    cuf.method_metrics = methods
+    cuf.II_async = ii_async
+    return cuf
+
+
+def test_all_async_overlaps_method_features_with_ii():
+    async def ii_async():
+        # a batch of Checkstyle jobs, each needing the event loop to proceed
+        for _ in range(10):
+            await asyncio.sleep(0.05)
+        return 0.25
+
+    cuf = commit_features([FakeMethod(delay=0.05)], ii_async)
+    start = time.perf_counter()
+    features = asyncio.run(cuf.all_async())
+    # 10 features x 0.05s of blocking work overlap with the 10 x 0.05s of II
+    assert time.perf_counter() - start < 0.8
+    assert features["II"] == 0.25
+    assert features["HV"] == 1.0
+
+
+def test_all_async_cancels_ii_on_failure():
+    state = {}
+
+    async def ii_async():
+        try:
+            await asyncio.sleep(10)
+        except asyncio.CancelledError:
+            state["cancelled"] = True
+            raise
+
+    cuf = commit_features([FakeMethod(fail=True)], ii_async)
+    with pytest.raises(RuntimeError):
+        asyncio.run(cuf.all_async())
+    assert state == {"cancelled": True}
+
+
+def test_cancelled_checkstyle_process_is_killed(tmp_path, monkeypatch):
+    pid_file = tmp_path / "pid"
+    java = tmp_path / "java"
+    java.write_text(f"#!/bin/sh\necho $$ > {pid_file}\nexec sleep 30\n")
+    java.chmod(0o755)
+    monkeypatch.setenv("PATH", f"{tmp_path}{os.pathsep}{os.environ['PATH']}")
+
+    async def cancel_checkstyle():
+        task = asyncio.create_task(run_checkstyle_async(tmp_path / "A.java"))
+        while not pid_file.exists() or not pid_file.read_text().strip():
+            await asyncio.sleep(0.01)
+        task.cancel()
+        with pytest.raises(asyncio.CancelledError):
+            await task
+
+    asyncio.run(cancel_checkstyle())
+    with pytest.raises(ProcessLookupError):
+        os.kill(int(pid_file.read_text()), 0)
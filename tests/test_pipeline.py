@@ -0,0 +1,76 @@
+# Copyright (c) 2024 Hansae Ju
+# Licensed under the Apache License, Version 2.0
+# See the LICENSE file in the project root for license terms.
+
+import sys
+
+import pandas as pd
+from rich.console import Console
+
+from pipeline import Runner, Stage
+
+# Appends a row per input line past the rows already in the output, tagged with argv[3]
+APPEND_ROWS = """
+import sys
+from pathlib import Path
+source, output, tag = Path(sys.argv[1]), Path(sys.argv[2]), sys.argv[3]
+lines = source.read_text().split()
+rows = output.read_text().splitlines() if output.exists() else ["commit_id,target,tag"]
+for line in lines[len(rows) - 1:]:
+    rows.append(f"{line},{'error' if line.startswith('bad') else 'done'},{tag}")
+output.write_text("\\n".join(rows) + "\\n")
+"""
+
+
+def make_stage(tmp_path, tag: str) -> Stage:
+    source, output = tmp_path / "commits.txt", tmp_path / "out.csv"
+    return Stage(
+        "append",
+        [sys.executable, "-c", APPEND_ROWS, str(source), str(output), tag],
+        inputs=[source],
+        outputs=[output],
+        incremental=True,
+        fail_on_errors=True,
+    )
+
+
+def run(tmp_path, tag: str) -> tuple[str, pd.DataFrame]:
+    runner = Runner([make_stage(tmp_path, tag)], tmp_path / "pipeline", Console(quiet=True))
+    status, _ = runner.run(workers=1)["append"]
+    return status, pd.read_csv(tmp_path / "out.csv")
+
+
+def test_incremental_stage_rebuilds_unless_inputs_only_grew(tmp_path):
+    source = tmp_path / "commits.txt"
+    source.write_text("c0\nc1\n")
+    assert run(tmp_path, "v1")[0] == "done"
+    assert run(tmp_path, "v1")[0] == "cached"
+
+    # new input rows are appended to the existing output
+    source.write_text("c0\nc1\nc2\n")
+    status, out = run(tmp_path, "v1")
+    assert status == "done"
+    assert out["tag"].to_list() == ["v1"] * 3
+
+    # another command rebuilds every row
+    status, out = run(tmp_path, "v2")
+    assert status == "done"
+    assert out["tag"].to_list() == ["v2"] * 3
+
+    # so do input rows that were rewritten rather than appended
+    source.write_text("c0\nc9\nc2\nc3\n")
+    (tmp_path / "out.csv").write_text("commit_id,target,tag\nc0,done,v1\n")
+    status, out = run(tmp_path, "v2")
+    assert status == "done"
+    assert out["commit_id"].to_list() == ["c0", "c9", "c2", "c3"]
+    assert out["tag"].to_list() == ["v2"] * 4
+
+
+def test_error_rows_fail_the_stage(tmp_path):
+    source = tmp_path / "commits.txt"
+    source.write_text("c0\nbad1\n")
+    status, out = run(tmp_path, "v1")
+    assert status.startswith("failed")
+    assert out["target"].to_list() == ["done", "error"]
+    # the failed stage is not cached
+    assert run(tmp_path, "v1")[0].startswith("failed")
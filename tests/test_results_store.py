@@ -0,0 +1,59 @@
+# Copyright (c) 2024 Hansae Ju
+# Licensed under the Apache License, Version 2.0
+# See the LICENSE file in the project root for license terms.
+
+import pytest
+
+pytest.importorskip("pyarrow")
+
+from results_store import ResultsStore  # noqa: E402
+
+
+def scores(project: str, fold: int, mcc: float, samples: list) -> list:
+    return [
+        {
+            "project": project,
+            "fold": fold,
+            "features": "cuf",
+            "mcc": mcc,
+            "tp_samples": samples,
+            "pos_samples": samples,
+        }
+    ]
+
+
+def test_appends_are_compacted(tmp_path):
+    store = ResultsStore(tmp_path, max_parts=3)
+    commit_ids = [f"{i:x}".ljust(40, "0") for i in range(7)]
+    for i, commit_id in enumerate(commit_ids):
+        store.append("random_forest", scores("camel", i % 2, float(i), [commit_id]))
+
+    part_dir = tmp_path / "model=random_forest" / "features=cuf"
+    assert len(list(part_dir.glob("part-*.parquet"))) <= 3
+    assert len(list(store.dictionary_dir.glob("part-*.parquet"))) <= 3
+    assert not list(part_dir.glob(".*"))
+
+    # the latest scores of each fold
+    df = store.read(decode=True).sort_values("fold")
+    assert df["mcc"].to_list() == [6.0, 5.0]
+    assert df["tp_samples"].to_list() == [[commit_ids[6]], [commit_ids[5]]]
+
+    store.compact()
+    assert len(list(part_dir.glob("part-*.parquet"))) == 1
+    assert store.read(decode=True).sort_values("fold").equals(df)
+
+
+def test_colliding_commit_codes_raise(tmp_path):
+    store = ResultsStore(tmp_path)
+    first = "0123456789abcde" + "0" * 25
+    second = "0123456789abcde" + "f" * 25
+    store.append("random_forest", scores("camel", 0, 0.5, [first]))
+    # the same commit again is fine
+    store.append("random_forest", scores("camel", 1, 0.5, [first]))
+
+    with pytest.raises(ValueError):
+        store.append("random_forest", scores("camel", 2, 0.5, [second]))
+    with pytest.raises(ValueError):
+        ResultsStore(tmp_path / "other").append(
+            "random_forest", scores("camel", 0, 0.5, [first, second])
+        )
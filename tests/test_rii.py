@@ -0,0 +1,78 @@
+# Copyright (c) 2024 Hansae Ju
+# Licensed under the Apache License, Version 2.0
+# See the LICENSE file in the project root for license terms.
+
+from pathlib import Path
+
+import pytest
+
+from neurojit.cuf.rii import (
+    CheckstyleError,
+    IndentationStore,
+    _parse_checkstyle,
+    native_indentation_errors,
+    require_conformance,
+)
+
+FIXTURES = sorted((Path(__file__).parents[1] / "data/fixtures/indentation").glob("*.java"))
+
+
+def marked_violations(code: str) -> list[int]:
+    return [
+        line
+        for line, text in enumerate(code.split("\n"), start=1)
+        if text.rstrip().endswith("// violation")
+    ]
+
+
+@pytest.mark.parametrize("java_file", FIXTURES, ids=lambda path: path.name)
+def test_native_engine_matches_fixture_markers(java_file):
+    code = java_file.read_text()
+    assert native_indentation_errors(code) == marked_violations(code)
+
+
+def test_wrapped_header_body_is_not_flagged():
+    code = "while (a > 0\n        && b > 0) {\n    a--;\n}\n"
+    assert native_indentation_errors(code) == []
+
+
+@pytest.mark.parametrize(
+    "fixtures, methods, min_agreement, allowed",
+    [
+        ((2, 2), (100, 100), 0.99, True),
+        ((2, 1), (100, 100), 0.99, False),
+        ((2, 2), (100, 98), 0.99, False),
+        ((2, 2), (100, 98), 0.95, True),
+        ((2, 2), (0, 0), 0.99, False),
+    ],
+)
+def test_native_engine_requires_conformance(tmp_path, fixtures, methods, min_agreement, allowed):
+    with pytest.raises(ValueError):
+        require_conformance(tmp_path, "checkstyle.jar", "indentation_config.xml")
+
+    store = IndentationStore(tmp_path)
+    config_key = store.config_key("checkstyle.jar", "indentation_config.xml", "native")
+    store.put_conformance(config_key, "activemq", fixtures, methods, min_agreement)
+    if allowed:
+        require_conformance(tmp_path, "checkstyle.jar", "indentation_config.xml")
+    else:
+        with pytest.raises(ValueError):
+            require_conformance(tmp_path, "checkstyle.jar", "indentation_config.xml")
+
+
+@pytest.mark.parametrize(
+    "stdout, stderr",
+    [
+        ("", "Error: Unable to access jarfile checkstyle.jar"),
+        ("Files to process must be specified, found 0.", ""),
+        ("", ""),
+    ],
+)
+def test_checkstyle_setup_failures_raise(stdout, stderr):
+    with pytest.raises(CheckstyleError):
+        _parse_checkstyle(stdout, stderr)
+
+
+def test_checkstyle_output_is_parsed():
+    stdout = "Starting audit...\n[ERROR] /tmp/0.java:3:9: 'a' has incorrect indentation\nAudit done.\n"
+    assert _parse_checkstyle(stdout) == [3]
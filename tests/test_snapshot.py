@@ -0,0 +1,45 @@
+# Copyright (c) 2024 Hansae Ju
+# Licensed under the Apache License, Version 2.0
+# See the LICENSE file in the project root for license terms.
+
+import numpy as np
+import pandas as pd
+
+from environment import PROJECTS
+from snapshot import DatasetSnapshot
+
+
+def memory_mapped(values: np.ndarray) -> bool:
+    while values is not None:
+        if isinstance(values, np.memmap):
+            return True
+        values = values.base
+    return False
+
+
+def test_snapshot_maps_columns_and_follows_csv_changes(tmp_path):
+    base_dir = tmp_path / "combined"
+    base_dir.mkdir()
+    for i, project in enumerate(PROJECTS):
+        pd.DataFrame(
+            {
+                "commit_id": [f"{project}{j}" for j in range(3)],
+                "project": project,
+                "buggy": [True, False, True],
+                "LA": [i, i + 1, i + 2],
+                "Entropy": [0.5, 0.25, 0.125],
+            }
+        ).to_csv(base_dir / f"{project}.csv", index=False)
+    snapshot = DatasetSnapshot(base_dir, tmp_path / "snapshots")
+
+    data = snapshot.load()
+    assert data.equals(snapshot.load())
+    for column in ["LA", "Entropy"]:
+        assert memory_mapped(data[column].to_numpy())
+    assert memory_mapped(snapshot.load("float32")["LA"].to_numpy())
+
+    version = snapshot.version()
+    csv_path = base_dir / f"{next(iter(PROJECTS))}.csv"
+    csv_path.write_text(csv_path.read_text().replace(",0.5\n", ",0.75\n"))
+    assert snapshot.version() != version
+    assert snapshot.load()["Entropy"].iloc[0] == 0.75